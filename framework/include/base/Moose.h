@@ -100,6 +100,18 @@ extern bool _deprecated_is_error;
  */
 extern bool _throw_on_error;
 
+/**
+ * Variable to turn on exceptions during mooseError() and mooseAssert() only, warnings are
+ * still printed unless they are errors. Used by the application server (--server).
+ */
+extern bool _throw_on_fatal_error;
+
+/**
+ * Incremented to make mooseDoOnce() run its statements again, by the application server
+ * before each request so they run as they would in a process of its own.
+ */
+extern unsigned int _do_once_generation;
+
 /**
  * Macros for coloring any output stream (_console, std::ostringstream, etc.)
  */
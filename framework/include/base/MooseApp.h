@@ -101,6 +101,13 @@ public:
    */
   virtual void run();
 
+  /**
+   * Run the command lines read from standard input one after the other (--server), each in
+   * an application of its own. This saves the TestHarness the start up of a process for
+   * every test that only checks for an error.
+   */
+  void runServer();
+
   /**
    * Setup options based on InputParameters.
    */
@@ -47,7 +47,7 @@
                 << msg                                                              \
                 << (Moose::_color_console ? XTERM_DEFAULT : "")                     \
                 << "\n\n";                                                          \
-    if (Moose::_throw_on_error)                                                     \
+    if (Moose::_throw_on_error || Moose::_throw_on_fatal_error)                     \
       throw std::runtime_error(_error_oss_.str());                                  \
     else                                                                            \
     {                                                                               \
@@ -89,7 +89,7 @@
         << __FILE__ << ", line " << __LINE__                                        \
         << (Moose::_color_console ? XTERM_DEFAULT : "")                             \
         << std::endl;                                                               \
-      if (Moose::_throw_on_error)                                                   \
+      if (Moose::_throw_on_error || Moose::_throw_on_fatal_error)                   \
         throw std::runtime_error(_assert_oss_.str());                               \
       else                                                                          \
       {                                                                             \
@@ -128,7 +128,11 @@
     }                                                                               \
   } while (0)
 
-#define mooseDoOnce(do_this) do { static bool did_this_already = false; if (!did_this_already) { did_this_already = true; do_this; } } while (0)
+/**
+ * Run the statement the first time it is reached, or the first time in each request of an
+ * application server (see Moose::_do_once_generation)
+ */
+#define mooseDoOnce(do_this) do { static unsigned int did_this_already = 0; if (did_this_already != Moose::_do_once_generation) { did_this_already = Moose::_do_once_generation; do_this; } } while (0)
 
 #define mooseInfo(msg)                                                              \
     do                                                                              \
@@ -6,7 +6,9 @@
 
 import os, sys, re, subprocess
 
-def findDepApps(dep_names, use_current_only=False):
+# If searched is a list, every path whose contents affect the result is appended to it
+# so callers can tell when the result may have changed.
+def findDepApps(dep_names, use_current_only=False, searched=None):
   dep_name = dep_names.split('~')[0]
 
   app_dirs = []
@@ -32,6 +34,8 @@ def findDepApps(dep_names, use_current_only=False):
   next_dir = os.getcwd()
   for i in range(4):
     next_dir = os.path.join(next_dir, "..")
+    if searched != None:
+      searched.append(os.path.abspath(os.path.join(next_dir, restrict_file)))
     if os.path.isfile(os.path.join(next_dir, restrict_file)):
       restrict_file_path = os.path.join(next_dir, restrict_file)
       break
@@ -86,6 +90,9 @@ def findDepApps(dep_names, use_current_only=False):
   for dir in unique_dirs:
     startinglevel = dir.count(os.sep)
     for dirpath, dirnames, filenames in os.walk(dir, topdown=True):
+      if searched != None:
+        searched.append(dirpath)
+
       # Don't traverse too deep!
       if dirpath.count(os.sep) - startinglevel >= 2: # 2 levels outta be enough for anybody
         dirnames[:] = []
@@ -110,6 +117,9 @@ def findDepApps(dep_names, use_current_only=False):
 
       potential_makefile = os.path.join(dirpath, 'Makefile')
 
+      if searched != None:
+        searched.append(potential_makefile)
+
       if os.path.isfile(potential_makefile):
         f = open(potential_makefile)
         lines = f.read()
@@ -3,6 +3,7 @@
 import sys, os, shutil
 from socket import gethostname
 from datetime import datetime
+from itertools import groupby
 
 # if it doesn't import this is probably icestorm and we won't use it anyway
 try:
@@ -14,12 +15,15 @@ except:
 ############### Generating html and json data from database ####################
 ################################################################################
 class HTMLGen:
-  def __init__(self, app_name, con):
+  def __init__(self, app_name, con, force=False):
     self.app_name = app_name
     self.con = con
     self.cr = self.con.cursor()
     self.ex = self.cr.execute
 
+    # regenerate the json data of every test, not only of those with new rows
+    self.force = force
+
     # used to find moose resources, assume we are in trunk right now
     self.trunk_dir = '.'
     # the generated html goes here
@@ -27,26 +31,42 @@ class HTMLGen:
     if not os.path.exists(self.base_dir):
       os.mkdir(self.base_dir)
 
+    # databases written by older versions of the TestHarness lack the indexes
+    for index in CREATE_INDEXES:
+      self.ex(index)
+    self.con.commit()
+
   # generates the html and json data for this app
+  #
+  # Only the tests with rows added since the last generation get their json data written
+  # again. The watermark kept next to the generated files is the largest rowid seen then:
+  # rows are committed at the end of a run with the dates of the tests, so a run finishing
+  # after another may add rows older than the newest date. The rows of all of those tests
+  # are read in a single pass ordered by test and date.
   def generateHTML(self):
-    self.ex('select distinct test_name from timing where app_name = ?', (self.app_name,))
+    self.ex('select distinct test_name from timing where app_name = ? order by test_name', (self.app_name,))
     tests = self.cr.fetchall()
     tests = [test[0] for test in tests]
 
     # generate the app.html file containing the checkboxes
     self.generateAppHTML(tests)
 
-    # now generate a json data file for each test
+    base = os.path.join(self.base_dir, self.app_name)
+    watermark = self.readWatermark()
+    self.ex('select max(rowid) from timing where app_name = ?', (self.app_name,))
+    newest = self.cr.fetchone()[0]
+
+    # now generate a json data file for each test that changed
     # each file has three parts, the timing listed by time, timing listed by
     # revision, and other info listed by revision
-    base = os.path.join(self.base_dir, self.app_name)
-    for test in tests:
+    self.ex('select test_name, revision, seconds, date, scale, load from timing where app_name = ? and test_name in ' +
+            '(select distinct test_name from timing where app_name = ? and rowid > ?) order by test_name, date',
+            (self.app_name, self.app_name, watermark))
+    for (test, rows) in groupby(self.cr, lambda row: row[0]):
+      results = [row[1:] for row in rows]
       json = JSON_TEMPLATE.replace('$LABEL$', self.app_name + '.' + test)
 
       # fill out revision vs timing
-      self.ex('select revision, seconds, date, scale, load from timing where app_name = ? and test_name = ? order by date',
-                   (self.app_name,test))
-      results = self.cr.fetchall()
       data = ['["' + str(r[0]) + '", ' + str(r[1]) + ']' for r in results]
       data = '[ ' + ', '.join(data) + ' ]'
       json = json.replace('$REV_DATA$', data)
@@ -57,19 +77,38 @@ class HTMLGen:
       json = json.replace( '$INFO$', data )
 
       # fill out data vs timing
-      # use another select statement because revisions and real dates may not exactly align
-      self.ex('select date, seconds from timing where app_name = ? and test_name = ? order by date',
-                   (self.app_name,test))
-      results = self.cr.fetchall()
-      data = ['[' + str(r[0]*1000) + ', ' + str(r[1]) + ']' for r in results]
+      data = ['[' + str(r[2]*1000) + ', ' + str(r[1]) + ']' for r in results]
       data = '[ ' + ', '.join(data) + ' ]'
       json = json.replace('$TIME_DATA$', data)
 
+      # test names include the directory of the test
       fname = os.path.join(base, test + '.json')
+      if not os.path.exists(os.path.dirname(fname)):
+        os.makedirs(os.path.dirname(fname))
       f = open(fname, 'w')
       f.write(json)
       f.close()
 
+    if newest != None:
+      self.writeWatermark(newest)
+
+  # returns the largest rowid used by the last generation, 0 if everything has to be
+  # generated
+  def readWatermark(self):
+    fname = os.path.join(self.base_dir, self.app_name, WATERMARK_FILE)
+    if self.force or not os.path.exists(fname):
+      return 0
+    f = open(fname)
+    try:
+      return int(f.read().strip() or 0)
+    finally:
+      f.close()
+
+  def writeWatermark(self, rowid):
+    f = open(os.path.join(self.base_dir, self.app_name, WATERMARK_FILE), 'w')
+    f.write(str(rowid) + '\n')
+    f.close()
+
   # generates the app.html file that contains the list of checkboxes
   def generateAppHTML(self, tests):
     tests = [CHECKBOX_TEMPLATE.replace('$TEST$', test) for test in tests]
@@ -99,6 +138,9 @@ JSON_TEMPLATE = """{
 CHECKBOX_TEMPLATE = '<div class="test"><input class="check" type="checkbox" id="$TEST$"></input><label for="$TEST$">$TEST$</label></div>'
 CHECKBOX_END = '\n<br clear="all"/>'
 
+# holds the watermark of an app (a rowid), next to its generated files
+WATERMARK_FILE = '.watermark_rowid'
+
 ################################################################################
 ####################### Database utility functions #############################
 ################################################################################
@@ -107,6 +149,8 @@ def createDB(fname):
   con = sqlite.connect(fname)
   cr = con.cursor()
   cr.execute(CREATE_TABLE)
+  for index in CREATE_INDEXES:
+    cr.execute(index)
   con.commit()
 
 def dumpDB(fname):
@@ -127,14 +171,23 @@ CREATE_TABLE = """create table timing
   date int,
   seconds real,
   scale int,
-  load real
+  load real,
+  peak_rss int,
+  cpu_time real,
+  read_bytes int,
+  write_bytes int
 );"""
 
+CREATE_INDEXES = ['create index if not exists timing_app_test_date on timing (app_name, test_name, date);',
+                  'create index if not exists timing_app_date on timing (app_name, date);']
+
 HELP_STRING = """Usage:
 -h   print this help message
 -c   create database with table timing in ~/timingDB/timing.sqlite
      the database must either not exist or not have a timing table
 -d   dump the contents of table timing
+-f   regenerate the json data of every test, not only of the tests
+     with new data since the last time
 
 [list of applications]  using the data in the database, generate
      json data for every application in the list. Assume db at
@@ -160,9 +213,14 @@ if __name__ == '__main__':
     dumpDB(fname)
     argv.remove('-d')
 
+  force = False
+  if '-f' in argv:
+    force = True
+    argv.remove('-f')
+
   if len(argv) > 0:
     con = sqlite.connect(fname)
     for app in argv:
       print "generating json data for " + app + "."
-      gen = HTMLGen(app, con)
+      gen = HTMLGen(app, con, force)
       gen.generateHTML()
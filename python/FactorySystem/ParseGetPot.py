@@ -90,6 +90,8 @@ class GPNode:
 
 class ParseException(Exception):
   def __init__(self, expr, msg):
+    # Pass the arguments along so the exception can be pickled (e.g. by a process pool)
+    Exception.__init__(self, expr, msg)
     self.expr = expr
     self.msg = msg
 
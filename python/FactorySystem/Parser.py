@@ -35,11 +35,17 @@ class Parser:
     # See Error codes description above for mask calculation
     return 0x3F
 
-  def parse(self, filename):
+  def parse(self, filename, root=None):
     error_code = 0x00
 
+    # The file may have already been read (e.g. in parallel), in which case root is
+    # the resulting tree or the ParseException raised while reading it
     try:
-      self.root = ParseGetPot.readInputFile(filename)
+      if isinstance(root, ParseGetPot.ParseException):
+        raise root
+      elif root == None:
+        root = ParseGetPot.readInputFile(filename)
+      self.root = root
     except ParseGetPot.ParseException, ex:
       print "Parse Error in " + filename + ": " + ex.msg
       return 0x01 # Parse Error
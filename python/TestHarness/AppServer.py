@@ -0,0 +1,189 @@
+import os, re, errno, shlex, tempfile
+from subprocess import Popen, PIPE, STDOUT
+from util import runCommand
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+## The single dash options the application parses itself (see MooseApp::validParams), any other
+# is a PETSc option
+APP_SHORT_OPTIONS = set(['-i', '-h', '-w', '-e', '-o', '-r', '-t'])
+
+## A command line handed to an application server, it stands in for the Popen instance of the job
+#
+# The output of the run is written to a file of its own (output) while the server reports the
+# status of the run on its standard output, which is read without blocking by poll().
+class ServerRequest:
+  def __init__(self, server, dirpath):
+    self.server = server
+    self.dirpath = dirpath
+
+    ## The server process, so the job is killed and sampled like any other
+    self.pid = server.process.pid
+
+    self.returncode = None
+
+    ## Whether the server died before the request was done, the job has to run again on its own
+    self.crashed = False
+
+    self.output = tempfile.NamedTemporaryFile(prefix='app_server_')
+
+  ## Return the file descriptor the status of the request is read from, or None once it is known
+  def fileno(self):
+    if self.returncode != None:
+      return None
+    return self.server.process.stdout.fileno()
+
+  ## Return the status of the request or None if it is not done yet
+  def poll(self):
+    if self.returncode == None:
+      status = self.server.readStatus()
+      if status != None:
+        self.returncode = status
+        self.server.request = None
+      elif not self.server.isAlive():
+        self.returncode = -1
+        self.crashed = True
+    return self.returncode
+
+## A long-lived process of an application running one command line after the other (--server)
+#
+# A server runs a request at a time. Errors in the input are caught by the application, which
+# goes on with the next request, anything worse ends the server.
+class AppServer:
+  def __init__(self, executable):
+    self.process = Popen([executable, '--server'], stdin=PIPE, stdout=PIPE, stderr=STDOUT, close_fds=True, preexec_fn=os.setsid)
+    fd = self.process.stdout.fileno()
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    ## The ServerRequest being run, None when idle
+    self.request = None
+
+    # Status output that does not make up a complete line yet
+    self.buffer = ''
+
+  def isAlive(self):
+    return self.process.poll() == None
+
+  ## Start running the given arguments in dirpath, returns the ServerRequest
+  def submit(self, dirpath, args):
+    self.request = ServerRequest(self, dirpath)
+    try:
+      self.process.stdin.write('\t'.join([dirpath, self.request.output.name] + args) + '\n')
+      self.process.stdin.flush()
+    except IOError:
+      # The server died since it was last used, poll() reports the crash
+      pass
+    return self.request
+
+  ## Return the status of the running request if the server reported it, without blocking
+  #
+  # The server may write other lines to its standard output (the status is preceded by an
+  # empty line so it never shares a line with them), those are skipped.
+  def readStatus(self):
+    while True:
+      while '\n' in self.buffer:
+        (line, self.buffer) = self.buffer.split('\n', 1)
+        try:
+          return int(line)
+        except ValueError:
+          pass
+
+      try:
+        data = os.read(self.process.stdout.fileno(), 4096)
+      except OSError, e:
+        if e.errno in [errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR]:
+          return None
+        raise
+      if data == '':
+        return None
+      self.buffer += data
+
+  ## Ask the server to exit once it is done with the running request
+  def shutdown(self):
+    try:
+      self.process.stdin.close()
+    except IOError:
+      pass
+
+## The application servers of each executable (--app-server)
+#
+# Tests that only check the errors an application reports (see Tester.canRunInServer) spend
+# most of their time starting a process and loading its libraries. They are instead handed
+# to an idle server of their executable, which runs them without starting a process, and a
+# new server is started when all of them are busy. A test that brings down its server runs
+# again in a process of its own, as do tests whose executable has no --server option.
+#
+# PETSc reads its options from the command line of the process, not from the arguments of a
+# request, so tests passing PETSc options (-pc_type, -snes_*, ...) always run on their own.
+class AppServerPool:
+  def __init__(self):
+    ## {executable : [AppServer]}
+    self.servers = {}
+
+    # Whether each executable knows the --server option
+    self.supported = {}
+
+    # Tests that have to run in a process of their own
+    self.excluded = set()
+
+  ## Start running a test in a server, returns the ServerRequest or None if it has to run on its own
+  def submit(self, tester, command, dirpath, options):
+    if not tester.canRunInServer(options) or tester.specs['test_name'] in self.excluded:
+      return None
+
+    # The command line has to run the executable itself, not a launcher like mpiexec
+    executable = tester.specs['executable']
+    try:
+      args = shlex.split(command)
+    except ValueError:
+      return None
+    if len(args) == 0 or args[0] != executable or len([arg for arg in args if '\t' in arg or '\n' in arg]):
+      return None
+    if len([arg for arg in args[1:] if re.match(r'-[A-Za-z_]', arg) and arg not in APP_SHORT_OPTIONS]):
+      return None
+
+    if not self.isSupported(executable):
+      return None
+
+    servers = self.servers.setdefault(executable, [])
+    for server in servers[:]:
+      if not server.isAlive():
+        servers.remove(server)
+      elif server.request == None:
+        return server.submit(dirpath, args[1:])
+
+    server = AppServer(executable)
+    servers.append(server)
+    return server.submit(dirpath, args[1:])
+
+  ## Return whether an executable can run as a server
+  def isSupported(self, executable):
+    if executable not in self.supported:
+      self.supported[executable] = '--server' in runCommand(executable + ' --help')
+    return self.supported[executable]
+
+  ## Run a test that crashed its server in a process of its own from now on
+  def exclude(self, test_name):
+    self.excluded.add(test_name)
+
+  ## Return the file descriptors of the servers running a request
+  def filenos(self):
+    fds = []
+    for servers in self.servers.values():
+      for server in servers:
+        if server.request != None and server.request.fileno() != None:
+          fds.append(server.request.fileno())
+    return fds
+
+  ## Stop all servers
+  def shutdown(self):
+    for servers in self.servers.values():
+      for server in servers:
+        server.shutdown()
+    for servers in self.servers.values():
+      for server in servers:
+        server.process.wait()
+    self.servers = {}
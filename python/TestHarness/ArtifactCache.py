@@ -0,0 +1,209 @@
+import os, re, errno, time, shutil, tempfile, hashlib
+from util import runCommand, loadPickle, dumpPickle
+
+## Bump this when the layout of the stored data changes
+CACHE_VERSION = 1
+
+## The least recently used entries are dropped once the stored files take more than this
+MAX_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+
+## Files modified this many seconds before a test started still count as written by it
+MTIME_SLACK = 2.0
+
+## Return the file_base of the outputs of a test: from its cli_args, the [Outputs] block of its
+# input file or the default (the input file name followed by _out)
+#
+# The checkpoints of a run are written to <file_base>_cp and the outputs of its sub-applications
+# start with the file_base as well.
+def outputFileBase(specs):
+  for arg in specs['cli_args']:
+    m = re.search(r'Outputs/file_base=(\S+)', arg)
+    if m:
+      return m.group(1)
+
+  input_file = specs['input'].strip()
+  try:
+    f = open(os.path.join(specs['test_dir'], input_file))
+    text = f.read()
+    f.close()
+  except IOError:
+    text = ''
+
+  in_outputs = False
+  for line in text.split('\n'):
+    line = line.split('#')[0].strip()
+    if line.startswith('['):
+      # The file_base of the [Outputs] block itself, not of the outputs nested in it
+      in_outputs = line.replace(' ', '') in ['[Outputs]', '[./Outputs]']
+      continue
+    m = re.match(r'file_base\s*=\s*[\'"]?([^\'"\s]+)', line)
+    if in_outputs and m:
+      return m.group(1)
+
+  return os.path.splitext(os.path.basename(input_file))[0] + '_out'
+
+## Return the executable followed by the shared libraries it loads (if ldd knows them)
+def findLinkedFiles(executable):
+  files = [executable]
+  output = runCommand('ldd ' + executable)
+  if not output.startswith('ERROR'):
+    files.extend(sorted(set(re.findall(r'=>\s*(/\S+)', output))))
+  return files
+
+## Output files of earlier runs that later tests can start from, keyed on everything they depend on
+#
+# Used for the first part of recover tests (see TestHarness.appendRecoverableTests): when the
+# executable, the libraries it links to, the input files (and everything they reference) and
+# the command line of part1 are unchanged since an earlier run, the outputs and checkpoints it
+# wrote are copied back into the test directory instead of running it again.
+#
+# The files of each entry are kept in a directory named after its key in the cache directory.
+# Files are copied both ways, the tests are free to modify what was restored.
+class ArtifactCache:
+  def __init__(self, cache_dir, file_digests):
+    self.directory = os.path.join(cache_dir, 'artifacts')
+    self.filename = os.path.join(self.directory, 'index.pickle')
+
+    data = loadPickle(self.filename, {})
+    if data.get('version') != CACHE_VERSION:
+      data = {}
+
+    ## {key : (relative paths, bytes, last used)}
+    self.entries = data.get('entries', {})
+
+    ## The digests of the input files and executables, see util.FileDigests
+    self.file_digests = file_digests
+
+    # Files each executable loads (itself and its shared libraries), found once per run
+    self.linked = {}
+
+    # Keys dropped during this run, so they are not merged back in by save()
+    self.discarded = set()
+
+  ## Return the key of the outputs of a command run with the given input files and executable
+  def computeKey(self, command, files, executable):
+    h = hashlib.md5(command)
+    for path in sorted(files) + self.linkedFiles(executable):
+      h.update('\0' + path + '\0' + str(self.file_digests.digest(path)))
+    return h.hexdigest()
+
+  ## Return the executable followed by the shared libraries it loads, see findLinkedFiles
+  def linkedFiles(self, executable):
+    if executable not in self.linked:
+      self.linked[executable] = findLinkedFiles(executable)
+    return self.linked[executable]
+
+  ## Return the files (relative to test_dir) starting with file_base, including those in the
+  # directories starting with it, that were modified after the given time
+  def collect(self, test_dir, file_base, since):
+    directory = os.path.join(test_dir, os.path.dirname(file_base))
+    prefix = os.path.basename(file_base)
+    try:
+      entries = os.listdir(directory)
+    except OSError:
+      return []
+
+    paths = []
+    for entry in entries:
+      if not entry.startswith(prefix):
+        continue
+      path = os.path.join(directory, entry)
+      if os.path.isdir(path):
+        for (dirpath, dirnames, filenames) in os.walk(path):
+          paths.extend([os.path.join(dirpath, filename) for filename in filenames])
+      else:
+        paths.append(path)
+
+    files = []
+    for path in paths:
+      try:
+        if os.path.getmtime(path) >= since - MTIME_SLACK:
+          files.append(os.path.relpath(path, test_dir))
+      except OSError:
+        pass
+    return sorted(files)
+
+  ## Copy files (relative to test_dir) into the cache under key
+  def store(self, key, test_dir, files):
+    if len(files) == 0:
+      return
+
+    try:
+      os.makedirs(self.directory)
+    except OSError, ex:
+      if ex.errno != errno.EEXIST:
+        raise
+
+    # The files are copied to a temporary directory which is then renamed into place, so
+    # concurrent runs sharing the cache never see a partial entry
+    tmp_dir = tempfile.mkdtemp(dir=self.directory, prefix='.' + key)
+    size = 0
+    try:
+      for path in files:
+        target = os.path.join(tmp_dir, path)
+        if not os.path.isdir(os.path.dirname(target)):
+          os.makedirs(os.path.dirname(target))
+        shutil.copy2(os.path.join(test_dir, path), target)
+        size += os.path.getsize(target)
+
+      entry_dir = os.path.join(self.directory, key)
+      if os.path.exists(entry_dir):
+        shutil.rmtree(entry_dir, True)
+      os.rename(tmp_dir, entry_dir)
+    except (IOError, OSError), ex:
+      print 'Warning: unable to store the output of a test in ' + self.directory + ': ' + str(ex)
+      shutil.rmtree(tmp_dir, True)
+      return
+
+    self.entries[key] = (files, size, time.time())
+    self.discarded.discard(key)
+
+  ## Copy the files stored under key back into test_dir, returns False if there are none
+  def restore(self, key, test_dir):
+    if key not in self.entries:
+      return False
+
+    (files, size, last_used) = self.entries[key]
+    entry_dir = os.path.join(self.directory, key)
+    try:
+      for path in files:
+        target = os.path.join(test_dir, path)
+        if not os.path.isdir(os.path.dirname(target)):
+          os.makedirs(os.path.dirname(target))
+        shutil.copy2(os.path.join(entry_dir, path), target)
+    except (IOError, OSError):
+      # Removed behind our back, the test has to run after all
+      self.discard(key)
+      return False
+
+    self.entries[key] = (files, size, time.time())
+    return True
+
+  ## Forget the files stored under key
+  def discard(self, key):
+    if key in self.entries:
+      del self.entries[key]
+    self.discarded.add(key)
+    shutil.rmtree(os.path.join(self.directory, key), True)
+
+  ## Write the index back to the cache directory, dropping the least recently used entries
+  # beyond MAX_CACHE_BYTES
+  #
+  # Entries stored by concurrent runs since this one started are kept.
+  def save(self):
+    data = loadPickle(self.filename, {})
+    if data.get('version') == CACHE_VERSION:
+      for (key, entry) in data['entries'].iteritems():
+        if key not in self.entries and key not in self.discarded and os.path.isdir(os.path.join(self.directory, key)):
+          self.entries[key] = entry
+
+    total = 0
+    for key in sorted(self.entries, key=lambda key: self.entries[key][2], reverse=True):
+      total += self.entries[key][1]
+      if total > MAX_CACHE_BYTES:
+        self.discard(key)
+
+    try:
+      dumpPickle(self.filename, {'version' : CACHE_VERSION, 'entries' : self.entries})
+    except (IOError, OSError), ex:
+      print 'Warning: unable to write the artifact cache index ' + self.filename + ': ' + str(ex)
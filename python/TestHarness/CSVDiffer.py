@@ -1,5 +1,13 @@
 import os, re, math
 
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+## Number of rows converted and compared at a time by the NumPy diff
+CHUNK_ROWS = 100000
+
 class CSVDiffer:
   def __init__(self, test_dir, out_files, abs_zero=1e-11, relative_error=5.5e-6):
     self.abs_zero = float(abs_zero)
@@ -45,6 +53,10 @@ class CSVDiffer:
   def diff(self):
 
     for fname, text1, text2 in self.files:
+      # Well formed files are compared column by column with NumPy when it is available
+      if numpy != None and self.diffArrays(fname, text1, text2):
+        continue
+
       # use this value to skip the rest of the tests when we've found an error
       # the order of the tests is most general to most specific, so if a general
       # one fails then the more specific ones will probably not only fail, but
@@ -112,6 +124,144 @@ class CSVDiffer:
 
     return self.msg
 
+  # split text into its header names and rows, or return None if the file is not
+  # well formed (the errors are then reported by convertToTable)
+  def splitText(self, text):
+    # ignore newlines
+    text = re.sub( r'\n\s*\n', '\n', text).strip()
+
+    lines = text.split('\n')
+    headers = lines.pop(0).split(',')
+
+    # Duplicate header names merge columns in convertToTable
+    if len(set(headers)) != len(headers):
+      return None
+
+    commas = len(headers) - 1
+    for row in lines:
+      if row.count(',') != commas:
+        return None
+
+    return (headers, lines)
+
+  # convert rows of text to a two dimensional array, strings are converted to zero
+  def convertToArray(self, rows, num_cols):
+    values = ','.join(rows).split(',')
+    try:
+      array = numpy.array(values, dtype=float)
+    except ValueError:
+      array = numpy.array([self.convertValue(val) for val in values], dtype=float)
+    return array.reshape(len(rows), num_cols)
+
+  def convertValue(self, val):
+    try:
+      return float(val)
+    except:
+      # ignore strings
+      return 0
+
+  # diff two files with NumPy, this reports exactly the same errors as the loop in diff()
+  #
+  # The rows are converted and compared CHUNK_ROWS at a time so very large files never
+  # have to be held as arrays all at once. Returns False if the files could not be
+  # handled here, nothing will have been reported in that case.
+  def diffArrays(self, fname, text1, text2):
+    split1 = self.splitText(text1)
+    split2 = self.splitText(text2)
+    if split1 == None or split2 == None:
+      return False
+    (headers1, rows1) = split1
+    (headers2, rows2) = split2
+
+    # Build the tables the same way convertToTable does so the columns are visited in
+    # the same order
+    table1 = {}
+    table2 = {}
+    for i, header in enumerate(headers1):
+      table1[header] = i
+    for i, header in enumerate(headers2):
+      table2[header] = i
+
+    # Make sure header names are the same (also makes sure # cols is the same)
+    foundError = False
+    keys1 = table1.keys()
+    keys2 = table2.keys()
+    (large,small) = (keys1,keys2)
+    if len(keys1) < len(keys2):
+      (large,small) = (keys2,keys1)
+    for key in large:
+      if key not in small:
+        self.addError(fname, "Header '" + key + "' is missing" )
+        foundError = True
+    if foundError:
+      return True
+
+    # now check that each column is the same length (every column has one value per row)
+    if len(rows1) != len(rows2):
+      if len(keys1):
+        self.addError(fname, "Columns with header '" + keys1[0] + "' aren't the same length")
+      return True
+
+    # The errors of each column, columns that are found to differ are not checked any further
+    errors = dict([(key, []) for key in keys1])
+    done = set()
+    for start in xrange(0, len(rows1), CHUNK_ROWS):
+      array1 = self.convertToArray(rows1[start:start+CHUNK_ROWS], len(headers1))
+      array2 = self.convertToArray(rows2[start:start+CHUNK_ROWS], len(headers2))
+      for key in keys1:
+        if key in done:
+          continue
+        if self.diffColumn(fname, key, array1[:,table1[key]], array2[:,table2[key]], errors[key]):
+          done.add(key)
+
+    for key in keys1:
+      for message in errors[key]:
+        self.addError(fname, message)
+    return True
+
+  # compare a chunk of one column, appending the error messages to errors. Returns True
+  # if the values differ, in which case the rest of the column should not be checked.
+  def diffColumn(self, fname, key, column1, column2, errors):
+    abs_zero = self.abs_zero
+    rel_tol = self.rel_tol
+
+    old_settings = numpy.seterr(all='ignore')
+    try:
+      # adjust to the absolute zero
+      val1 = numpy.where(numpy.abs(column1) < abs_zero, 0.0, column1)
+      val2 = numpy.where(numpy.abs(column2) < abs_zero, 0.0, column2)
+
+      # NaN and Inf never count as a difference (their relative difference is NaN)
+      largest = numpy.maximum(numpy.abs(val1), numpy.abs(val2))
+      rel_diff = numpy.abs((val1 - val2) / numpy.where(largest > 0, largest, 1.0))
+      mismatch = numpy.flatnonzero((largest > 0) & (rel_diff > rel_tol))
+    finally:
+      numpy.seterr(**old_settings)
+
+    # Only the values up to the first mismatch are checked for NaN and Inf
+    end = len(column1)
+    if len(mismatch):
+      end = mismatch[0] + 1
+
+    # disallow nan and inf in the gold file
+    for i in numpy.flatnonzero(~numpy.isfinite(column1[:end])):
+      if math.isnan(column1[i]):
+        errors.append("The values in column \"" + key.strip() + "\" contain NaN")
+      else:
+        errors.append("The values in column \"" + key.strip() + "\" contain Inf")
+
+    if len(mismatch) == 0:
+      return False
+
+    # Report the difference exactly as the loop in diff() does
+    (val1, val2) = (float(column1[end-1]), float(column2[end-1]))
+    if abs(val1) < abs_zero:
+      val1 = 0
+    if abs(val2) < abs_zero:
+      val2 = 0
+    rel_diff = abs( ( val1 - val2 ) / max( abs(val1), abs(val2) ) )
+    errors.append("The values in column \"" + key.strip() + "\" don't match\n\trel diff:  " + str(val1) + " ~ " + str(val2) + " = " + str(rel_diff))
+    return True
 
   # convert text to a map of column names to column values
   def convertToTable(self, fname, text):
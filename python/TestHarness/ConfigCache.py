@@ -0,0 +1,47 @@
+import os
+from util import loadPickle, dumpPickle, getFileStamps
+
+## Bump this when the layout of the cached data changes
+CACHE_VERSION = 1
+
+## A persistent cache of the results of probing the build configuration
+#
+# Probing libMesh, libtool and git for the configuration checks runs several
+# external commands on every start up. Each probe returns its result along with
+# the paths the result was derived from, and the result is reused on later runs
+# for as long as the modification times and sizes of those paths are unchanged.
+class ConfigCache:
+  def __init__(self, cache_dir):
+    self.filename = os.path.join(cache_dir, 'config_checks.pickle')
+    self.modified = False
+
+    data = loadPickle(self.filename, {})
+    if data.get('version') == CACHE_VERSION:
+      self.entries = data['entries']
+    else:
+      self.entries = {}
+
+  ## Return the cached result of a probe, running it if the result is missing or stale
+  #
+  # probe is called without arguments and must return a tuple (result, paths).
+  def get(self, key, probe):
+    if key in self.entries:
+      (stamps, result) = self.entries[key]
+      if getFileStamps([stamp[0] for stamp in stamps]) == stamps:
+        return result
+
+    (result, paths) = probe()
+    self.entries[key] = (getFileStamps(paths), result)
+    self.modified = True
+    return result
+
+  ## Write the cache back to disk if anything changed
+  def save(self):
+    if not self.modified:
+      return
+
+    try:
+      dumpPickle(self.filename, {'version' : CACHE_VERSION, 'entries' : self.entries})
+    except (IOError, OSError), ex:
+      print 'Warning: unable to write the configuration cache ' + self.filename + ': ' + str(ex)
+    self.modified = False
@@ -0,0 +1,123 @@
+import os, re
+from util import runCommand, loadPickle, dumpPickle, getParameterFiles
+
+## Bump this when the layout of the stored data changes
+INDEX_VERSION = 1
+
+## Return the absolute paths of the files changed since a git revision, or None if git fails
+#
+# Committed and uncommitted changes to tracked files count, as do untracked files.
+def changedFiles(revision, directory):
+  top = runCommand('git rev-parse --show-toplevel', cwd=directory)
+  diff = runCommand("git diff --name-only '" + revision.replace("'", '') + "' --", cwd=directory)
+  untracked = runCommand('git ls-files --others --exclude-standard --full-name', cwd=directory)
+  for output in [top, diff, untracked]:
+    if output.startswith('ERROR'):
+      print output.strip()
+      return None
+
+  top = top.strip()
+  return set([os.path.join(top, path) for path in (diff + untracked).split('\n') if path.strip() != ''])
+
+## The files each test depends on, used by --since to select the tests affected by a change
+#
+# The dependencies of a test are its spec file, the files named by its parameters (the
+# input file, gold files, custom_cmp files, ...), its depend_files and everything the
+# input files reference in turn: !include files, meshes, data files and the inputs of
+# sub-applications. Input files are scanned for any value naming an existing file
+# relative to them, so no knowledge of the MOOSE syntax is needed.
+#
+# The references found in each scanned file are kept in the cache directory keyed on
+# its modification time and size, so only files that were touched are scanned again.
+class DependencyIndex:
+  def __init__(self, cache_dir=None):
+    self.filename = None
+    self.modified = False
+
+    ## {path : (mtime, size, [referenced paths])}
+    self.references = {}
+
+    if cache_dir != None:
+      self.filename = os.path.join(cache_dir, 'dependency_index.pickle')
+      data = loadPickle(self.filename, {})
+      if data.get('version') == INDEX_VERSION:
+        self.references = data['references']
+
+  ## Return the set of files a test depends on
+  def getDependencies(self, specs, spec_file):
+    files = getParameterFiles(specs)
+    files.add(os.path.abspath(spec_file))
+
+    # Follow the references of the input files
+    stack = [path for path in files if path.endswith('.i')]
+    while len(stack):
+      for path in self.getReferences(stack.pop()):
+        if path not in files:
+          files.add(path)
+          if path.endswith('.i'):
+            stack.append(path)
+
+    return files
+
+  ## Return the files referenced by an input file
+  def getReferences(self, path):
+    try:
+      stat = os.stat(path)
+    except OSError:
+      return []
+
+    if path in self.references:
+      (mtime, size, references) = self.references[path]
+      if (stat.st_mtime, stat.st_size) == (mtime, size):
+        return references
+
+    references = self.scanInputFile(path)
+    self.references[path] = (stat.st_mtime, stat.st_size, references)
+    self.modified = True
+    return references
+
+  ## Return the existing files named in an input file
+  def scanInputFile(self, path):
+    directory = os.path.dirname(path)
+    try:
+      f = open(path)
+      text = f.read()
+      f.close()
+    except IOError:
+      return []
+
+    references = set()
+    for line in text.split('\n'):
+      line = line.split('#')[0]
+      m = re.match(r'\s*!include\s+(\S+)', line)
+      if m:
+        tokens = [m.group(1)]
+      elif '=' in line:
+        tokens = re.split(r'[\s\'"]+', line.split('=', 1)[1])
+      else:
+        # Continuation of a quoted value spanning several lines
+        tokens = re.split(r'[\s\'"]+', line)
+
+      for token in tokens:
+        if ('.' in token or '/' in token) and '${' not in token:
+          candidate = os.path.join(directory, token)
+          if os.path.isfile(candidate):
+            references.add(os.path.abspath(candidate))
+
+    references.discard(os.path.abspath(path))
+    return sorted(references)
+
+  ## Write the scanned references back to the cache directory
+  def save(self):
+    if self.filename == None or not self.modified:
+      return
+
+    for path in self.references.keys():
+      if not os.path.exists(path):
+        del self.references[path]
+
+    try:
+      dumpPickle(self.filename, {'version' : INDEX_VERSION, 'references' : self.references})
+    except (IOError, OSError), ex:
+      print 'Warning: unable to write the dependency index ' + self.filename + ': ' + str(ex)
+    self.modified = False
@@ -0,0 +1,338 @@
+import re, threading
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# netCDF4 reads every flavor of Exodus file, scipy only the classic (netCDF-3) formats
+try:
+  import netCDF4
+except ImportError:
+  netCDF4 = None
+
+try:
+  from scipy.io import netcdf as scipy_netcdf
+except ImportError:
+  scipy_netcdf = None
+
+## The netCDF and HDF5 libraries are not thread safe, the files are compared one at a time
+# when the output of several tests is checked at once (see PostProcessPool)
+NETCDF_LOCK = threading.Lock()
+
+## Return True if Exodus files can be compared in process
+def available():
+  return numpy != None and (netCDF4 != None or scipy_netcdf != None)
+
+## Raised for anything the in process differ does not handle the way exodiff does
+class ExodusDifferError(Exception):
+  pass
+
+## An exodiff tolerance: type is one of 'relative', 'absolute', 'combined' or 'ignore'
+class Tolerance:
+  def __init__(self, type, value, floor):
+    self.type = type
+    self.value = value
+    self.floor = floor
+
+  def copy(self):
+    return Tolerance(self.type, self.value, self.floor)
+
+  ## Return a boolean array, True where the values differ (see Tolerance::Diff in exodiff)
+  #
+  # NaN always counts as a difference so that exodiff gets to report it.
+  def diff(self, v1, v2, use_old_floor):
+    if self.type == 'ignore':
+      return numpy.zeros(v1.shape, dtype=bool)
+
+    delta = numpy.abs(v1 - v2)
+    largest = numpy.maximum(numpy.abs(v1), numpy.abs(v2))
+
+    if self.type == 'relative':
+      ok = delta <= self.value * largest
+    elif self.type == 'absolute':
+      ok = delta <= self.value
+    else:
+      ok = delta < numpy.maximum(largest, 1.0) * self.value
+
+    if use_old_floor:
+      ok |= delta < self.floor
+    else:
+      ok |= (numpy.abs(v1) <= self.floor) & (numpy.abs(v2) <= self.floor)
+
+    return ~ok
+
+## Compare two Exodus files in process
+#
+# This is a fast path in front of the exodiff executable, it can only prove that two
+# files are the same. Every netCDF variable in the files is compared: the coordinates,
+# times and global, nodal, element, nodeset and sideset variables with the same
+# tolerances exodiff would use (from abs_zero, rel_err and the custom_cmp file) and
+# everything else (connectivity, maps, names, ...) exactly. Elements are compared in
+# file order, which is what exodiff's geometric mapping arrives at when the
+# connectivity is identical. Whenever the files are not shown to be the same, or they
+# use something not handled here, diff() returns False and exodiff has the final say.
+class ExodusDiffer:
+
+  ## netCDF variables that differ between any two runs
+  IGNORED_VARIABLES = set(['qa_records', 'info_records'])
+
+  def __init__(self, gold_file, test_file, abs_zero=1e-10, rel_err=5.5e-6, custom_cmp=None, use_old_floor=False):
+    self.gold_file = gold_file
+    self.test_file = test_file
+    self.use_old_floor = use_old_floor
+    self.msg = ''
+
+    # Tolerances as exodiff sets them up from -t and -F, keyed on the kind of variable
+    default = Tolerance('relative', float(rel_err), float(abs_zero))
+    self.tolerances = {}
+    for kind in ['time', 'global', 'nodal', 'element', 'nodeset', 'sideset', 'attribute']:
+      self.tolerances[kind] = default.copy()
+    self.tolerances['coordinates'] = Tolerance('absolute', 1.0e-6, 0.0)
+
+    # Per variable tolerances from the custom_cmp file keyed on (kind, name)
+    self.variable_tolerances = {}
+
+    self.error = None
+    if custom_cmp != None:
+      try:
+        self.parseCommandFile(custom_cmp, default)
+      except (IOError, ExodusDifferError), ex:
+        self.error = str(ex)
+
+  ## Return True if the files are known to be the same, self.msg describes why not otherwise
+  def diff(self):
+    if self.error != None:
+      self.msg = self.error
+      return False
+
+    NETCDF_LOCK.acquire()
+    try:
+      gold = self.openFile(self.gold_file)
+      try:
+        test = self.openFile(self.test_file)
+        try:
+          difference = self.compareFiles(gold, test)
+        finally:
+          test.close()
+      finally:
+        gold.close()
+    except Exception, ex:
+      # Unreadable or unsupported file formats are left to exodiff
+      self.msg = 'Unable to read ' + str(ex)
+      return False
+    finally:
+      NETCDF_LOCK.release()
+
+    if difference != None:
+      self.msg = difference
+      return False
+    return True
+
+  def openFile(self, filename):
+    if netCDF4 != None:
+      dataset = netCDF4.Dataset(filename, 'r')
+      dataset.set_auto_mask(False)
+      return dataset
+    return scipy_netcdf.netcdf_file(filename, 'r', mmap=True)
+
+  ## Return a description of the first difference found, or None if the files are the same
+  #
+  # Nothing here raises so that no references to the (memory mapped) data outlive the files.
+  def compareFiles(self, gold, test):
+    gold_names = set(gold.variables.keys()) - self.IGNORED_VARIABLES
+    test_names = set(test.variables.keys()) - self.IGNORED_VARIABLES
+    if gold_names != test_names:
+      return 'The files do not contain the same data: ' + ', '.join(sorted(gold_names ^ test_names))
+
+    # The variable names are needed to look up the tolerance of each result variable
+    names = {}
+    for (kind, name_variable) in [('global', 'name_glo_var'), ('nodal', 'name_nod_var'), ('element', 'name_elem_var'),
+                                  ('nodeset', 'name_nset_var'), ('sideset', 'name_sset_var')]:
+      if name_variable in gold_names:
+        names[kind] = self.readNames(gold.variables[name_variable])
+
+    for name in sorted(gold_names):
+      gold_data = gold.variables[name][:]
+      test_data = test.variables[name][:]
+
+      if gold_data.dtype.kind in 'SU':
+        if self.readNames(gold.variables[name]) != self.readNames(test.variables[name]):
+          return 'The values of ' + name + ' differ'
+        continue
+
+      if gold_data.shape != test_data.shape:
+        return 'The shape of ' + name + ' differs'
+
+      if gold_data.dtype.kind != 'f':
+        if not numpy.array_equal(gold_data, test_data):
+          return 'The values of ' + name + ' differ'
+        continue
+
+      if name == 'vals_nod_var':
+        # Old style nodal variables hold every variable in one array
+        return 'Unsupported layout of the nodal variables'
+
+      if not self.compareValues(name, names, gold_data, test_data):
+        return 'The values of ' + name + ' differ'
+
+    return None
+
+  ## Return True if the floating point values of one netCDF variable are the same
+  def compareValues(self, name, names, gold_data, test_data):
+    gold_data = numpy.asarray(gold_data, dtype=float)
+    test_data = numpy.asarray(test_data, dtype=float)
+
+    # The tolerance of every column (last index) of the data, None means exact
+    if name == 'time_whole':
+      tolerances = [self.tolerances['time']]
+    elif name in ['coordx', 'coordy', 'coordz', 'coord']:
+      tolerances = [self.tolerances['coordinates']]
+    elif name == 'vals_glo_var':
+      tolerances = [self.variableTolerance('global', names, i) for i in xrange(gold_data.shape[-1])]
+    else:
+      tolerances = [self.resultTolerance(name, names)]
+
+    old_settings = numpy.seterr(all='ignore')
+    try:
+      for i, tolerance in enumerate(tolerances):
+        if len(tolerances) == 1:
+          (v1, v2) = (gold_data, test_data)
+        else:
+          (v1, v2) = (gold_data[..., i], test_data[..., i])
+
+        if tolerance == None:
+          different = ~(v1 == v2)
+        else:
+          different = tolerance.diff(v1, v2, self.use_old_floor)
+
+        if different.any():
+          return False
+    finally:
+      numpy.seterr(**old_settings)
+    return True
+
+  ## Return the tolerance used for a result variable stored in its own netCDF variable
+  def resultTolerance(self, name, names):
+    for (kind, pattern) in [('nodal', r'vals_nod_var(\d+)$'), ('element', r'vals_elem_var(\d+)eb\d+$'),
+                            ('nodeset', r'vals_nset_var(\d+)ns\d+$'), ('sideset', r'vals_sset_var(\d+)ss\d+$')]:
+      m = re.match(pattern, name)
+      if m:
+        return self.variableTolerance(kind, names, int(m.group(1)) - 1)
+
+    if re.match(r'attrib\d+$', name):
+      return self.tolerances['attribute']
+
+    # Anything else (distribution factors, ...) has to match exactly
+    return None
+
+  def variableTolerance(self, kind, names, index):
+    if kind in names and index < len(names[kind]):
+      key = (kind, names[kind][index])
+      if key in self.variable_tolerances:
+        return self.variable_tolerances[key]
+    return self.tolerances[kind]
+
+  ## Decode a netCDF character array into a list of strings
+  def readNames(self, variable):
+    data = numpy.asarray(variable[:])
+    if data.ndim == 1:
+      data = data.reshape(1, -1)
+    return [''.join([str(c) for c in row]).rstrip('\0 ') for row in data]
+
+  ## Read the tolerances from an exodiff command file
+  #
+  # Only the sections that set tolerances are understood, anything else raises an
+  # ExodusDifferError so that exodiff is used for the comparison.
+  def parseCommandFile(self, filename, default):
+    sections = [('coordinates', ['coor'], 'coordinates'),
+                ('time steps', ['time', 'step'], 'time'),
+                ('global variables', ['glob', 'var'], 'global'),
+                ('nodal variables', ['noda', 'var'], 'nodal'),
+                ('element variables', ['elem', 'var'], 'element'),
+                ('nodeset variables', ['nodeset', 'var'], 'nodeset'),
+                ('sideset variables', ['side', 'var'], 'sideset'),
+                ('element attributes', ['elem', 'att'], 'attribute')]
+
+    f = open(filename)
+    lines = f.read().split('\n')
+    f.close()
+
+    default = default.copy()
+    default_specified = False
+
+    kind = None
+    for line in lines:
+      is_variable = line.startswith('\t')
+      tokens = line.split('#')[0].replace('=', ' ').replace(',', ' ').split()
+      if len(tokens) == 0:
+        continue
+
+      if is_variable and kind not in [None, 'coordinates', 'time']:
+        name = tokens.pop(0)
+        if name.startswith('!'):
+          # Excluded variables are compared anyway, with the default tolerance
+          continue
+        tolerance = self.tolerances[kind].copy()
+        self.parseTolerance(tokens, tolerance, line)
+        self.variable_tolerances[(kind, name)] = tolerance
+        continue
+
+      kind = None
+      words = [token.lower() for token in tokens]
+
+      # The default tolerance applies to the sections that follow it
+      if len(words) >= 2 and abbreviation(words[0], 'default', 3) and abbreviation(words[1], 'tolerance', 3):
+        self.parseTolerance(tokens[2:], default, line)
+        default_specified = True
+        continue
+
+      for (section, abbreviations, section_kind) in sections:
+        full = section.split()
+        if all([i < len(words) and abbreviation(words[i], full[i], len(abbreviations[i])) \
+                for i in range(len(abbreviations))]):
+          kind = section_kind
+          tokens = tokens[len(abbreviations):]
+          break
+
+      if kind == None:
+        raise ExodusDifferError('Unsupported custom_cmp command: ' + line.strip())
+
+      if kind == 'coordinates' and not default_specified:
+        tolerance = Tolerance('absolute', 1.0e-6, 0.0)
+      else:
+        tolerance = default.copy()
+      if len(tokens) and tokens[0].lower() in ['all', '(all)']:
+        tokens.pop(0)
+      self.parseTolerance(tokens, tolerance, line)
+      self.tolerances[kind] = tolerance
+
+  ## Parse "[type value] [floor value]" into tolerance
+  def parseTolerance(self, tokens, tolerance, line):
+    tokens = list(tokens)
+    try:
+      if len(tokens):
+        for (type, keyword) in [('relative', 'relative'), ('absolute', 'absolute'), ('combined', 'combine'), ('ignore', 'ignore')]:
+          if abbreviation(tokens[0], keyword, 3):
+            tokens.pop(0)
+            tolerance.type = type
+            if type == 'ignore':
+              tolerance.value = 0.0
+            break
+
+        if len(tokens) and not abbreviation(tokens[0], 'floor', 3) and tolerance.type != 'ignore':
+          tolerance.value = float(tokens.pop(0))
+
+      if len(tokens) >= 2 and abbreviation(tokens[0], 'floor', 3):
+        tolerance.floor = float(tokens[1])
+        tokens = tokens[2:]
+    except ValueError:
+      raise ExodusDifferError('Unsupported custom_cmp command: ' + line.strip())
+
+    if len(tokens):
+      raise ExodusDifferError('Unsupported custom_cmp command: ' + line.strip())
+
+## Return True if token is an abbreviation of keyword at least minimum characters long (as exodiff does)
+def abbreviation(token, keyword, minimum):
+  token = token.lower()
+  return len(token) >= minimum and keyword.startswith(token)
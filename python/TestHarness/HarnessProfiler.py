@@ -0,0 +1,174 @@
+import inspect, threading
+from timeit import default_timer as clock
+from Parser import Parser
+
+## The methods of the TestHarness timed by the profiler
+HARNESS_METHODS = ['discoverTests', 'findSpecFiles', 'readSpecFiles', 'augmentParameters', 'appendRecoverableTests',
+                   'selectTests', 'restoreRecoverOutput', 'storeRecoverOutput', 'reportTestResult',
+                   'handleTestResult', 'cleanup']
+
+## The methods of the runner (RunParallel or RunDistributed) timed by the profiler
+RUNNER_METHODS = ['join', 'buildGraph', 'startReadyJobs', 'launch', 'returnToTestHarness', 'collectResults']
+
+## The methods of every Tester timed by the profiler
+TESTER_METHODS = ['checkRunnableBase', 'getCommand', 'prepare', 'processResults']
+
+## Finds out where the time of the TestHarness itself goes (--profile-harness)
+#
+# The methods doing the work of the harness are replaced by wrappers that time every call.
+# Nothing is replaced unless profiling was asked for, so there is no overhead otherwise.
+#
+# The instrumented calls nest into stacks (one per thread) that are written at exit as
+# collapsed stacks: one line per stack with its self time in microseconds, the input of
+# flamegraph.pl and speedscope. Time on the main thread that is not spent in any of the
+# instrumented methods is attributed to the root frame. A summary table adds up the time
+# of each phase (method) and of each type of Tester, counting nested calls of the same
+# phase once.
+class HarnessProfiler:
+  ROOT = 'run_tests'
+
+  def __init__(self, start_time):
+    self.start_time = start_time
+    self.lock = threading.Lock()
+    self.local = threading.local()
+
+    # Methods already replaced, keyed on (class, name)
+    self.wrapped = set()
+
+    ## Self time keyed on the stack, a tuple of frame names
+    self.stacks = {}
+
+    ## [calls, seconds] keyed on the phase and on the type of Tester
+    self.phases = {}
+    self.tester_types = {}
+
+    # Time spent on the main thread in the outermost instrumented calls
+    self.covered = 0.0
+
+  ## Replace the methods of the harness, its runner and every Tester class with timed ones
+  def instrument(self, harness, tester_classes):
+    for name in HARNESS_METHODS:
+      self.wrapInstance(harness, name)
+    for name in RUNNER_METHODS:
+      self.wrapInstance(harness.runner, name)
+    if getattr(harness.runner, 'child_watcher', None) != None:
+      self.wrapInstance(harness.runner.child_watcher, 'wait', 'RunParallel.wait')
+
+    # Building the testers from the parsed specification files
+    self.wrapClass(Parser, 'parse', 'Parser.parse', False)
+
+    for tester_class in tester_classes:
+      for owner in inspect.getmro(tester_class):
+        for name in TESTER_METHODS:
+          if name in owner.__dict__:
+            self.wrapClass(owner, name, 'Tester.' + name, True)
+
+  ## Replace a method of a class (once)
+  def wrapClass(self, owner, name, phase, tester_method):
+    if (owner, name) not in self.wrapped:
+      self.wrapped.add((owner, name))
+      setattr(owner, name, self.timed(owner.__dict__[name], owner.__name__ + '.' + name, phase, tester_method))
+
+  ## Replace a method of one object
+  def wrapInstance(self, instance, name, frame=None):
+    method = getattr(instance, name, None)
+    if method == None:
+      return
+    if frame == None:
+      frame = instance.__class__.__name__ + '.' + name
+    setattr(instance, name, self.timed(method, frame, frame, False))
+
+  ## Return a function timing the calls of function
+  #
+  # frame names the calls in the stacks and phase in the summary. For the methods of
+  # Testers the first argument is the tester and its type is recorded as well.
+  def timed(self, function, frame, phase, tester_method):
+    profiler = self
+    def wrapper(*args, **kwargs):
+      tester_type = None
+      if tester_method:
+        tester_type = args[0].__class__.__name__
+      profiler.enter(frame, phase)
+      start = clock()
+      try:
+        return function(*args, **kwargs)
+      finally:
+        profiler.leave(tester_type, clock() - start)
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__ = function.__doc__
+    return wrapper
+
+  ## Return the stack of the calling thread as a list of [frame, phase, seconds of the calls made from it]
+  def getStack(self):
+    stack = getattr(self.local, 'stack', None)
+    if stack == None:
+      thread = threading.current_thread()
+      if isinstance(thread, threading._MainThread):
+        root = self.ROOT
+      else:
+        root = self.ROOT + ';' + thread.name
+      stack = self.local.stack = [[root, None, 0.0]]
+    return stack
+
+  def enter(self, frame, phase):
+    self.getStack().append([frame, phase, 0.0])
+
+  def leave(self, tester_type, seconds):
+    stack = self.getStack()
+    (frame, phase, child_seconds) = stack.pop()
+    stack[-1][2] += seconds
+
+    key = tuple([entry[0] for entry in stack] + [frame])
+    # The same phase further up the stack already counts this time
+    outermost = phase not in [entry[1] for entry in stack]
+
+    self.lock.acquire()
+    try:
+      self.stacks[key] = self.stacks.get(key, 0.0) + max(seconds - child_seconds, 0.0)
+      if outermost:
+        self.add(self.phases, phase, seconds)
+        if tester_type != None:
+          self.add(self.tester_types, tester_type, seconds)
+      if len(stack) == 1 and stack[0][0] == self.ROOT:
+        self.covered += seconds
+    finally:
+      self.lock.release()
+
+  def add(self, totals, key, seconds):
+    if key not in totals:
+      totals[key] = [0, 0.0]
+    totals[key][0] += 1
+    totals[key][1] += seconds
+
+  ## Write the collapsed stacks to filename and print the summary
+  def finish(self, filename):
+    total = clock() - self.start_time
+    stacks = dict(self.stacks)
+    stacks[(self.ROOT,)] = stacks.get((self.ROOT,), 0.0) + max(total - self.covered, 0.0)
+
+    try:
+      f = open(filename, 'w')
+      try:
+        for key in sorted(stacks.keys()):
+          microseconds = int(round(stacks[key] * 1e6))
+          if microseconds > 0:
+            f.write('%s %d\n' % (';'.join(key), microseconds))
+      finally:
+        f.close()
+    except IOError, ex:
+      print 'Warning: unable to write the harness profile ' + filename + ': ' + str(ex)
+
+    print '\nTestHarness profile (%.2f seconds, collapsed stacks written to %s):' % (total, filename)
+    self.printTable('Phase', self.phases, total)
+    self.printTable('Tester type', self.tester_types, total)
+
+  def printTable(self, title, totals, total):
+    if len(totals) == 0:
+      return
+    width = max([len(title)] + [len(key) for key in totals.keys()])
+    print '\n  %-*s %8s %10s %7s' % (width, title, 'Calls', 'Seconds', 'Share')
+    for (key, (calls, seconds)) in sorted(totals.items(), key=lambda item: item[1][1], reverse=True):
+      share = 0.0
+      if total > 0:
+        share = 100.0 * seconds / total
+      print '  %-*s %8d %10.3f %6.1f%%' % (width, key, calls, seconds, share)
@@ -0,0 +1,195 @@
+import heapq
+
+## A dependency graph of all of the jobs in a test run
+#
+# Jobs are keyed on their test name and an edge runs from each prereq to the jobs
+# that depend on it. The graph is completed before anything is launched so invalid
+# and cyclic dependencies are found up front, and ready jobs are handed out in order
+# of the longest remaining chain of work (the critical path) that starts with them.
+class JobDAG:
+  def __init__(self):
+    ## Jobs as [tester, command, dirpath] lists keyed on test name
+    self.jobs = {}
+
+    ## Test names in the order they were added, used to break ties deterministically
+    self.order = {}
+
+    ## Names of the unfinished prereqs of each job
+    self.prereqs = {}
+
+    ## Names of the jobs that depend on each job
+    self.dependents = {}
+
+    ## Length of the longest chain of work starting at each job
+    self.priority = {}
+
+    ## Heap of (-priority, order, name) for jobs whose prereqs have all finished
+    self.ready = []
+
+    ## Names of the jobs that were added more than once, reported by build()
+    self.duplicates = []
+
+  ## Add a job to the graph. Edges are not created until build() is called.
+  #
+  # A job with the name of a job already in the graph is not added, see build().
+  def addJob(self, tester, command, dirpath):
+    name = tester.specs['test_name']
+    if name in self.jobs:
+      if name not in self.duplicates:
+        self.duplicates.append(name)
+      return
+    self.order[name] = len(self.order)
+    self.jobs[name] = [tester, command, dirpath]
+    self.prereqs[name] = set()
+    self.dependents[name] = set()
+
+  def getJob(self, name):
+    return self.jobs[name]
+
+  ## Return True if there are jobs that have not been handed out or removed
+  def hasJobs(self):
+    return len(self.jobs) != 0
+
+  ## Return the groups of jobs connected through their prereqs as lists of test names
+  #
+  # The groups and the names in them are in the order the jobs were added.
+  def connectedJobs(self):
+    # Union-find keyed on test name, each group is represented by its earliest job
+    parent = dict([(name, name) for name in self.jobs])
+    def find(name):
+      while parent[name] != name:
+        parent[name] = parent[parent[name]]
+        name = parent[name]
+      return name
+
+    for name in self.jobs:
+      for prereq in self.jobs[name][0].specs['prereq'] or []:
+        if prereq in self.jobs:
+          (a, b) = (find(name), find(prereq))
+          if a != b:
+            (a, b) = sorted([a, b], key=lambda name: self.order[name])
+            parent[b] = a
+
+    groups = {}
+    for name in sorted(self.jobs, key=lambda name: self.order[name]):
+      groups.setdefault(find(name), []).append(name)
+    return sorted(groups.values(), key=lambda group: self.order[group[0]])
+
+  ## Drop jobs from the graph before it is built
+  def discardJobs(self, names):
+    for name in names:
+      del self.jobs[name]
+      del self.prereqs[name]
+      del self.dependents[name]
+
+  ## Connect every job to its prereqs
+  #
+  # Prereqs that name a job that will never run (listed in skipped) do not become
+  # edges, the jobs depending on them are returned so they can be skipped as well.
+  # Prereqs that do not need to run (listed in finished) are satisfied already.
+  # When ignore_prereqs is True no edges are created at all (PBS handles ordering).
+  #
+  # Returns a tuple of lists of test names (skipped_dependency, invalid, cyclic, duplicate)
+  def build(self, skipped, ignore_prereqs=False, finished=set()):
+    skipped_dependency = []
+    invalid = []
+
+    for name in self.jobs:
+      tester = self.jobs[name][0]
+      if ignore_prereqs or tester.specs['prereq'] == None:
+        continue
+      for prereq in tester.specs['prereq']:
+        if prereq in self.jobs:
+          self.prereqs[name].add(prereq)
+          self.dependents[prereq].add(name)
+        elif prereq in finished:
+          continue
+        elif prereq in skipped:
+          if name not in skipped_dependency:
+            skipped_dependency.append(name)
+        elif name not in invalid:
+          invalid.append(name)
+
+    # Kahn's algorithm: anything that is never freed of its prereqs is on a cycle
+    # (or depends on one)
+    topological = []
+    remaining = dict([(name, len(self.prereqs[name])) for name in self.jobs])
+    stack = [name for name in self.jobs if remaining[name] == 0]
+    while len(stack):
+      name = stack.pop()
+      topological.append(name)
+      for dependent in self.dependents[name]:
+        remaining[dependent] -= 1
+        if remaining[dependent] == 0:
+          stack.append(dependent)
+
+    cyclic = [job for job in self.jobs if remaining[job] != 0]
+    cyclic.sort(key=lambda name: self.order[name])
+    skipped_dependency.sort(key=lambda name: self.order[name])
+    invalid.sort(key=lambda name: self.order[name])
+
+    self.topological = topological
+    return (skipped_dependency, invalid, cyclic, self.duplicates)
+
+  ## Compute the critical path priority of each job
+  #
+  # weight is called with a tester and returns the expected runtime of that job.
+  # Must be called after build() and before any job is handed out.
+  def computePriorities(self, weight):
+    self.topological = [name for name in self.topological if name in self.jobs]
+    for name in reversed(self.topological):
+      longest = 0.0
+      for dependent in self.dependents[name]:
+        if dependent in self.priority:
+          longest = max(longest, self.priority[dependent])
+      self.priority[name] = weight(self.jobs[name][0]) + longest
+
+    for name in self.topological:
+      if len(self.prereqs[name]) == 0:
+        self.pushReady(name)
+
+  def pushReady(self, name):
+    heapq.heappush(self.ready, (-self.priority[name], self.order[name], name))
+
+  ## Pop the highest priority ready job, or None when no job is ready
+  def popReady(self):
+    if len(self.ready) == 0:
+      return None
+    name = heapq.heappop(self.ready)[2]
+    return self.jobs.pop(name)
+
+  ## Return a job popped with popReady() that could not be launched yet
+  def pushBack(self, job):
+    name = job[0].specs['test_name']
+    self.jobs[name] = job
+    self.pushReady(name)
+
+  ## Record that a job finished successfully, returning the names of the jobs it freed
+  def jobFinished(self, name):
+    freed = []
+    for dependent in self.dependents.get(name, set()):
+      self.prereqs[dependent].discard(name)
+      if len(self.prereqs[dependent]) == 0 and dependent in self.jobs:
+        self.pushReady(dependent)
+        freed.append(dependent)
+    return freed
+
+  ## Remove a job that will not run along with everything that depends on it
+  def removeJob(self, name):
+    return [self.jobs.pop(name)] + self.jobSkipped(name)
+
+  ## Record that a job failed or was skipped
+  #
+  # Every job that depends on it, directly or not, is removed from the graph and
+  # returned (in the order they were added) so it can be reported as skipped.
+  def jobSkipped(self, name):
+    removed = []
+    stack = list(self.dependents.get(name, set()))
+    while len(stack):
+      dependent = stack.pop()
+      if dependent not in self.jobs:
+        continue
+      removed.append(self.jobs.pop(dependent))
+      stack.extend(self.dependents[dependent])
+    removed.sort(key=lambda job: self.order[job[0].specs['test_name']])
+    return removed
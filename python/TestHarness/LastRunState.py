@@ -0,0 +1,122 @@
+import os, hashlib
+from util import loadPickle, dumpPickle, getParameterFiles
+
+## Bump this when the layout of the stored data changes
+STATE_VERSION = 1
+
+## Parameters that are filled in while the tests run and do not describe the test itself
+VOLATILE_PARAMETERS = set(['caveats', 'hostname'])
+
+## The outcome of the last run of every test, used by --failed and --changed
+#
+# For each test the status of its last result is kept along with a fingerprint of what it
+# ran: the parameters from its block in the spec file and the contents of the files those
+# parameters name (the input file, gold files, custom_cmp files, ...), see getParameterFiles.
+#
+# A spec file is recorded as unchanged once every test in it has a result with the current
+# fingerprint. As long as neither the spec file nor any of the files its tests use change
+# after that, --changed does not need to parse it at all.
+#
+# File contents are hashed once per (mtime, size) of the file (see util.FileDigests), so
+# only files that were touched since the last run are read again.
+class LastRunState:
+  def __init__(self, cache_dir, file_digests):
+    self.filename = os.path.join(cache_dir, 'last_run.pickle')
+
+    data = loadPickle(self.filename, {})
+    if data.get('version') != STATE_VERSION:
+      data = {}
+
+    ## {test_name : (status, fingerprint, spec_file)}
+    self.tests = data.get('tests', {})
+
+    ## {spec_file : {path : digest}} of the spec file and the files used by its tests, for unchanged spec files
+    self.spec_files = data.get('spec_files', {})
+
+    ## The digests of the files used by the tests, see util.FileDigests
+    self.file_digests = file_digests
+
+    # Fingerprints of the tests found in this run keyed on test name, and the test
+    # names found in each spec file read in this run
+    self.fingerprints = {}
+    self.found = {}
+
+  ## Return the spec files containing tests that failed the last time they ran
+  def failedSpecFiles(self):
+    spec_files = set()
+    for (status, fingerprint, spec_file) in self.tests.itervalues():
+      if status == 'FAILED':
+        spec_files.add(spec_file)
+    return spec_files
+
+  ## Return whether a spec file and all of the files used by the tests in it are unchanged
+  def specFileUnchanged(self, spec_file):
+    if spec_file not in self.spec_files:
+      return False
+    for (path, digest) in self.spec_files[spec_file].iteritems():
+      if self.file_digests.digest(path) != digest:
+        return False
+    return True
+
+  ## Remember the tests found in a spec file and compute their fingerprints
+  def addTests(self, spec_file, testers):
+    self.found[spec_file] = [tester.specs['test_name'] for tester in testers]
+    for tester in testers:
+      self.fingerprints[tester.specs['test_name']] = self.fingerprint(tester.specs, spec_file)
+
+  def isFailed(self, test_name):
+    return test_name in self.tests and self.tests[test_name][0] == 'FAILED'
+
+  ## Return whether a test was changed since its last result (or never had one)
+  def isChanged(self, test_name):
+    if test_name not in self.tests:
+      return True
+    return self.tests[test_name][1] != self.fingerprints.get(test_name)[0]
+
+  ## Record the status of a finished test
+  def record(self, test_name, status):
+    if test_name not in self.fingerprints:
+      return
+    (fingerprint, files, spec_file) = self.fingerprints[test_name]
+    self.tests[test_name] = (status, fingerprint, spec_file)
+
+  ## Return the tuple (fingerprint, files, spec_file) of a test from its parameters
+  def fingerprint(self, specs, spec_file):
+    parameters = []
+    for name in sorted(specs.valid_keys()):
+      # Parameters starting with an underscore hold the objects used to build the tester
+      if name in VOLATILE_PARAMETERS or name.startswith('_'):
+        continue
+      parameters.append((name, repr(specs[name])))
+
+    files = getParameterFiles(specs)
+    h = hashlib.md5(repr(parameters))
+    files = sorted(files)
+    for path in files:
+      h.update(path + '\0' + str(self.file_digests.digest(path)))
+    return (h.hexdigest(), files, spec_file)
+
+  ## Write the state back to disk
+  #
+  # Spec files read in this run are recorded as unchanged if every test in them has a result
+  # for its current fingerprint, and forgotten otherwise so they are read again next time.
+  def save(self):
+    for (spec_file, names) in self.found.iteritems():
+      files = set()
+      complete = True
+      for name in names:
+        (fingerprint, test_files, test_spec_file) = self.fingerprints[name]
+        files.update(test_files)
+        if name not in self.tests or self.tests[name][1] != fingerprint:
+          complete = False
+      if complete:
+        files.add(spec_file)
+        self.spec_files[spec_file] = dict([(path, self.file_digests.digest(path)) for path in files])
+      elif spec_file in self.spec_files:
+        del self.spec_files[spec_file]
+
+    try:
+      dumpPickle(self.filename, {'version' : STATE_VERSION, 'tests' : self.tests,
+                                 'spec_files' : self.spec_files})
+    except (IOError, OSError), ex:
+      print 'Warning: unable to write the last run state ' + self.filename + ': ' + str(ex)
@@ -0,0 +1,115 @@
+import os
+from ResourceUsage import readSessionRSS, formatKB
+
+## Memory kept free for everything else on the machine, as a fraction of the total
+MEMORY_HEADROOM = 0.05
+
+## Hold jobs back while tasks stall on memory more than this percentage of the time
+MEMORY_PRESSURE_LIMIT = 10.0
+
+## Decides whether the machine has room for another job
+#
+# Rounds of launching jobs start with a snapshot of the machine (see startRound):
+#  - The pressure stall information of Linux (/proc/pressure/cpu and memory), the share
+#    of time tasks were waiting on the CPU or memory over the last 10 seconds. Unlike the
+#    load average this reacts within seconds. The CPU pressure is only checked when a
+#    limit is given (--max-pressure), otherwise or without it the load average is used.
+#  - The memory available (/proc/meminfo) minus the growth the running jobs are still
+#    expected to go through: the difference between their peak memory use in earlier runs
+#    and what they use right now (read from /proc for the whole process session).
+#
+# Jobs are then only admitted while their expected peak memory fits in what is left, each
+# admitted job using up its share of the projection. Anything that can not be read counts
+# as no information, never as a reason to hold a job back.
+class LoadGovernor:
+  def __init__(self, average_load=64.0, max_pressure=None):
+    self.average_load = average_load
+    self.max_pressure = max_pressure
+
+    ## KB of memory the jobs started in this round may still use, None if unknown
+    self.projected = None
+
+    ## The reason to hold back every job in this round (the machine is overloaded), or None
+    self.overloaded = None
+
+  ## Take a snapshot of the machine before launching jobs
+  #
+  # running is a list of (session id, expected peak memory in KB or None) for the running jobs.
+  def startRound(self, running):
+    self.overloaded = None
+    cpu = None
+    if self.max_pressure != None:
+      cpu = self.readPressure('cpu')
+    memory = self.readPressure('memory')
+    if cpu != None:
+      if cpu >= self.max_pressure:
+        self.overloaded = 'CPU pressure %.1f%% >= %.1f%%' % (cpu, self.max_pressure)
+    else:
+      load = self.readLoadAverage()
+      if load != None and load >= self.average_load:
+        self.overloaded = 'load average %.2f >= %.2f' % (load, self.average_load)
+    if memory != None and memory >= MEMORY_PRESSURE_LIMIT:
+      self.overloaded = 'memory pressure %.1f%% >= %.1f%%' % (memory, MEMORY_PRESSURE_LIMIT)
+
+    self.projected = None
+    meminfo = self.readMeminfo()
+    if 'MemAvailable' not in meminfo:
+      return
+    self.projected = meminfo['MemAvailable'] - int(meminfo.get('MemTotal', 0) * MEMORY_HEADROOM)
+
+    expected = [(session, rss) for (session, rss) in running if rss != None]
+    if len(expected):
+      usage = readSessionRSS([session for (session, rss) in expected])
+      for (session, rss) in expected:
+        self.projected -= max(rss - usage.get(session, 0), 0)
+
+  ## Return the reason a job expected to use rss KB of memory at most (None if unknown) has to
+  # wait, or None if it can start now
+  def admit(self, rss):
+    if self.overloaded != None:
+      return self.overloaded
+    if self.projected != None and rss != None:
+      if rss > self.projected:
+        return 'needs %s of memory, %s available' % (formatKB(rss), formatKB(max(self.projected, 0)))
+      self.projected -= rss
+    return None
+
+  ## Return the "some avg10" value of /proc/pressure/<resource>, or None if not available
+  def readPressure(self, resource):
+    try:
+      f = open('/proc/pressure/' + resource)
+      try:
+        for line in f:
+          if line.startswith('some'):
+            for field in line.split()[1:]:
+              (key, value) = field.split('=')
+              if key == 'avg10':
+                return float(value)
+      finally:
+        f.close()
+    except (IOError, OSError, ValueError):
+      pass
+    return None
+
+  def readLoadAverage(self):
+    try:
+      return os.getloadavg()[0]
+    except (AttributeError, OSError):
+      # getloadavg() not available in this implementation of os
+      return None
+
+  ## Return the fields of /proc/meminfo in KB keyed on their name, empty if not available
+  def readMeminfo(self):
+    meminfo = {}
+    try:
+      f = open('/proc/meminfo')
+      try:
+        for line in f:
+          fields = line.split()
+          if len(fields) >= 2:
+            meminfo[fields[0].rstrip(':')] = int(fields[1])
+      finally:
+        f.close()
+    except (IOError, OSError, ValueError):
+      pass
+    return meminfo
@@ -0,0 +1,222 @@
+import os, re, errno
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+## Size of the reads from a pipe or file
+READ_SIZE = 65536
+
+## Number of already scanned characters kept for patterns that span several reads
+SCAN_OVERLAP = 16384
+
+## Compiled regular expressions keyed on (pattern, flags)
+#
+# Most tests search their output for the same few patterns (see RunApp.getOutputPatterns),
+# they are compiled once for the whole run. The cache of the re module is too small for that
+# and is emptied as a whole once it fills up.
+COMPILED = {}
+
+## Return the compiled regular expression of a pattern
+def compilePattern(pattern, flags=0):
+  key = (pattern, flags)
+  if key not in COMPILED:
+    COMPILED[key] = re.compile(pattern, flags)
+  return COMPILED[key]
+
+## The parts of a regular expression match needed after the output is gone
+#
+# Unlike a match object this does not hold on to the searched text, and it can be pickled.
+class SavedMatch:
+  def __init__(self, m):
+    self.groups = (m.group(0),) + m.groups()
+
+  def group(self, index=0):
+    return self.groups[index]
+
+## Collects the output of a test in bounded memory
+#
+# The output is read from a pipe while the test runs (or from a file once it is done)
+# and only the beginning and the end of it are kept: the first two thirds of max_size
+# and a ring buffer of the last third. Unless keep_all is set (--sep-files) anything in
+# between is dropped.
+#
+# The regular expressions registered as (pattern, flags) tuples are searched for as the
+# output streams past, so they are found anywhere in the output and not just in the
+# parts that are kept. The output is read once, however many patterns there are. The
+# first match of each pattern is available from getMatches(), which also tells which
+# patterns are not in the output at all so that it is never searched again for them.
+#
+# Only SCAN_OVERLAP characters of the output are searched again with the next read, so a
+# pattern with re.DOTALL whose parts are further apart than that is not seen while the output
+# streams past. Those patterns are only known to be absent if all of the output was searched
+# at once, otherwise getMatches() leaves them out and the returned output is searched.
+class OutputCapture:
+  def __init__(self, patterns=[], max_size=100000, keep_all=False):
+    self.head_size = int(max_size*(2.0/3.0))
+    self.tail_size = int(max_size*(1.0/3.0))
+    self.keep_all = keep_all
+
+    self.head = ''
+    self.tail = ''
+    self.chunks = []
+    self.trimmed = False
+
+    ## SavedMatch objects keyed on the (pattern, flags) tuples
+    self.matches = {}
+
+    # Compiled patterns that have not matched yet
+    self.unmatched = {}
+    for (pattern, flags) in patterns:
+      self.unmatched[(pattern, flags)] = compilePattern(pattern, flags)
+
+    # The end of the scanned output and the complete lines at the end of it that are
+    # scanned again, followed by a partial line that has not been scanned yet
+    self.scan_buffer = ''
+    self.scan_overlap = 0
+
+    # Whether output that was searched has been dropped from scan_buffer
+    self.scan_split = False
+
+    self.pipe = None
+    self.file = None
+    self.eof = False
+
+  ## Read the output from a pipe, which is made non-blocking
+  def attachPipe(self, pipe):
+    self.pipe = pipe
+    if fcntl != None:
+      fd = pipe.fileno()
+      fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+      # Other jobs must not inherit the read end
+      fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+  ## Read the output from a file once the test is done
+  def attachFile(self, f):
+    self.file = f
+
+  ## Return the file descriptor to wait on for more output, or None if there is nothing to wait for
+  def fileno(self):
+    if self.pipe == None or self.eof:
+      return None
+    return self.pipe.fileno()
+
+  ## Read whatever output is available from the pipe without blocking
+  #
+  # Returns False once the end of the output has been reached.
+  def read(self):
+    if self.pipe == None or self.eof:
+      return not self.eof
+
+    while True:
+      try:
+        data = os.read(self.pipe.fileno(), READ_SIZE)
+      except OSError, e:
+        if e.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
+          return True
+        if e.errno == errno.EINTR:
+          continue
+        raise
+
+      if data == '':
+        self.eof = True
+        return False
+      self.feed(data)
+
+  ## Add output to the capture
+  def feed(self, data):
+    self.scan(data)
+
+    if self.keep_all:
+      self.chunks.append(data)
+      return
+
+    if len(self.head) < self.head_size:
+      needed = self.head_size - len(self.head)
+      self.head += data[:needed]
+      data = data[needed:]
+      if len(data) == 0:
+        return
+
+    self.trimmed = True
+    if len(data) >= self.tail_size:
+      self.tail = data[-self.tail_size:]
+    else:
+      self.tail = self.tail[len(self.tail) + len(data) - self.tail_size:] + data
+
+  ## Search the output for the patterns that have not matched yet
+  #
+  # Only complete lines are searched (so a pattern ending in .* sees the whole line)
+  # unless final is True or a line grows very long. A few lines of output that have
+  # already been searched are searched again along with the new output.
+  def scan(self, data, final=False):
+    if len(self.unmatched) == 0:
+      return
+
+    text = self.scan_buffer + data
+    if final:
+      end = len(text)
+    else:
+      end = text.rfind('\n') + 1
+      if end <= self.scan_overlap:
+        if len(text) - self.scan_overlap < SCAN_OVERLAP:
+          self.scan_buffer = text
+          return
+        end = len(text)
+
+    for key in self.unmatched.keys():
+      m = self.unmatched[key].search(text, 0, end)
+      if m != None:
+        self.matches[key] = SavedMatch(m)
+        del self.unmatched[key]
+
+    # Keep the overlap starting at the beginning of a line where possible
+    start = max(end - SCAN_OVERLAP, 0)
+    if start > 0:
+      newline = text.find('\n', start, end)
+      if newline != -1:
+        start = newline + 1
+      self.scan_split = True
+    self.scan_buffer = text[start:]
+    self.scan_overlap = end - start
+
+  ## Read the rest of the output and release the pipe or file
+  def close(self):
+    if self.pipe != None:
+      self.read()
+      self.pipe.close()
+      self.pipe = None
+
+    if self.file != None:
+      self.file.seek(0)
+      while True:
+        data = self.file.read(READ_SIZE)
+        if data == '':
+          break
+        self.feed(data)
+      self.file.close()
+      self.file = None
+
+    self.scan('', True)
+
+  ## Return the captured output, trimmed in the middle if it was too long
+  def getOutput(self):
+    if self.keep_all:
+      return ''.join(self.chunks)
+    if not self.trimmed and len(self.head) < self.head_size:
+      return self.head
+    return self.head + "\n" + "#"*80 + "\n\nOutput trimmed\n\n" + "#"*80 + "\n" + self.tail
+
+  ## Return the first match of each pattern keyed on the (pattern, flags) tuples, None for
+  # the patterns that are not in the output
+  #
+  # Patterns with re.DOTALL that did not match are left out when the output was not all
+  # searched at once, as they may span more than SCAN_OVERLAP characters.
+  def getMatches(self):
+    matches = {}
+    for (pattern, flags) in self.unmatched.keys():
+      if not (self.scan_split and flags & re.DOTALL):
+        matches[(pattern, flags)] = None
+    matches.update(self.matches)
+    return matches
@@ -0,0 +1,115 @@
+import os, sys, errno, threading, Queue
+from collections import deque
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+## The output of a finished test waiting to be processed
+class PostProcessJob:
+  def __init__(self, tester, retcode, output, data):
+    self.tester = tester
+    self.retcode = retcode
+    self.output = output
+
+    ## Anything the submitter needs back along with the result
+    self.data = data
+
+    ## The (reason, output) tuple returned by harness.processTestOutput once done
+    self.result = None
+
+    # The exception raised while processing, raised again by collect()
+    self.error = None
+
+    self.done = False
+
+## Processes the output of finished tests on threads of their own (--post-jobs)
+#
+# Checking the output of a test (Tester.processResults running exodiff, the CSVDiffer,
+# the XMLDiffer, ...) does not need the job slot of the test any more, so it is moved off
+# the thread that launches the tests and done while the next tests run. External commands
+# like exodiff run in parallel, the Python code of the differs takes turns.
+#
+# The results are handed back by collect() in the order the tests were submitted, the
+# harness reports them and releases the tests waiting on them from there as before.
+class PostProcessPool:
+  def __init__(self, harness, num_threads):
+    self.harness = harness
+    self.num_threads = num_threads
+    self.threads = []
+
+    self.queue = Queue.Queue()
+
+    ## Submitted jobs that have not been collected yet, oldest first
+    self.pending = deque()
+
+    # A byte is written to the pipe whenever a job is done to wake up the harness
+    (self.read_fd, self.write_fd) = os.pipe()
+    for fd in [self.read_fd, self.write_fd]:
+      fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+      fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+  ## Queue the output of a test for processing
+  def submit(self, tester, retcode, output, data):
+    # The threads are started once there is something to do
+    if len(self.threads) == 0:
+      for i in xrange(self.num_threads):
+        thread = threading.Thread(target=self.work, name='PostProcess-%d' % i)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    job = PostProcessJob(tester, retcode, output, data)
+    self.pending.append(job)
+    self.queue.put(job)
+
+  def work(self):
+    while True:
+      job = self.queue.get()
+      if job == None:
+        return
+      try:
+        job.result = self.harness.processTestOutput(job.tester, job.retcode, job.output)
+      except:
+        job.error = sys.exc_info()
+      job.done = True
+      try:
+        os.write(self.write_fd, 'x')
+      except OSError, e:
+        # The pipe is full, the harness has plenty of wake ups waiting already
+        if e.errno != errno.EAGAIN:
+          raise
+
+  ## Return the processed jobs that are next in line, without blocking
+  def collect(self):
+    try:
+      while os.read(self.read_fd, 4096):
+        pass
+    except OSError, e:
+      if e.errno != errno.EAGAIN:
+        raise
+
+    jobs = []
+    while len(self.pending) and self.pending[0].done:
+      job = self.pending.popleft()
+      if job.error != None:
+        raise job.error[0], job.error[1], job.error[2]
+      jobs.append(job)
+    return jobs
+
+  ## Return the file descriptor that becomes readable when a job is done
+  def fileno(self):
+    return self.read_fd
+
+  ## Return the number of jobs that have not been collected yet
+  def pendingCount(self):
+    return len(self.pending)
+
+  ## Stop the threads once they are done with the queued jobs
+  def shutdown(self):
+    for thread in self.threads:
+      self.queue.put(None)
+    for thread in self.threads:
+      thread.join()
+    self.threads = []
@@ -0,0 +1,103 @@
+import os, sys, signal
+
+try:
+  import ctypes
+except ImportError:
+  ctypes = None
+
+## waitid() of the C library and the Linux values of its arguments, see hasExited
+WAITID = None
+P_PID = 1
+WEXITED = 4
+WNOHANG = 1
+WNOWAIT = 0x01000000
+if ctypes != None and sys.platform.startswith('linux'):
+  try:
+    WAITID = ctypes.CDLL(None, use_errno=True).waitid
+  except (OSError, AttributeError):
+    WAITID = None
+
+## Readers of the resources used by running jobs (Linux only, they return nothing elsewhere)
+#
+# Every job is started in a session of its own (see RunParallel.launch) so the session
+# covers every process of a job, MPI ranks included.
+
+## Return the resident memory in KB of all processes of each of the given sessions
+def readSessionRSS(sessions):
+  usage = {}
+  sessions = set(sessions)
+  try:
+    pids = [entry for entry in os.listdir('/proc') if entry.isdigit()]
+    page_kb = os.sysconf('SC_PAGE_SIZE') / 1024
+  except (OSError, ValueError, AttributeError):
+    return usage
+
+  for pid in pids:
+    try:
+      f = open('/proc/' + pid + '/stat')
+      try:
+        # The command name may contain spaces, the fields after it do not
+        fields = f.read().rsplit(')', 1)[1].split()
+      finally:
+        f.close()
+    except (IOError, OSError, IndexError):
+      # The process exited in the meantime
+      continue
+    session = int(fields[3])
+    if session in sessions:
+      usage[session] = usage.get(session, 0) + int(fields[21]) * page_kb
+  return usage
+
+## Return the (read_bytes, write_bytes) a process caused to be fetched from or sent to storage,
+# or None if not available
+#
+# The counts include the children the process waited for. Read this after the process exited
+# but before it is reaped to cover everything the job did.
+def readIO(pid):
+  counters = {}
+  try:
+    f = open('/proc/%d/io' % pid)
+    try:
+      for line in f:
+        (name, value) = line.split(':')
+        counters[name] = int(value)
+    finally:
+      f.close()
+  except (IOError, OSError, ValueError):
+    return None
+  if 'read_bytes' not in counters or 'write_bytes' not in counters:
+    return None
+  return (counters['read_bytes'], counters['write_bytes'])
+
+## Return whether a child process has exited, without reaping it, or None if that can not be told
+#
+# Used to read the counters of a process (readIO) only once it is done. os.waitid is not
+# available in this version of Python, the call of the C library is used on Linux, the only
+# system with the counters anyway.
+def hasExited(pid):
+  if WAITID == None:
+    return None
+  # siginfo_t is 128 bytes, si_signo comes first and is only set if the child has exited
+  info = (ctypes.c_int * 32)()
+  if WAITID(P_PID, pid, info, WEXITED | WNOHANG | WNOWAIT) != 0:
+    return None
+  return info[0] == signal.SIGCHLD
+
+## Format an amount of memory given in KB
+def formatKB(kb):
+  if kb >= 1024 * 1024:
+    return '%.1f GB' % (kb / (1024.0 * 1024.0))
+  return '%.0f MB' % (kb / 1024.0)
+
+## Return the resources used by a finished test as a short string for the result line
+#
+# usage is a dictionary as kept by RunParallel.resource_usage, returns '' if nothing was measured.
+def formatUsage(usage):
+  if 'peak_rss' not in usage:
+    return ''
+  text = formatKB(usage['peak_rss'])
+  if 'user_time' in usage:
+    text += ', %.2fs CPU' % (usage['user_time'] + usage['sys_time'])
+  if 'read_bytes' in usage:
+    text += ', %s read, %s written' % (formatKB(usage['read_bytes'] / 1024), formatKB(usage['write_bytes'] / 1024))
+  return text
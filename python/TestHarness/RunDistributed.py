@@ -0,0 +1,349 @@
+import os, sys, socket, select, errno, threading, Queue, binascii
+from multiprocessing.connection import Listener, Client, AuthenticationError
+from timeit import default_timer as clock
+
+from RunParallel import RunParallel
+
+## The environment variable holding the key shared by the coordinator and its workers
+AUTHKEY_VARIABLE = 'TESTHARNESS_AUTHKEY'
+
+## The options of the coordinator a worker uses to run and check the tests it is handed
+#
+# Everything else (the number of jobs, output files, ...) comes from the command line of
+# the worker itself.
+WORKER_OPTIONS = ['method', 'dry_run', 'valgrind_mode', 'sep_files', 'timing', 'store_time',
+                  'perf_check', 'scaling', 'external_exodiff', 'enable_recover', 'extra_info']
+
+## Split "[HOST:]PORT" into a (host, port) tuple, host defaults to default_host
+def parseAddress(address, default_host=''):
+  (host, port) = (default_host, address)
+  if ':' in address:
+    (host, port) = address.rsplit(':', 1)
+  try:
+    return (host, int(port))
+  except ValueError:
+    print 'ERROR: Invalid address "' + address + '", expected [HOST:]PORT'
+    sys.exit(1)
+
+## Return the key used to authenticate the connections between the coordinator and its workers
+#
+# The key is read from the environment. When it is not set the coordinator makes one up
+# (and prints it, see RunDistributed) while a worker has no way of knowing it and returns None.
+def getAuthKey(generate=False):
+  if os.environ.has_key(AUTHKEY_VARIABLE):
+    return os.environ[AUTHKEY_VARIABLE]
+  if generate:
+    return binascii.hexlify(os.urandom(16))
+  return None
+
+## The state the coordinator keeps about one connected worker
+class WorkerConnection:
+  def __init__(self, conn, hostname, job_slots):
+    self.conn = conn
+    self.hostname = hostname
+    self.job_slots = job_slots
+    self.slots_in_use = 0
+
+    ## The jobs handed to this worker as (tester, command, dirpath, slots) tuples keyed by test name
+    self.running = {}
+
+  def fileno(self):
+    return self.conn.fileno()
+
+  def freeSlots(self):
+    return self.job_slots - self.slots_in_use
+
+  ## Return whether a job of the given size fits in the free slots
+  def fits(self, slots):
+    return self.slots_in_use + slots <= self.job_slots
+
+  def start(self, tester, command, dirpath, slots):
+    self.conn.send(('job', tester, command, dirpath, slots))
+    self.running[tester.specs['test_name']] = (tester, command, dirpath, slots)
+    self.slots_in_use += slots
+
+  def finish(self, test_name):
+    (tester, command, dirpath, slots) = self.running.pop(test_name)
+    self.slots_in_use -= slots
+    return (tester, slots)
+
+## Runs the jobs of the dependency graph on workers connected over the network
+#
+# The coordinator (run_tests --coordinator [HOST:]PORT) finds the tests and builds the
+# dependency graph as usual, but instead of launching the jobs itself it hands them out to
+# workers (run_tests --worker HOST:PORT) that may be started on other hosts at any time.
+# Each worker runs the jobs it is handed with a RunParallel of its own, checks the output
+# and sends back the result, which is reported here exactly as if the job ran locally.
+#
+# The connections use multiprocessing.connection: messages are pickled Python objects and
+# both ends authenticate each other with a shared key (TESTHARNESS_AUTHKEY). Anyone holding
+# the key can run code on the coordinator, so it only listens on localhost unless another
+# host (0.0.0.0 for all interfaces) is given, and a key taken from the environment is never
+# printed. The commands
+# refer to the files by their absolute paths so the workers must see the same directories
+# as the coordinator, through a shared file system or identical checkouts.
+#
+# Messages sent to a worker:
+#   ('options', {name : value})                   the coordinator options listed in WORKER_OPTIONS
+#   ('job', tester, command, dirpath, slots)      run a job
+#   ('stop',)                                     all done
+# Messages sent by a worker:
+#   ('hello', hostname, job_slots)                sent once after connecting
+#   ('result', test_name, reason, output, seconds, caveats, matches, usage)
+#
+# Jobs running on a worker that goes away are put back into the graph and handed out again.
+class RunDistributed(RunParallel):
+  def __init__(self, harness, address, authkey):
+    RunParallel.__init__(self, harness)
+
+    ## The connected workers
+    self.workers = []
+
+    # Workers are accepted on a separate thread (the handshake blocks) and handed over through
+    # this queue, a byte written to the pipe wakes up the main loop
+    self.connected = Queue.Queue()
+    (self.wakeup_read, self.wakeup_write) = os.pipe()
+
+    self.listener = Listener(address, authkey=authkey)
+    (host, port) = self.listener.address
+    if host in ['', '0.0.0.0']:
+      host = socket.gethostname()
+
+    # Only a key made up for this run is printed, it is of no use once the run is over
+    if os.environ.has_key(AUTHKEY_VARIABLE):
+      print 'Waiting for workers, start them with the same $' + AUTHKEY_VARIABLE + ' and:'
+      print '  ./run_tests --worker ' + host + ':' + str(port) + ' -j <jobs>\n'
+    else:
+      print 'Waiting for workers, start them with:'
+      print '  ' + AUTHKEY_VARIABLE + '=' + authkey + ' ./run_tests --worker ' + host + ':' + str(port) + ' -j <jobs>\n'
+
+    thread = threading.Thread(target=self.acceptWorkers)
+    thread.daemon = True
+    thread.start()
+
+  ## Accept connections until the process exits (runs on its own thread)
+  def acceptWorkers(self):
+    while True:
+      try:
+        conn = self.listener.accept()
+        message = conn.recv()
+      except (AuthenticationError, IOError, EOFError), e:
+        print 'WARNING: Rejected a worker connection: ' + str(e)
+        continue
+
+      if type(message) != tuple or len(message) != 3 or message[0] != 'hello':
+        conn.close()
+        continue
+
+      self.connected.put((conn, message[1], message[2]))
+      os.write(self.wakeup_write, 'w')
+
+  ## Hand every job in the graph out to the workers, returning once all results are in
+  def join(self):
+    # Nothing runs during a dry run so there is nothing to distribute
+    if self.options.dry_run:
+      return RunParallel.join(self)
+
+    self.buildGraph()
+
+    while self.dag.hasJobs() or self.isRunning():
+      self.addWorkers()
+      self.startReadyJobs()
+      self.waitForResults()
+
+    for worker in self.workers:
+      try:
+        worker.conn.send(('stop',))
+        worker.conn.close()
+      except IOError:
+        pass
+    self.workers = []
+
+  ## Return whether any job is out on a worker
+  def isRunning(self):
+    for worker in self.workers:
+      if len(worker.running):
+        return True
+    return False
+
+  ## Start using the workers that connected since the last call
+  def addWorkers(self):
+    while True:
+      try:
+        (conn, hostname, job_slots) = self.connected.get_nowait()
+      except Queue.Empty:
+        return
+
+      options = {}
+      for name in WORKER_OPTIONS:
+        options[name] = getattr(self.options, name)
+      try:
+        conn.send(('options', options))
+      except IOError:
+        continue
+
+      print 'Worker connected: %s (%d slots)' % (hostname, job_slots)
+      self.workers.append(WorkerConnection(conn, hostname, job_slots))
+
+  ## Hand out as many of the ready jobs as the workers have room for, highest priority first
+  def startReadyJobs(self):
+    deferred = []
+    while len([worker for worker in self.workers if worker.freeSlots() > 0]):
+      job = self.dag.popReady()
+      if job == None:
+        break
+      (tester, command, dirpath) = job
+      slots = self.getSlots(tester)
+
+      worker = self.findWorker(slots)
+      if worker == None:
+        deferred.append(job)
+        continue
+
+      # Stop launching new jobs once too many have failed
+      if self.harness.maxFailsExceeded():
+        self.harness.handleTestResult(tester.specs, '', 'Max Fails Exceeded')
+        self.jobFailed(tester)
+        continue
+
+      try:
+        worker.start(tester, command, dirpath, slots)
+      except IOError:
+        deferred.append(job)
+        self.workerLost(worker)
+
+    for job in deferred:
+      self.dag.pushBack(job)
+
+  ## Return the worker with the most free slots that can take a job of the given size
+  #
+  # A job larger than every worker runs on its own on one of the largest workers.
+  def findWorker(self, slots):
+    largest = max([worker.job_slots for worker in self.workers])
+
+    best = None
+    for worker in self.workers:
+      if slots > largest:
+        fits = worker.job_slots == largest and worker.slots_in_use == 0
+      else:
+        fits = worker.fits(slots)
+      if fits and (best == None or worker.freeSlots() > best.freeSlots()):
+        best = worker
+    return best
+
+  ## Wait for results from the workers or for new workers to connect
+  def waitForResults(self):
+    fds = [self.wakeup_read] + [worker.fileno() for worker in self.workers]
+    try:
+      readable = select.select(fds, [], [])[0]
+    except select.error, e:
+      if e.args[0] != errno.EINTR:
+        raise
+      return
+
+    if self.wakeup_read in readable:
+      os.read(self.wakeup_read, 4096)
+
+    for worker in list(self.workers):
+      if worker.fileno() not in readable:
+        continue
+      try:
+        while worker.conn.poll():
+          self.receiveResult(worker, worker.conn.recv())
+      except (IOError, EOFError):
+        self.workerLost(worker)
+
+  ## Report the result of a job sent back by a worker
+  def receiveResult(self, worker, message):
+    (kind, test_name, reason, output, seconds, caveats, matches, usage) = message
+    (tester, slots) = worker.finish(test_name)
+
+    tester.output_matches = matches
+    if len(caveats):
+      tester.specs.addParam('caveats', caveats, "")
+    self.resource_usage[test_name] = usage
+    usage['slots'] = slots
+
+    end = clock()
+    did_pass = self.harness.reportTestResult(tester, reason, output, end - seconds, end)
+    self.jobDone(tester, did_pass, seconds, slots)
+
+  ## Put the jobs of a worker that went away back into the graph
+  def workerLost(self, worker):
+    print 'WARNING: Lost the connection to worker %s, rescheduling %d jobs' % (worker.hostname, len(worker.running))
+    for (tester, command, dirpath, slots) in worker.running.values():
+      self.dag.pushBack((tester, command, dirpath))
+    worker.running = {}
+    worker.conn.close()
+    self.workers.remove(worker)
+
+## Runs the jobs handed out by a coordinator (see RunDistributed) until told to stop
+#
+# The jobs are run with the RunParallel of the harness, which calls back into
+# harness.reportTestResult once the output of a job has been checked. The harness is
+# expected to pass the outcome on through sendResult().
+class Worker:
+  def __init__(self, harness, address, authkey):
+    self.harness = harness
+    self.runner = harness.runner
+    self.address = address
+    self.authkey = authkey
+    self.conn = None
+
+  ## Connect to the coordinator and run jobs, returns False if the connection failed or was lost
+  def run(self):
+    try:
+      self.conn = Client(self.address, authkey=self.authkey)
+      self.conn.send(('hello', socket.gethostname(), self.runner.job_slots))
+    except (socket.error, AuthenticationError, IOError, EOFError), e:
+      print 'ERROR: Unable to connect to the coordinator at %s:%d: %s' % (self.address[0], self.address[1], str(e))
+      return False
+
+    print 'Connected to the coordinator at %s:%d' % self.address
+
+    # A message from the coordinator ends the wait for a job to finish
+    self.runner.wakeup_fds = [self.conn.fileno()]
+
+    if self.runner.child_watcher != None:
+      self.runner.child_watcher.start()
+    try:
+      while True:
+        if self.isRunning():
+          self.runner.spinwait()
+        else:
+          self.conn.poll(None)
+
+        while self.conn.poll():
+          message = self.conn.recv()
+          if message[0] == 'stop':
+            self.conn.close()
+            return True
+          elif message[0] == 'options':
+            for (name, value) in message[1].items():
+              setattr(self.harness.options, name, value)
+          elif message[0] == 'job':
+            (kind, tester, command, dirpath, slots) = message
+            self.runner.launch(tester, command, dirpath, slots)
+    except (IOError, EOFError):
+      print 'ERROR: Lost the connection to the coordinator'
+      self.killJobs()
+      return False
+    finally:
+      if self.runner.child_watcher != None:
+        self.runner.child_watcher.stop()
+
+  def isRunning(self):
+    return self.runner.jobs.count(None) != len(self.runner.jobs) or self.runner.postProcessing()
+
+  ## Send the outcome of a job back to the coordinator
+  def sendResult(self, tester, reason, output, seconds):
+    caveats = []
+    if tester.specs.isValid('caveats'):
+      caveats = tester.specs['caveats']
+    test_name = tester.specs['test_name']
+    usage = self.runner.getResourceUsage(test_name)
+    self.conn.send(('result', test_name, reason, output, seconds, caveats, tester.output_matches, usage))
+
+  ## Kill the jobs that are still running, nobody is waiting for them anymore
+  def killJobs(self):
+    self.runner.killJobs()
@@ -0,0 +1,85 @@
+import os, json, hashlib
+from ArtifactCache import findLinkedFiles
+
+## The results of the tests of the current run, written as they finish so an interrupted run can be resumed (--resume)
+#
+# Every result is appended to the journal as a line of JSON and synced to disk right away, so
+# the results survive the harness being interrupted or the machine going down. Each result is
+# stored with a key made of the fingerprint of the test (see LastRunState.fingerprint) and the
+# digests of the executable and the shared libraries it loads.
+#
+# A new run starts a new journal. With --resume the journal of the earlier run is read first
+# and added to, the tests that passed in it with the same key do not run again.
+class RunJournal:
+  def __init__(self, filename, last_run, file_digests, resume):
+    self.filename = filename
+    self.last_run = last_run
+    self.file_digests = file_digests
+
+    ## {test_name : (status, key)} of the earlier run, with --resume
+    self.results = {}
+    if resume:
+      self.results = self.read()
+
+    # The digests of the files each executable loads, found once per run
+    self.executables = {}
+
+    directory = os.path.dirname(self.filename)
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    if resume:
+      self.file = open(self.filename, 'a')
+    else:
+      self.file = open(self.filename, 'w')
+
+  ## Return the results in the journal, a line cut short by an interruption is ignored
+  def read(self):
+    results = {}
+    try:
+      f = open(self.filename)
+    except IOError:
+      return results
+    try:
+      for line in f:
+        try:
+          record = json.loads(line)
+          results[record['name']] = (record['status'], record['key'])
+        except (ValueError, KeyError, TypeError):
+          pass
+    finally:
+      f.close()
+    return results
+
+  ## Return the key of a test, or None if it was not fingerprinted
+  def getKey(self, specs):
+    test_name = specs['test_name']
+    if test_name not in self.last_run.fingerprints:
+      return None
+
+    executable = specs['executable']
+    if executable not in self.executables:
+      h = hashlib.md5()
+      for path in findLinkedFiles(executable):
+        h.update(path + '\0' + str(self.file_digests.digest(path)) + '\0')
+      self.executables[executable] = h.hexdigest()
+
+    return hashlib.md5(self.last_run.fingerprints[test_name][0] + self.executables[executable]).hexdigest()
+
+  ## Return whether a test passed in the resumed run and nothing it depends on changed since
+  def passed(self, specs):
+    if specs['test_name'] not in self.results:
+      return False
+    (status, key) = self.results[specs['test_name']]
+    return status == 'OK' and key == self.getKey(specs)
+
+  ## Append the status of a finished test
+  def record(self, specs, status):
+    key = self.getKey(specs)
+    if key == None:
+      return
+    self.file.write(json.dumps({'name' : specs['test_name'], 'status' : status, 'key' : key}) + '\n')
+    self.file.flush()
+    os.fsync(self.file.fileno())
+
+  def close(self):
+    self.file.close()
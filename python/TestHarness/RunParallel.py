@@ -1,27 +1,63 @@
 from subprocess import *
-from time import sleep
+from time import sleep, time as wallclock
 from timeit import default_timer as clock
 
 from tempfile import TemporaryFile
-#from Queue import Queue
-from collections import deque
+from OutputCapture import OutputCapture
 from Tester import Tester
+from JobDAG import JobDAG
+from LoadGovernor import LoadGovernor
+from AppServer import AppServerPool, ServerRequest
+from PostProcessPool import PostProcessPool
+import ResourceUsage
+import Shards
 from signal import SIGTERM
-import platform
+import platform, signal, select, errno, threading
 
 import os, sys
 
+try:
+  import fcntl
+except ImportError:
+  # Not available on Windows, where we always poll
+  fcntl = None
+
 ## This class provides an interface to run commands in parallel
 #
 # To use this class, call the .run() method with the command and the test
 # options. When the test is finished running it will call harness.testOutputAndFinish
 # to complete the test. Be sure to call join() to make sure all the tests are finished.
 #
+# Jobs handed to run() are collected into a dependency graph (JobDAG) and nothing is
+# launched until join() is called, at which point the whole graph is checked and the
+# ready jobs are started in critical path order.
+#
+# When the harness keeps a runtime history the critical path is weighted with the
+# measured runtimes (longest first) and jobs needing more slots than are free get a
+# reservation: smaller jobs are only packed into the free slots while they are
+# expected to finish before the reservation starts.
+#
+# Jobs are also held back while the machine is overloaded or the memory they needed in
+# earlier runs is not available (see LoadGovernor). The reason is reported once per job.
+#
+# With --app-server the jobs that allow it are handed to a long-lived process of their
+# application (see AppServer) instead of being started as processes of their own.
+#
+# The output of a finished job is checked on the threads of a PostProcessPool while the
+# next jobs run. The results are reported in the order the jobs finished and the jobs
+# depending on a job are only started once its result is known.
+#
 class RunParallel:
 
   ## Return this return code if the process must be killed because of timeout
   TIMEOUT = -999999
 
+  ## Seconds between snapshots of the machine load, and between checks while jobs are held back
+  GOVERNOR_INTERVAL = 0.5
+
+  ## Seconds between samples of the memory used by the running jobs
+  SAMPLE_INTERVAL = 1.0
+
   def __init__(self, harness, max_processes=None, average_load=64.0):
     ## The test harness to run callbacks on
     self.harness = harness
@@ -44,22 +80,40 @@ class RunParallel:
     # Current slots in use
     self.slots_in_use = 0
 
-    ## List of currently running jobs as (Popen instance, command, test, time when expires, slots) tuples
+    ## List of currently running jobs as (Popen instance, command, test, start time, OutputCapture, slots) tuples
     # None means no job is running in this slot
     self.jobs = [None] * self.job_slots
 
     # Requested average load level to stay below
     self.average_load = average_load
 
-    # queue for jobs needing a prereq
-    self.queue = deque()
+    # Decides whether the machine has room for another job
+    self.governor = LoadGovernor(average_load, self.options.max_pressure)
+
+    # The time of the last snapshot taken by the governor
+    self.last_round = None
+
+    # Whether jobs were held back by the governor in the last call to startReadyJobs
+    self.held = False
+
+    # Jobs that have been held back by the governor, each is only reported once
+    self.reported_held = set()
+
+    # Graph of all jobs that have not been launched yet
+    self.dag = JobDAG()
 
-    # queue for jobs that are always too big (can run at the end if we have soft limits)
-    self.big_queue = deque()
+    # Whether the "Oversized Jobs" banner has been printed
+    self.reported_oversized = False
 
     # Jobs that have been finished
     self.finished_jobs = set()
 
+    # Results of the jobs in the graph that do not need to run, reported once the shards are split
+    self.finished_results = {}
+
+    # The shard of each job in the graph (--shard), see selectShard
+    self.shards = {}
+
     # List of skipped jobs to resolve prereq issues for tests that never run
     self.skipped_jobs = set()
 
@@ -69,40 +123,229 @@ class RunParallel:
     # Reporting timer which resets when ever data is printed to the screen.
     self.reported_timer = clock()
 
-  ## run the command asynchronously and call testharness.testOutputAndFinish when complete
-  def run(self, tester, command, recurse=True, slot_check=True):
-    # First see if any of the queued jobs can be run but only if recursion is allowed on this run
-    if recurse:
-      self.startReadyJobs(slot_check)
+    # Resource usage of finished jobs keyed by test name: slots, max_rss (KB, the largest process),
+    # peak_rss (KB, summed over all processes of the job), user_time, sys_time (seconds),
+    # read_bytes and write_bytes (storage I/O)
+    self.resource_usage = {}
+
+    # The memory of the running jobs is sampled from /proc where it exists
+    self.sample_memory = os.path.isdir('/proc')
+    self.last_sample = clock()
+
+    # Runtimes measured in previous runs (None if the harness keeps no history)
+    self.history = getattr(harness, 'runtime_history', None)
+
+    # Other file descriptors that end the wait for a child to exit when they become readable
+    self.wakeup_fds = []
+
+    # Block on child exit instead of polling when the platform allows it
+    self.child_watcher = None
+    if hasattr(os, 'wait4'):
+      try:
+        self.child_watcher = ChildWatcher()
+      except (AttributeError, ValueError, OSError):
+        # No SIGCHLD or not running on the main thread: fall back to polling
+        self.child_watcher = None
+
+    # Application servers need the child watcher to wake up when they report a result
+    self.app_servers = None
+    if getattr(self.options, 'app_server', False) and self.child_watcher != None:
+      self.app_servers = AppServerPool()
+
+    # The output of finished jobs is checked on threads of their own unless --post-jobs is 0.
+    # They need the child watcher to wake up when a result is ready, PBS batches are built
+    # in order
+    self.post_processing = None
+    post_jobs = getattr(self.options, 'post_jobs', None)
+    if post_jobs == None:
+      post_jobs = self.job_slots
+    if post_jobs > 0 and self.child_watcher != None and not self.options.pbs:
+      self.post_processing = PostProcessPool(harness, post_jobs)
+
+  ## Add the command to the graph of jobs, it will be run asynchronously once join() is called
+  #
+  # A job given a result (it passed in the run being resumed, for example) does not run at
+  # all. It stays in the graph until the shards are split so it is placed with the jobs that
+  # depend on it, and is then reported with that result by the shard it belongs to.
+  def run(self, tester, command, result=None):
+    if result != None:
+      self.finished_results[tester.specs['test_name']] = result
+      self.dag.addJob(tester, command, os.getcwd())
+      return
 
     # Get the number of slots that this job takes
-    slots = tester.getProcs(self.options) * tester.getThreads(self.options)
+    slots = self.getSlots(tester)
 
-    # Is this job always too big?
-    if slot_check and slots > self.job_slots:
-      if self.soft_limit:
-        self.big_queue.append([tester, command, os.getcwd()])
-      else:
+    # Is this job always too big? If we have a soft limit it will run when nothing else is
+    if slots > self.job_slots and not self.soft_limit:
+      if self.harness.inShard(tester.specs['test_name']):
         self.harness.handleTestResult(tester.specs, '', 'skipped (Insufficient slots)')
-        self.skipped_jobs.add(tester.specs['test_name'])
-      return
-
-    # Now make sure that this job doesn't have an unsatisfied prereq
-    if tester.specs['prereq'] != None and len(set(tester.specs['prereq']) - self.finished_jobs) and self.options.pbs is None:
-      self.queue.append([tester, command, os.getcwd()])
+      self.skipped_jobs.add(tester.specs['test_name'])
       return
 
-    # Make sure we are complying with the requested load average
-    self.satisfyLoad()
+    self.dag.addJob(tester, command, os.getcwd())
 
-    # Wait for a job to finish if the jobs queue is full
-    while self.jobs.count(None) == 0 or self.slots_in_use >= self.job_slots:
-      self.spinwait()
+  ## Return the number of slots that a job takes
+  def getSlots(self, tester):
+    return tester.getProcs(self.options) * tester.getThreads(self.options)
 
-    # Will this new job fit without exceeding the available job slots?
-    if slot_check and self.slots_in_use + slots > self.job_slots:
-      self.queue.append([tester, command, os.getcwd()])
-      return
+  ## Return the expected runtime of a job, used to weight the critical path
+  #
+  # The runtime history is used when there is one. Tests that were never run are
+  # assumed to take as long as a typical test, and without any history at all the
+  # allowed time is the best guess we have.
+  def estimateRuntime(self, tester):
+    if self.history != None:
+      runtime = self.history.getRuntime(tester.specs['test_name'])
+      if runtime == None:
+        runtime = self.history.getTypicalRuntime()
+      if runtime != None:
+        return runtime
+    return float(tester.specs['max_time'])
+
+  ## Return the expected peak memory use of a job in KB or None if there is no history
+  #
+  # The recorded peak is that of the largest process of the job, every MPI rank is assumed
+  # to need as much.
+  def expectedMemory(self, tester):
+    if self.history == None:
+      return None
+    max_rss = self.history.getMaxRSS(tester.specs['test_name'])
+    if max_rss == None:
+      max_rss = self.history.getTypicalMaxRSS()
+    if max_rss == None:
+      return None
+    return max_rss * tester.getProcs(self.options)
+
+  ## Return the (session id, expected peak memory) of every running job, see LoadGovernor
+  def runningMemory(self):
+    running = []
+    for tuple in self.jobs:
+      if tuple != None:
+        (p, command, tester, start_time, capture, slots) = tuple
+        running.append((p.pid, self.expectedMemory(tester)))
+    return running
+
+  ## Report that a job is held back by the governor, once per job
+  def reportHeld(self, tester, reason):
+    test_name = tester.specs['test_name']
+    if test_name not in self.reported_held:
+      print 'Holding back %s: %s' % (test_name, reason)
+      self.reported_held.add(test_name)
+
+  ## Return the measured runtime of a job or None if there is no history for it
+  def knownRuntime(self, tester):
+    if self.history == None:
+      return None
+    return self.history.getRuntime(tester.specs['test_name'])
+
+  ## Return whether a job can be started with the slots that are free right now
+  def fitsNow(self, slots):
+    # Oversized jobs (only possible with a soft limit) run on an otherwise idle machine
+    if slots > self.job_slots:
+      return self.slots_in_use == 0
+    return self.slots_in_use + slots <= self.job_slots
+
+  ## Reserve slots for a job that does not fit yet
+  #
+  # Returns [start, extra] where start is the time the running jobs are expected to
+  # have freed enough slots for the job and extra is the number of slots left over at
+  # that time, or None if that can not be predicted (no history for a running job).
+  def reserveSlots(self, slots):
+    # Oversized jobs need the whole machine
+    needed = min(slots, self.job_slots)
+
+    ends = []
+    for tuple in self.jobs:
+      if tuple != None:
+        (p, command, tester, start_time, capture, job_slots) = tuple
+        runtime = self.knownRuntime(tester)
+        if runtime == None:
+          return None
+        ends.append((start_time + runtime, job_slots))
+    ends.sort()
+
+    free = self.job_slots - self.slots_in_use
+    for (end, job_slots) in ends:
+      free += job_slots
+      if free >= needed:
+        return [end, min(free - needed, self.job_slots - self.slots_in_use)]
+    return None
+
+  ## Return whether a job may be packed in front of a job holding a reservation
+  #
+  # It must either be expected to finish before the reservation starts or fit in the
+  # slots the reserved job leaves over (which it then uses up).
+  def canBackfill(self, tester, slots, reservation):
+    runtime = self.knownRuntime(tester)
+    if runtime != None and clock() + runtime <= reservation[0]:
+      return True
+    if slots <= reservation[1]:
+      reservation[1] -= slots
+      return True
+    return False
+
+  ## Launch as many of the ready jobs as will fit, highest priority first
+  def startReadyJobs(self):
+    deferred = []
+    reservation = None
+    self.held = False
+    governed = False
+    while self.jobs.count(None) != 0 and self.slots_in_use < self.job_slots:
+      job = self.dag.popReady()
+      if job == None:
+        break
+      (tester, command, dirpath) = job
+      slots = self.getSlots(tester)
+
+      # Will this new job fit without exceeding the available job slots? The first
+      # (highest priority) job that does not gets its slots reserved
+      if not self.fitsNow(slots):
+        if len(deferred) == 0:
+          reservation = self.reserveSlots(slots)
+        deferred.append(job)
+        continue
+
+      if reservation != None and not self.canBackfill(tester, slots, reservation):
+        deferred.append(job)
+        continue
+
+      # Stop launching new jobs once too many have failed
+      if self.harness.maxFailsExceeded():
+        self.harness.handleTestResult(tester.specs, '', 'Max Fails Exceeded')
+        self.jobFailed(tester)
+        continue
+
+      # Make sure the machine has room for the job. We'll always run at least one job
+      # regardless of load or we'll starve! Once a job is held back the jobs after it
+      # wait too, so it gets the resources that free up first
+      if self.slots_in_use > 0 and not self.options.dry_run:
+        if not governed:
+          # startReadyJobs runs each time spinwait wakes up (for every read of the output
+          # of a job), the snapshot reads all of /proc so it is only taken every GOVERNOR_INTERVAL.
+          # Until then the jobs admitted since the last one keep using up its projection
+          now = clock()
+          if self.last_round == None or now >= self.last_round + self.GOVERNOR_INTERVAL:
+            self.governor.startRound(self.runningMemory())
+            self.last_round = now
+          governed = True
+        reason = self.governor.admit(self.expectedMemory(tester))
+        if reason != None:
+          self.reportHeld(tester, reason)
+          self.held = True
+          deferred.append(job)
+          break
+
+      self.launch(tester, command, dirpath, slots)
+
+    for job in deferred:
+      self.dag.pushBack(job)
+
+  ## Start running a single job in the given directory
+  def launch(self, tester, command, dirpath, slots):
+    if slots > self.job_slots and not self.reported_oversized:
+      print "\nOversized Jobs:\n"
+      self.reported_oversized = True
 
     # Pre-run preperation
     tester.prepare()
@@ -110,22 +353,42 @@ class RunParallel:
     job_index = self.jobs.index(None) # find an empty slot
     log( 'Command %d started: %s' % (job_index, command) )
 
-    # It seems that using PIPE doesn't work very well when launching multiple jobs.
-    # It deadlocks rather easy.  Instead we will use temporary files
-    # to hold the output as it is produced
+    capture = OutputCapture(self.getOutputPatterns(tester), keep_all=self.options.sep_files)
+
+    # Pipes deadlock when nothing reads them while the jobs run, they are only used when
+    # the child watcher can wake us up to read them and the output of finished jobs is
+    # checked by the post-processing threads (a slow exodiff on this thread would leave
+    # the pipes of the running jobs full). Otherwise we use temporary files to hold the
+    # output as it is produced
     try:
       if self.options.dry_run or not tester.shouldExecute():
         tmp_command = command
         command = "echo"
 
-      f = TemporaryFile()
+      # Tests that allow it are run by an application server, which writes their output to a file
+      p = None
+      if self.app_servers != None and tester.shouldExecute() and not self.options.dry_run:
+        p = self.app_servers.submit(tester, command, dirpath, self.options)
 
-      # On Windows, there is an issue with path translation when the command is passed in
-      # as a list.
-      if platform.system() == "Windows":
-        p = Popen(command,stdout=f,stderr=f,close_fds=False, shell=True, creationflags=CREATE_NEW_PROCESS_GROUP)
+      if p != None:
+        stdout = p.output
+      else:
+        if self.child_watcher != None and self.post_processing != None:
+          stdout = PIPE
+        else:
+          stdout = TemporaryFile()
+
+        # On Windows, there is an issue with path translation when the command is passed in
+        # as a list.
+        if platform.system() == "Windows":
+          p = Popen(command,stdout=stdout,stderr=STDOUT,close_fds=False, shell=True, cwd=dirpath, creationflags=CREATE_NEW_PROCESS_GROUP)
+        else:
+          p = Popen(command,stdout=stdout,stderr=STDOUT,close_fds=False, shell=True, cwd=dirpath, preexec_fn=os.setsid)
+
+      if stdout == PIPE:
+        capture.attachPipe(p.stdout)
       else:
-        p = Popen(command,stdout=f,stderr=f,close_fds=False, shell=True, preexec_fn=os.setsid)
+        capture.attachFile(stdout)
 
       if self.options.dry_run or not tester.shouldExecute():
         command = tmp_command
@@ -133,70 +396,120 @@ class RunParallel:
       print "Error in launching a new task"
       raise
 
-    self.jobs[job_index] = (p, command, tester, clock(), f, slots)
-    self.slots_in_use = self.slots_in_use + slots
+    # The output starts with where and how the test ran, it is searched for the patterns too
+    capture.feed('Working Directory: ' + tester.specs['test_dir'] + '\nRunning command: ' + command + '\n')
 
-  def startReadyJobs(self, slot_check):
-    queue_items = len(self.queue)
-    for i in range(0, queue_items):
-      (tester, command, dirpath) = self.queue.popleft()
-      saved_dir = os.getcwd()
-      sys.path.append(os.path.abspath(dirpath))
-      os.chdir(dirpath)
-      # We want to avoid "dual" recursion so pass a False flag here
-      self.run(tester, command, recurse=False, slot_check=slot_check)
-      os.chdir(saved_dir)
-      sys.path.pop()
+    self.jobs[job_index] = (p, command, tester, clock(), capture, slots)
+    # The wall clock time of the launch, file modification times are compared with it
+    self.resource_usage[tester.specs['test_name']] = {'slots' : slots, 'launched' : wallclock()}
+    self.slots_in_use = self.slots_in_use + slots
 
   ## Return control the the test harness by finalizing the test output and calling the callback
   def returnToTestHarness(self, job_index):
-    (p, command, tester, time, f, slots) = self.jobs[job_index]
+    (p, command, tester, time, capture, slots) = self.jobs[job_index]
+    end_time = clock()
+
+    # The test brought down its application server, it runs again in a process of its own
+    if isinstance(p, ServerRequest) and p.crashed:
+      log( 'Command %d crashed its server: %s' % (job_index, command) )
+      capture.close()
+      self.app_servers.exclude(tester.specs['test_name'])
+      self.jobs[job_index] = None
+      self.slots_in_use = self.slots_in_use - slots
+      self.dag.pushBack((tester, command, p.dirpath))
+      return
 
     log( 'Command %d done:    %s' % (job_index, command) )
-    did_pass = True
 
-    output = 'Working Directory: ' + tester.specs['test_dir'] + '\nRunning command: ' + command + '\n'
-    output += self.readOutput(f)
+    # Read the rest of the output and hand the pattern matches found in it to the tester
+    capture.close()
+    tester.output_matches = capture.getMatches()
+
+    output = capture.getOutput()
     if p.poll() == None: # process has not completed, it timed out
       output += '\n' + "#"*80 + '\nProcess terminated by test harness. Max time exceeded (' + str(tester.specs['max_time']) + ' seconds)\n' + "#"*80 + '\n'
-      f.close()
       if platform.system() == "Windows":
         p.terminate()
       else:
         pgid = os.getpgid(p.pid)
         os.killpg(pgid, SIGTERM)
-
-      if not self.harness.testOutputAndFinish(tester, RunParallel.TIMEOUT, output, time, clock()):
-        did_pass = False
+      retcode = RunParallel.TIMEOUT
     else:
-      f.close()
-
       if tester in self.reported_jobs:
         tester.specs.addParam('caveats', ['FINISHED'], "")
+      retcode = p.returncode
 
-      if not self.harness.testOutputAndFinish(tester, p.returncode, output, time, clock()):
-        did_pass = False
+    self.jobs[job_index] = None
+    self.slots_in_use = self.slots_in_use - slots
+
+    if self.post_processing != None:
+      self.post_processing.submit(tester, retcode, output, (time, clock(), end_time - time, slots))
+    else:
+      did_pass = self.harness.testOutputAndFinish(tester, retcode, output, time, clock())
+      self.jobDone(tester, did_pass, end_time - time, slots)
+
+  ## Report the jobs whose output has been checked by the post-processing threads, returns
+  # the number of jobs reported
+  def collectResults(self):
+    jobs = self.post_processing.collect()
+    for job in jobs:
+      (start, end, seconds, slots) = job.data
+      (reason, output) = job.result
+      did_pass = self.harness.reportTestResult(job.tester, reason, output, start, end)
+      self.jobDone(job.tester, did_pass, seconds, slots)
+    return len(jobs)
+
+  ## Return the number of finished jobs whose result has not been reported yet
+  def postProcessing(self):
+    if self.post_processing == None:
+      return 0
+    return self.post_processing.pendingCount()
+
+  ## Record the outcome of a job that ran for the given number of seconds
+  def jobDone(self, tester, did_pass, seconds, slots):
+    # Only complete runs are representative of how long a test takes
+    if did_pass and self.history != None and not self.options.dry_run and tester.shouldExecute():
+      test_name = tester.specs['test_name']
+      self.history.record(test_name, seconds, slots, self.getResourceUsage(test_name).get('max_rss'))
 
     if did_pass:
-      self.finished_jobs.add(tester.specs['test_name'])
+      self.jobPassed(tester)
     else:
-      self.skipped_jobs.add(tester.specs['test_name'])
+      self.jobFailed(tester)
 
-    self.jobs[job_index] = None
-    self.slots_in_use = self.slots_in_use - slots
+  ## Record a passing job and make the jobs waiting on it ready
+  def jobPassed(self, tester):
+    self.finished_jobs.add(tester.specs['test_name'])
+    self.dag.jobFinished(tester.specs['test_name'])
+
+  ## Record a failed job and skip everything that depends on it
+  def jobFailed(self, tester):
+    self.skipped_jobs.add(tester.specs['test_name'])
+    for (dependent, command, dirpath) in self.dag.jobSkipped(tester.specs['test_name']):
+      self.harness.handleTestResult(dependent.specs, '', 'skipped (skipped dependency)')
+      self.skipped_jobs.add(dependent.specs['test_name'])
 
   ## Don't return until one of the running processes exits.
   #
   # When a process exits (or times out) call returnToTestHarness and return from
-  # this function.
-  def spinwait(self, time_to_wait=0.05):
+  # this function. If nothing has finished yet we block until a child exits or
+  # the next deadline (timeout or progress report) passes. time_to_wait puts an
+  # upper bound on that block for callers that need to re-check other state.
+  def spinwait(self, time_to_wait=None):
     now = clock()
+    if self.sample_memory and now >= self.last_sample + self.SAMPLE_INTERVAL:
+      self.sampleMemory()
+
     job_index = 0
     slot_freed = False
+    if self.post_processing != None and self.collectResults():
+      self.reported_timer = now
+      slot_freed = True
+
     for tuple in self.jobs:
       if tuple != None:
-        (p, command, tester, start_time, f, slots) = tuple
-        if p.poll() != None or now > (start_time + float(tester.specs['max_time'])):
+        (p, command, tester, start_time, capture, slots) = tuple
+        if self.reapJob(job_index) or now > (start_time + float(tester.specs['max_time'])):
           # finish up as many jobs as possible, don't sleep until
           # we've cleared all of the finished jobs
           self.returnToTestHarness(job_index)
@@ -212,14 +525,7 @@ class RunParallel:
         elif now > (self.reported_timer + 10.0):
           # Has the current test been previously reported?
           if tester not in self.reported_jobs:
-            if tester.specs.isValid('min_reported_time'):
-              start_min_threshold = start_time + float(tester.specs['min_reported_time'])
-            else:
-              start_min_threshold = start_time + (0.1 * float(tester.specs['max_time']))
-
-            threshold = max(start_min_threshold, (0.1 * float(tester.specs['max_time'])))
-
-            if now >= threshold:
+            if now >= self.reportThreshold(tester, start_time):
               self.harness.handleTestResult(tester.specs, '', 'RUNNING...', start_time, now, False)
 
               self.reported_jobs.add(tester)
@@ -228,109 +534,311 @@ class RunParallel:
       job_index += 1
 
     if not slot_freed:
-      sleep(time_to_wait)
+      if self.child_watcher != None:
+        # Also wake up to read the output of the running jobs
+        captures = {}
+        for tuple in self.jobs:
+          if tuple != None and tuple[4].fileno() != None:
+            captures[tuple[4].fileno()] = tuple[4]
+
+        fds = captures.keys() + self.wakeup_fds
+        if self.app_servers != None:
+          fds += self.app_servers.filenos()
+        if self.post_processing != None:
+          fds.append(self.post_processing.fileno())
+
+        for fd in self.child_watcher.wait(self.nextDeadline(time_to_wait), fds):
+          if fd in captures:
+            captures[fd].read()
+      else:
+        if time_to_wait == None:
+          time_to_wait = 0.05
+        sleep(time_to_wait)
+
+  ## Check whether the process in the given slot has exited, without blocking
+  #
+  # The process is reaped with wait4 when possible so that its resource usage can be
+  # recorded. Returns True if the process is no longer running.
+  def reapJob(self, job_index):
+    (p, command, tester, start_time, capture, slots) = self.jobs[job_index]
+
+    # Requests to an application server are not processes of their own
+    if self.child_watcher == None or p.returncode != None or isinstance(p, ServerRequest):
+      return p.poll() != None
+
+    # The I/O counters of the process are gone once it is reaped, they are read once it exited
+    io = None
+    if ResourceUsage.hasExited(p.pid) != False:
+      io = ResourceUsage.readIO(p.pid)
 
-  def satisfyLoad(self):
-    # Get the current load average, or zero if it isn't available for some reason (such as being
-    #   run on a non-posix operating system)
-    loadAverage = 0.0
     try:
-      loadAverage = os.getloadavg()[0]
-    except AttributeError:
-      pass      # getloadavg() not available in this implementation of os
+      (pid, status, rusage) = os.wait4(p.pid, os.WNOHANG)
+    except OSError, e:
+      if e.errno == errno.ECHILD:
+        # Already reaped elsewhere, let Popen sort out the return code
+        return p.poll() != None
+      raise
 
-    # We'll always run at least one job regardless of load or we'll starve!
-    while self.jobs.count(None) < len(self.jobs) and loadAverage >= self.average_load:
+    if pid == 0:
+      return False
 
-#      print "DEBUG: Sleeping... ", len(self.jobs) - self.jobs.count(None), " jobs running (load average: ", os.getloadavg()[0], ")\n"
-      self.spinwait(0.5) # If the load average is high we'll sleep longer here to let things clear out
-#      print "DEBUG: Ready to run (load average: ", os.getloadavg()[0], ")\n"
+    if os.WIFSIGNALED(status):
+      p.returncode = -os.WTERMSIG(status)
+    else:
+      p.returncode = os.WEXITSTATUS(status)
+
+    # ru_maxrss is reported in bytes on OS X and kilobytes everywhere else
+    max_rss = rusage.ru_maxrss
+    if platform.system() == "Darwin":
+      max_rss = max_rss / 1024
+    # Without /proc the blocks (of 512 bytes) counted by the kernel are the next best thing
+    if io == None:
+      io = (rusage.ru_inblock * 512, rusage.ru_oublock * 512)
+
+    usage = self.resource_usage[tester.specs['test_name']]
+    usage.update({'max_rss' : max_rss, 'peak_rss' : max(usage.get('peak_rss', 0), max_rss),
+                  'user_time' : rusage.ru_utime, 'sys_time' : rusage.ru_stime,
+                  'read_bytes' : io[0], 'write_bytes' : io[1]})
+    return True
+
+  ## Record the memory used by all processes of each running job, keeping the peak
+  #
+  # The largest process is all the rusage of a job reports, this adds up all of its
+  # processes (the MPI ranks). Jobs shorter than SAMPLE_INTERVAL may not be sampled at all.
+  def sampleMemory(self):
+    self.last_sample = clock()
+    running = {}
+    for tuple in self.jobs:
+      if tuple != None:
+        running[tuple[0].pid] = tuple[2].specs['test_name']
+    if len(running) == 0:
+      return
 
-  ## Wait until all processes are done, then return
+    for (session, rss) in ResourceUsage.readSessionRSS(running.keys()).iteritems():
+      usage = self.resource_usage[running[session]]
+      usage['peak_rss'] = max(usage.get('peak_rss', 0), rss)
+
+  ## Return the time after which a running test is reported as taking a long time
+  def reportThreshold(self, tester, start_time):
+    if tester.specs.isValid('min_reported_time'):
+      start_min_threshold = start_time + float(tester.specs['min_reported_time'])
+    else:
+      start_min_threshold = start_time + (0.1 * float(tester.specs['max_time']))
+
+    return max(start_min_threshold, (0.1 * float(tester.specs['max_time'])))
+
+  ## Return the number of seconds until something other than a child exiting needs attention
+  #
+  # This is the earliest of the job timeouts, the next "RUNNING..." report and the optional
+  # caller supplied limit.
+  def nextDeadline(self, time_to_wait=None):
+    now = clock()
+    deadlines = []
+    if time_to_wait != None:
+      deadlines.append(now + time_to_wait)
+
+    for tuple in self.jobs:
+      if tuple != None:
+        (p, command, tester, start_time, capture, slots) = tuple
+        deadlines.append(start_time + float(tester.specs['max_time']))
+        if tester not in self.reported_jobs:
+          deadlines.append(max(self.reported_timer + 10.0, self.reportThreshold(tester, start_time)))
+
+    if len(deadlines) == 0:
+      # Nothing is running, only results still being checked are worth waiting for
+      if self.postProcessing():
+        return None
+      return 0
+    if self.sample_memory:
+      deadlines.append(self.last_sample + self.SAMPLE_INTERVAL)
+    # Add a small margin so the expired deadline is seen on the next pass
+    return max(min(deadlines) - now, 0) + 0.01
+
+  ## Return the (pattern, flags) tuples the output of a job is searched for as it runs
+  def getOutputPatterns(self, tester):
+    return tester.getOutputPatterns(self.options) + self.harness.getOutputPatterns()
+
+  ## Return the resource usage recorded for a finished test (empty if not available)
+  def getResourceUsage(self, test_name):
+    return self.resource_usage.get(test_name, {})
+
+  ## Run every job in the graph, returning once all processes are done
   def join(self):
-    while self.jobs.count(None) != len(self.jobs):
-      self.spinwait()
-      self.startReadyJobs(slot_check=True)
-
-    # At this point there are no running jobs but there may still be jobs in queue
-    # for three reasons:
-    # 1) There are testers that require more slots than were available for this run.
-    # 2) There is a tester that is waiting on a prereq that was skipped.
-    # 3) There is an invalid or cyclic dependency in one or more test specifications
-
-    # Handle the first case if the user has not explicitely provided a jobs argument
-    # We'll allow larger jobs if the TestHarness is run with without any jobs argument
-    if len(self.big_queue) and self.soft_limit:
-      print "\nOversized Jobs:\n"
+    self.buildGraph()
 
-      # Dump the big jobs into the front of the queue
-      self.queue.extendleft(self.big_queue)
-      # Run the queue again without the slot check
-      self.startReadyJobs(slot_check=False)
-      while self.jobs.count(None) != len(self.jobs):
-        self.spinwait()
-        self.startReadyJobs(slot_check=False)
-
-    # If we had a soft limit then we'll have run the oversized jobs but we still
-    # have three cases (see note above) of jobs left to handle. We'll do that here
-    if len(self.queue) != 0:
-      keep_going = True
-      while keep_going:
-        keep_going = False
-        queue_items = len(self.queue)
-        for i in range(0, queue_items):
-          (tester, command, dirpath) = self.queue.popleft()
-          slots = tester.getProcs(self.options) * tester.getThreads(self.options)
-
-          # If the user is running the script with no options, we'll just exceed the slots for
-          # these remaining big jobs. Otherwise, we'll skip them
-          if not self.soft_limit and slots > self.job_slots:
-            self.harness.handleTestResult(tester.specs, '', 'skipped (Insufficient slots)')
-            self.skipped_jobs.add(tester.specs['test_name'])
-            keep_going = True
-          # Do we have unsatisfied dependencies left?
-          elif len(set(tester.specs['prereq']) & self.skipped_jobs):
-            self.harness.handleTestResult(tester.specs, '', 'skipped (skipped dependency)')
-            self.skipped_jobs.add(tester.specs['test_name'])
-            keep_going = True
-          # We need to keep trying in case there is a chain of unresolved dependencies
-          # and we hit them out of order in this loop
-          else:
-            self.queue.append([tester, command, dirpath])
-
-      # Anything left is a cyclic dependency
-      if len(self.queue) != 0:
-        print "\nCyclic or Invalid Dependency Detected!"
-        for (tester, command, dirpath) in self.queue:
-          print tester.specs['test_name']
-        sys.exit(1)
-
-  # This function reads output from the file (i.e. the test output)
-  # but trims it down to the specified size.  It'll save the first two thirds
-  # of the requested size and the last third trimming from the middle
-  def readOutput(self, f, max_size=100000):
-    first_part = int(max_size*(2.0/3.0))
-    second_part = int(max_size*(1.0/3.0))
-    output = ''
-
-    f.seek(0)
-    if self.harness.options.sep_files != True:
-      output = f.read(first_part)     # Limit the output to 1MB
-      if len(output) == first_part:   # This means we didn't read the whole file yet
-        output += "\n" + "#"*80 + "\n\nOutput trimmed\n\n" + "#"*80 + "\n"
-        f.seek(-second_part, 2)       # Skip the middle part of the file
-
-        if (f.tell() <= first_part):  # Don't re-read some of what you've already read
-          f.seek(first_part+1, 0)
-
-    output += f.read()              # Now read the rest
-    return output
+    if self.child_watcher != None:
+      self.child_watcher.start()
+    try:
+      self.startReadyJobs()
+      while self.jobs.count(None) != len(self.jobs) or self.postProcessing():
+        # Check the load again in a little while when jobs are held back
+        if self.held:
+          self.spinwait(self.GOVERNOR_INTERVAL)
+        else:
+          self.spinwait()
+        self.startReadyJobs()
+    finally:
+      if self.child_watcher != None:
+        self.child_watcher.stop()
+
+    if self.app_servers != None:
+      self.app_servers.shutdown()
+    if self.post_processing != None:
+      self.post_processing.shutdown()
+
+  ## Check the graph of jobs and prepare it for handing out jobs
+  def buildGraph(self):
+    if self.options.shard:
+      self.selectShard()
+
+    # Jobs that do not need to run are finished right away, their dependents do not wait for them
+    finished = [name for name in self.dag.jobs if name in self.finished_results]
+    for name in sorted(finished, key=lambda name: self.dag.order[name]):
+      tester = self.dag.getJob(name)[0]
+      self.dag.discardJobs([name])
+      self.finished_jobs.add(name)
+      self.harness.handleTestResult(tester.specs, '', self.finished_results[name], executed=False)
+
+    # PBS jobs are launched through the cluster launcher which handles its own ordering
+    (skipped_dependency, invalid, cyclic, duplicate) = self.dag.build(self.skipped_jobs, self.options.pbs != None, self.finished_jobs)
+
+    # Dependency problems and tests that share a name are fatal and reported before anything is launched
+    if len(duplicate):
+      print "\nDuplicate Test Names Detected!"
+      for name in duplicate:
+        print name
+    if len(invalid) or len(cyclic):
+      print "\nCyclic or Invalid Dependency Detected!"
+      for name in invalid + cyclic:
+        print name
+    if len(duplicate) or len(invalid) or len(cyclic):
+      sys.exit(1)
+
+    # Jobs waiting on a test that will never run are skipped right away
+    for name in skipped_dependency:
+      for (tester, command, dirpath) in self.dag.removeJob(name):
+        self.harness.handleTestResult(tester.specs, '', 'skipped (skipped dependency)')
+        self.skipped_jobs.add(tester.specs['test_name'])
 
+    self.dag.computePriorities(self.estimateRuntime)
+
+  ## Drop the jobs that belong to the other shards (--shard)
+  #
+  # Jobs connected through prereqs (including both parts of recover tests) always end up
+  # in the same shard, see Shards.partition. Every shard has to arrive at the same split,
+  # so the runtime history of this machine (written at the end of every run) is never
+  # used: the shards are balanced with the read-only snapshot given to all of them with
+  # --shard-history, and the tests are placed by hashing their names without one.
+  def selectShard(self):
+    (index, count) = self.options.shard
+    groups = self.dag.connectedJobs()
+
+    snapshot = getattr(self.harness, 'shard_history', None)
+    runtime = lambda name: None
+    typical_runtime = None
+    if snapshot != None:
+      runtime = snapshot.getRuntime
+      typical_runtime = snapshot.getTypicalRuntime()
+
+    total = 0
+    for (group, shard) in zip(groups, Shards.partition(groups, count, runtime, typical_runtime)):
+      total += len(group)
+      for name in group:
+        self.shards[name] = shard
+      if shard != index:
+        self.dag.discardJobs(group)
+
+    print 'Running shard %d of %d: %d of %d tests' % (index, count, len(self.dag.jobs), total)
+
+  ## Return whether a test is reported by this shard (--shard)
+  #
+  # Jobs in the graph belong to the shard selectShard placed them in, tests that never made it
+  # into the graph (skipped ones) to the shard their name hashes to.
+  def inShard(self, test_name):
+    if not self.options.shard:
+      return True
+    (index, count) = self.options.shard
+    return self.shards.get(test_name, Shards.hashShard(test_name, count)) == index
 
   # Add a skipped job to the list
   def jobSkipped(self, name):
     self.skipped_jobs.add(name)
 
+  ## Kill the jobs that are still running, nobody is waiting for them anymore
+  def killJobs(self):
+    for job in self.jobs:
+      if job != None and job[0].poll() == None:
+        try:
+          os.killpg(os.getpgid(job[0].pid), SIGTERM)
+        except OSError:
+          pass
+
+## Wakes the scheduler as soon as a child process exits
+#
+# SIGCHLD is routed through the wakeup file descriptor of the signal module so a select()
+# on the read end of the pipe returns as soon as any child terminates. This replaces the
+# fixed sleep between polls so a freed slot is refilled immediately.
+#
+# The handler is only installed between start() and stop() (while RunParallel.join runs),
+# so the processes forked before that (the discovery pool, for one) do not inherit it.
+class ChildWatcher:
+  def __init__(self):
+    # Signal handlers can only be installed from the main thread
+    if not hasattr(signal, 'SIGCHLD') or not isinstance(threading.current_thread(), threading._MainThread):
+      raise ValueError('SIGCHLD can not be handled here')
+    self.read_fd = None
+    self.write_fd = None
+    self.previous_handler = None
+
+  ## Start routing SIGCHLD to the wakeup pipe
+  def start(self):
+    (self.read_fd, self.write_fd) = os.pipe()
+    for fd in [self.read_fd, self.write_fd]:
+      flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+      fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+      # The jobs are started with close_fds=False, they must not inherit the pipe
+      fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+    # A Python level handler is required for the wakeup fd to be written. Restart
+    # interrupted system calls so other blocking reads in the harness are unaffected.
+    self.previous_handler = signal.signal(signal.SIGCHLD, self._handler)
+    signal.siginterrupt(signal.SIGCHLD, False)
+    signal.set_wakeup_fd(self.write_fd)
+
+  ## Restore the SIGCHLD handler that was installed before start() and close the pipe
+  def stop(self):
+    if self.read_fd == None:
+      return
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGCHLD, self.previous_handler)
+    os.close(self.read_fd)
+    os.close(self.write_fd)
+    (self.read_fd, self.write_fd) = (None, None)
+
+  def _handler(self, signum, frame):
+    pass
+
+  ## Block until a child exits, one of fds is readable or timeout seconds pass (forever if timeout is None)
+  #
+  # Returns the list of readable fds.
+  def wait(self, timeout=None, fds=[]):
+    readable = []
+    try:
+      readable = select.select([self.read_fd] + list(fds), [], [], timeout)[0]
+    except select.error, e:
+      if e.args[0] != errno.EINTR:
+        raise
+
+    # Empty the pipe, we only care that something happened
+    try:
+      while os.read(self.read_fd, 4096):
+        pass
+    except OSError, e:
+      if e.errno != errno.EAGAIN:
+        raise
+
+    return [fd for fd in readable if fd != self.read_fd]
+
 ## Static logging string for debugging
 LOG = []
 LOG_ON = False
@@ -0,0 +1,134 @@
+import os, errno, time
+
+try:
+  from sqlite3 import dbapi2 as sqlite
+except ImportError:
+  sqlite = None
+
+## Number of runs the recorded values are averaged over
+HISTORY_WINDOW = 5
+
+CREATE_TABLE = """create table if not exists runtime_history
+(
+  app_name text,
+  test_name text,
+  seconds real,
+  slots int,
+  max_rss int,
+  runs int,
+  updated real,
+  primary key (app_name, test_name)
+);"""
+
+## The wall time, slots and peak memory use of the tests of previous runs
+#
+# The history is a sqlite database so that it can be shared between several
+# runs (CI workers pointing at the same file, for example). Entries are only
+# read when the harness starts, new measurements are merged into whatever is in
+# the database at the time save() is called so concurrent runs do not lose each
+# other's updates. Each value is a moving average over the last few runs.
+class RuntimeHistory:
+  def __init__(self, filename, app_name):
+    self.filename = filename
+    self.app_name = app_name
+
+    ## Entries read at start up as {test_name : (seconds, slots, max_rss, runs)}
+    self.entries = {}
+
+    ## Measurements taken during this run as {test_name : (seconds, slots, max_rss)}
+    self.updates = {}
+
+    if not os.path.exists(self.filename):
+      return
+
+    try:
+      con = sqlite.connect(self.filename, timeout=30)
+      try:
+        cr = con.cursor()
+        cr.execute(CREATE_TABLE)
+        cr.execute('select test_name, seconds, slots, max_rss, runs from runtime_history where app_name = ?', (self.app_name,))
+        for (test_name, seconds, slots, max_rss, runs) in cr.fetchall():
+          self.entries[test_name] = (seconds, slots, max_rss, runs)
+      finally:
+        con.close()
+    except sqlite.Error, ex:
+      print 'Warning: unable to read the runtime history ' + self.filename + ': ' + str(ex)
+
+  ## Return the expected wall time of a test in seconds or None if it has never been run
+  def getRuntime(self, test_name):
+    if test_name in self.entries:
+      return self.entries[test_name][0]
+    return None
+
+  ## Return the median runtime of all tests with a history, or None if there is no history
+  def getTypicalRuntime(self):
+    if not hasattr(self, 'typical_runtime'):
+      runtimes = sorted([entry[0] for entry in self.entries.itervalues()])
+      if len(runtimes):
+        self.typical_runtime = runtimes[len(runtimes) / 2]
+      else:
+        self.typical_runtime = None
+    return self.typical_runtime
+
+  ## Return the peak memory use of a test in KB or None if it is not known
+  def getMaxRSS(self, test_name):
+    if test_name in self.entries:
+      return self.entries[test_name][2]
+    return None
+
+  ## Return the median peak memory use of all tests with a history, or None if there is no history
+  def getTypicalMaxRSS(self):
+    if not hasattr(self, 'typical_max_rss'):
+      values = sorted([entry[2] for entry in self.entries.itervalues() if entry[2] != None])
+      if len(values):
+        self.typical_max_rss = values[len(values) / 2]
+      else:
+        self.typical_max_rss = None
+    return self.typical_max_rss
+
+  ## Record a measurement of a finished test, max_rss (in KB) may be None if it is not known
+  def record(self, test_name, seconds, slots, max_rss=None):
+    self.updates[test_name] = (seconds, slots, max_rss)
+
+  ## Return the average of a recorded value and a new measurement
+  def average(self, old, new, runs):
+    if old == None:
+      return new
+    if new == None:
+      return old
+    return old + (new - old) / float(min(runs + 1, HISTORY_WINDOW))
+
+  ## Merge the measurements of this run into the database
+  def save(self):
+    if len(self.updates) == 0:
+      return
+
+    try:
+      os.makedirs(os.path.dirname(os.path.abspath(self.filename)))
+    except OSError, ex:
+      if ex.errno != errno.EEXIST:
+        raise
+
+    try:
+      con = sqlite.connect(self.filename, timeout=30)
+      try:
+        cr = con.cursor()
+        cr.execute(CREATE_TABLE)
+        now = time.time()
+        for (test_name, (seconds, slots, max_rss)) in self.updates.iteritems():
+          cr.execute('select seconds, max_rss, runs from runtime_history where app_name = ? and test_name = ?', (self.app_name, test_name))
+          row = cr.fetchone()
+          if row != None:
+            (old_seconds, old_max_rss, runs) = row
+            seconds = self.average(old_seconds, seconds, runs)
+            max_rss = self.average(old_max_rss, max_rss, runs)
+          else:
+            runs = 0
+          cr.execute('insert or replace into runtime_history values (?, ?, ?, ?, ?, ?, ?)',
+                     (self.app_name, test_name, seconds, slots, max_rss, runs + 1, now))
+        con.commit()
+      finally:
+        con.close()
+    except sqlite.Error, ex:
+      print 'Warning: unable to write the runtime history ' + self.filename + ': ' + str(ex)
+    self.updates = {}
@@ -0,0 +1,53 @@
+import sys, re, hashlib
+
+## Parse "i/N" (1 <= i <= N) into the tuple (i, N), exiting with an error if it is not valid
+def parseShard(text):
+  m = re.match(r'\s*(\d+)\s*/\s*(\d+)\s*$', text)
+  if m:
+    (index, count) = (int(m.group(1)), int(m.group(2)))
+    if 1 <= index <= count:
+      return (index, count)
+  print 'ERROR: Invalid shard "' + text + '", expected i/N with 1 <= i <= N'
+  sys.exit(1)
+
+## Return the shard (1 to count) a test name hashes to
+#
+# md5 is used since the builtin hash differs between platforms and Python versions.
+def hashShard(name, count):
+  return int(hashlib.md5(name).hexdigest(), 16) % count + 1
+
+## Split groups of test names that must run together into count shards
+#
+# Groups without any runtime history are placed by hashing their first name (in sorted
+# order), so they stay put as other tests come and go. The groups with a history are then
+# spread over the shards largest first, each going to the shard with the least work so
+# far. runtime is called with a test name and returns its measured runtime or None. Tests
+# without one count as typical_runtime (None when there is no history at all).
+#
+# Every shard has to arrive at the same split, so all of them must see the same tests and
+# the same runtime history (see RunParallel.selectShard). The order of the groups does not
+# matter, and without any history the shard of a group does not depend on the other groups
+# either. Returns the shard (1 to count) of each group.
+def partition(groups, count, runtime, typical_runtime=None):
+  loads = [0.0] * count
+  shards = [None] * len(groups)
+
+  timed = []
+  for i, group in enumerate(groups):
+    runtimes = [runtime(name) for name in group]
+    known = [seconds for seconds in runtimes if seconds != None]
+    if len(known) == 0:
+      shards[i] = hashShard(min(group), count)
+      if typical_runtime != None:
+        loads[shards[i] - 1] += typical_runtime * len(group)
+    else:
+      weight = sum(known) + (len(group) - len(known)) * (typical_runtime or 0.0)
+      timed.append((-weight, min(group), i))
+
+  timed.sort()
+  for (weight, name, i) in timed:
+    lightest = loads.index(min(loads))
+    shards[i] = lightest + 1
+    loads[lightest] -= weight
+
+  return shards
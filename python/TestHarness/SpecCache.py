@@ -0,0 +1,96 @@
+import os, hashlib
+import ParseGetPot
+from util import loadPickle, dumpPickle
+
+## Bump this when the cached data (or the GPNode layout) changes
+CACHE_VERSION = 1
+
+## A persistent cache of parsed test specification files
+#
+# The raw GPNode tree produced by ParseGetPot is stored for every spec file, keyed
+# on the path and validated against the file's mtime and size. When those change
+# the content hash is checked before the file is considered modified, so touching
+# a file (or a fresh checkout) does not force it to be parsed again. The Testers
+# and their InputParameters are always rebuilt from the cached tree, so changes to
+# the validParams of the tester plugins can never be masked by the cache.
+class SpecCache:
+  def __init__(self, cache_dir):
+    self.filename = os.path.join(cache_dir, 'spec_trees.pickle')
+    self.modified = False
+
+    # The cache is only valid for the parser that produced it
+    self.signature = (CACHE_VERSION, self.parserStamp())
+
+    data = loadPickle(self.filename, {})
+    if data.get('signature') == self.signature:
+      self.entries = data['entries']
+    else:
+      self.entries = {}
+      self.modified = True
+
+  ## Return the modification time and size of the parser that produces the trees
+  def parserStamp(self):
+    source = os.path.splitext(ParseGetPot.__file__)[0] + '.py'
+    try:
+      stat = os.stat(source)
+      return (stat.st_mtime, stat.st_size)
+    except OSError:
+      return None
+
+  ## Return the cached tree for a spec file or None if the file changed since it was cached
+  def lookup(self, spec_file):
+    if spec_file not in self.entries:
+      return None
+
+    (mtime, size, digest, root) = self.entries[spec_file]
+    try:
+      stat = os.stat(spec_file)
+    except OSError:
+      return None
+
+    if (stat.st_mtime, stat.st_size) == (mtime, size):
+      return root
+
+    # The file was touched, see if the content really changed
+    if stat.st_size == size and self.contentHash(spec_file) == digest:
+      self.entries[spec_file] = (stat.st_mtime, stat.st_size, digest, root)
+      self.modified = True
+      return root
+
+    return None
+
+  ## Store the tree read from a spec file
+  def store(self, spec_file, root):
+    # Errors are not cached so that they are reported on every run
+    if isinstance(root, ParseGetPot.ParseException):
+      return
+
+    try:
+      stat = os.stat(spec_file)
+    except OSError:
+      return
+
+    self.entries[spec_file] = (stat.st_mtime, stat.st_size, self.contentHash(spec_file), root)
+    self.modified = True
+
+  def contentHash(self, spec_file):
+    f = open(spec_file, 'rb')
+    try:
+      return hashlib.md5(f.read()).hexdigest()
+    finally:
+      f.close()
+
+  ## Write the cache back to disk if anything changed, dropping spec files that no longer exist
+  def save(self):
+    if not self.modified:
+      return
+
+    for spec_file in self.entries.keys():
+      if not os.path.exists(spec_file):
+        del self.entries[spec_file]
+
+    try:
+      dumpPickle(self.filename, {'signature' : self.signature, 'entries' : self.entries})
+    except (IOError, OSError), ex:
+      print 'Warning: unable to write the test spec cache ' + self.filename + ': ' + str(ex)
+    self.modified = False
@@ -1,14 +1,26 @@
-import os, sys, re, inspect, types, errno, pprint, subprocess, io, shutil, time, copy
+import os, sys, re, inspect, types, errno, pprint, subprocess, io, shutil, copy, multiprocessing, json
 import path_tool
 
 path_tool.activate_module('FactorySystem')
 path_tool.activate_module('argparse')
 
-from ParseGetPot import ParseGetPot
+import ParseGetPot
 from socket import gethostname
 #from options import *
 from util import *
+from ResourceUsage import formatUsage
 from RunParallel import RunParallel
+import RunDistributed
+import Shards
+from SpecCache import SpecCache
+from ConfigCache import ConfigCache
+import RuntimeHistory
+import TimingDatabase
+from LastRunState import LastRunState
+from RunJournal import RunJournal
+import DependencyIndex
+import ArtifactCache
+from HarnessProfiler import HarnessProfiler
 from CSVDiffer import CSVDiffer
 from XMLDiffer import XMLDiffer
 from Tester import Tester
@@ -22,26 +34,97 @@ import argparse
 from optparse import OptionParser, OptionGroup, Values
 from timeit import default_timer as clock
 
+## Seconds to wait on a process pool result. Waiting with a timeout keeps Ctrl-C working.
+TIMEOUT_FOREVER = 60 * 60 * 24 * 365
+
+## Size of the write buffer of the --results-json file
+RESULTS_JSON_BUFFER = 65536
+
+## Patterns for the timing reported by --timing and --store-timing
+TIMING_PATTERN = r"Active time=(\S+)"
+SOLVE_TIME_PATTERN = r"solve().*"
+
+## Walk the tree below top and return the test specification files found in it
+#
+# This runs in a process pool so it is kept at module level. Submodules below the
+# base directory and contrib directories are not searched.
+def findSpecFilesIn(args):
+  (top, base_dir, input_file_name) = args
+  spec_files = []
+  for dirpath, dirnames, filenames in os.walk(top, followlinks=True):
+    # Prune submdule paths when searching for tests
+    if base_dir != dirpath and os.path.exists(os.path.join(dirpath, '.git')):
+      dirnames[:] = []
+
+    # Don't walk into contrib directories
+    if "contrib" in os.path.relpath(dirpath, base_dir):
+      dirnames[:] = []
+      continue
+
+    if input_file_name in filenames:
+      spec_files.append(os.path.join(dirpath, input_file_name))
+  return spec_files
+
+## Read a single test specification file, returning the root GPNode or the ParseException raised
+#
+# This runs in a process pool so it is kept at module level.
+def readSpecFile(spec_file):
+  saved_cwd = os.getcwd()
+  os.chdir(os.path.dirname(spec_file))
+  try:
+    return ParseGetPot.readInputFile(os.path.basename(spec_file))
+  except ParseGetPot.ParseException, ex:
+    return ex
+  finally:
+    os.chdir(saved_cwd)
+
 class TestHarness:
 
   @staticmethod
   def buildAndRun(argv, app_name, moose_dir):
-    if '--store-timing' in argv:
+    if '--store-timing' in argv or '--perf-check' in argv:
       harness = TestTimer(argv, app_name, moose_dir)
+    elif '--worker' in argv:
+      harness = TestWorker(argv, app_name, moose_dir)
     else:
       harness = TestHarness(argv, app_name, moose_dir)
 
     harness.findAndRunTests()
 
+    if harness.profiler != None:
+      harness.profiler.finish(os.path.join(harness.output_dir, harness.options.profile_harness))
+
     sys.exit(harness.error_code)
 
 
   def __init__(self, argv, app_name, moose_dir):
+    # Everything from here on counts towards the time of the harness with --profile-harness
+    self.init_time = clock()
+
     self.factory = Factory()
 
     # Build a Warehouse to hold the MooseObjects
     self.warehouse = Warehouse()
 
+    self.run_tests_dir = os.path.abspath('.')
+
+    # The cache options are needed before the rest of the command line can be parsed
+    # (the tester plugins have to be loaded first) so they are picked out here
+    cache_parser = argparse.ArgumentParser(add_help=False)
+    cache_parser.add_argument('--cache-dir', nargs=1, dest='cache_dir')
+    cache_parser.add_argument('--no-cache', action='store_true', dest='no_cache')
+    cache_options = cache_parser.parse_known_args(argv[1:])[0]
+
+    # Persistent data (parsed specs, configuration checks, etc.) is kept here between runs
+    if cache_options.cache_dir:
+      self.cache_dir = os.path.abspath(cache_options.cache_dir[0])
+    else:
+      self.cache_dir = os.path.join(self.run_tests_dir, '.testharness_cache')
+
+    self.config_cache = None
+    if not cache_options.no_cache:
+      self.config_cache = ConfigCache(self.cache_dir)
+
     # Get dependant applications and load dynamic tester plugins
     # If applications have new testers, we expect to find them in <app_dir>/scripts/TestHarness/testers
     dirs = [os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))]
@@ -49,7 +132,10 @@ class TestHarness:
 
     # Use the find_dep_apps script to get the dependant applications for an app
     import find_dep_apps
-    depend_app_dirs = find_dep_apps.findDepApps(app_name)
+    def probeDepApps():
+      searched = []
+      return (find_dep_apps.findDepApps(app_name, searched=searched), searched)
+    depend_app_dirs = self.probeConfig(('dep_apps', app_name, os.getcwd()), probeDepApps)
     dirs.extend([os.path.join(my_dir, 'scripts', 'TestHarness') for my_dir in depend_app_dirs.split('\n')])
 
     # Finally load the plugins!
@@ -63,7 +149,6 @@ class TestHarness:
     self.host_name = gethostname()
     self.moose_dir = moose_dir
     self.base_dir = os.getcwd()
-    self.run_tests_dir = os.path.abspath('.')
     self.code = '2d2d6769726c2d6d6f6465'
     self.error_code = 0x0
     # Assume libmesh is a peer directory to MOOSE if not defined
@@ -78,7 +163,7 @@ class TestHarness:
 
     self.checks = {}
     self.checks['platform'] = getPlatforms()
-    self.checks['submodules'] = getInitializedSubmodules(self.run_tests_dir)
+    self.checks['submodules'] = self.probeConfig(('submodules', self.run_tests_dir), self.probeSubmodules)
 
     # The TestHarness doesn't strictly require the existence of libMesh in order to run. Here we allow the user
     # to select whether they want to probe for libMesh configuration options.
@@ -100,23 +185,29 @@ class TestHarness:
       self.checks['cxx11'] = set(['ALL'])
       self.checks['asio'] =  set(['ALL'])
     else:
-      self.checks['compiler'] = getCompilers(self.libmesh_dir)
-      self.checks['petsc_version'] = getPetscVersion(self.libmesh_dir)
-      self.checks['library_mode'] = getSharedOption(self.libmesh_dir)
-      self.checks['mesh_mode'] = getLibMeshConfigOption(self.libmesh_dir, 'mesh_mode')
-      self.checks['dtk'] =  getLibMeshConfigOption(self.libmesh_dir, 'dtk')
-      self.checks['unique_ids'] = getLibMeshConfigOption(self.libmesh_dir, 'unique_ids')
-      self.checks['vtk'] =  getLibMeshConfigOption(self.libmesh_dir, 'vtk')
-      self.checks['tecplot'] =  getLibMeshConfigOption(self.libmesh_dir, 'tecplot')
-      self.checks['dof_id_bytes'] = getLibMeshConfigOption(self.libmesh_dir, 'dof_id_bytes')
-      self.checks['petsc_debug'] = getLibMeshConfigOption(self.libmesh_dir, 'petsc_debug')
-      self.checks['curl'] =  getLibMeshConfigOption(self.libmesh_dir, 'curl')
-      self.checks['tbb'] =  getLibMeshConfigOption(self.libmesh_dir, 'tbb')
-      self.checks['superlu'] =  getLibMeshConfigOption(self.libmesh_dir, 'superlu')
-      self.checks['unique_id'] =  getLibMeshConfigOption(self.libmesh_dir, 'unique_id')
-      self.checks['cxx11'] =  getLibMeshConfigOption(self.libmesh_dir, 'cxx11')
+      # libmesh_config.h is only scanned once for all of the options, and nothing is
+      # probed at all while the cached results are still valid
+      config_file = findLibMeshConfigFile(self.libmesh_dir)
+      config_options = self.probeConfig(('libmesh_config', self.libmesh_dir),
+                                        lambda: (getLibMeshConfigOptions(self.libmesh_dir), [config_file]))
+
+      # The compiler and libtool are rewritten whenever libMesh is reconfigured
+      libmesh_config = findExecutable(self.libmesh_dir, 'bin', 'libmesh-config')
+      libtool = findExecutable(self.libmesh_dir, 'contrib/bin', 'libtool')
+      self.checks['compiler'] = self.probeConfig(('compiler', self.libmesh_dir),
+                                                 lambda: (getCompilers(self.libmesh_dir), [libmesh_config, config_file]))
+      self.checks['library_mode'] = self.probeConfig(('library_mode', self.libmesh_dir),
+                                                     lambda: (getSharedOption(self.libmesh_dir), [libtool]))
+
+      self.checks['petsc_version'] = getPetscVersion(self.libmesh_dir, config_options)
+      for option in ['mesh_mode', 'dtk', 'unique_ids', 'vtk', 'tecplot', 'dof_id_bytes', 'petsc_debug', \
+                     'curl', 'tbb', 'superlu', 'unique_id', 'cxx11']:
+        self.checks[option] = set(config_options[option])
       self.checks['asio'] =  getIfAsioExists(self.moose_dir)
 
+    if self.config_cache != None:
+      self.config_cache.save()
+
     # Override the MESH_MODE option if using the '--distributed-mesh'
     # or (deprecated) '--parallel-mesh' option.
     if (self.options.parallel_mesh == True or self.options.distributed_mesh == True) or \
@@ -137,6 +228,7 @@ class TestHarness:
   0x0  - Success
   0x0* - Parser error
   0x1* - TestHarness error
+  0x40 - Performance regression (--perf-check)
   """
   def findAndRunTests(self, find_only=False):
     self.error_code = 0x0
@@ -155,91 +247,101 @@ class TestHarness:
       else:
         self.options.processingPBS = False
         self.base_dir = os.getcwd()
-        for dirpath, dirnames, filenames in os.walk(self.base_dir, followlinks=True):
-          # Prune submdule paths when searching for tests
-          if self.base_dir != dirpath and os.path.exists(os.path.join(dirpath, '.git')):
-            dirnames[:] = []
-
-          # walk into directories that aren't contrib directories
-          if "contrib" not in os.path.relpath(dirpath, os.getcwd()):
-            for file in filenames:
-              # set cluster_handle to be None initially (happens for each test)
-              self.options.cluster_handle = None
-              # See if there were other arguments (test names) passed on the command line
-              if file == self.options.input_file_name: #and self.test_match.search(file):
-                saved_cwd = os.getcwd()
-                sys.path.append(os.path.abspath(dirpath))
-                os.chdir(dirpath)
-
-                if self.prunePath(file):
-                  continue
 
-                # Build a Parser to parse the objects
-                parser = Parser(self.factory, self.warehouse)
+        # Find and parse every test specification first, nothing is launched until this is done
+        discovered = self.discoverTests(find_only)
+        if self.options.since:
+          self.findAffectedApps(discovered)
+
+        for (dirpath, file, testers) in discovered:
+          # Short circuit this loop if we've only been asked to parse Testers
+          # Note: The warehouse will accumulate all testers in this mode
+          if find_only:
+            continue
 
-                # Parse it
-                self.error_code = self.error_code | parser.parse(file)
+          # set cluster_handle to be None initially (happens for each test)
+          self.options.cluster_handle = None
 
-                # Retrieve the tests from the warehouse
-                testers = self.warehouse.getActiveObjects()
+          saved_cwd = os.getcwd()
+          sys.path.append(os.path.abspath(dirpath))
+          os.chdir(dirpath)
 
-                # Augment the Testers with additional information directly from the TestHarness
-                for tester in testers:
-                  self.augmentParameters(file, tester)
+          if self.options.enable_recover:
+            testers = self.appendRecoverableTests(testers)
 
-                # Short circuit this loop if we've only been asked to parse Testers
-                # Note: The warehouse will accumulate all testers in this mode
-                if find_only:
-                  self.warehouse.markAllObjectsInactive()
+          if self.last_run != None:
+            self.last_run.addTests(os.path.join(dirpath, file), testers)
+          testers = self.selectTests(testers, os.path.join(dirpath, file))
+
+          # Handle PBS tests.cluster file
+          if self.options.pbs:
+            (tester, command) = self.createClusterLauncher(dirpath, testers)
+            if command is not None:
+              self.runner.run(tester, command)
+          else:
+            # Go through the Testers and run them
+            for tester in testers:
+              # Double the alloted time for tests when running with the valgrind option
+              tester.setValgrindMode(self.options.valgrind_mode)
+
+              if self.maxFailsExceeded():
+                (should_run, reason) = (False, 'Max Fails Exceeded')
+              elif tester.parameters().isValid('error_code'):
+                (should_run, reason) = (False, 'skipped (Parser Error)')
+              else:
+                (should_run, reason) = tester.checkRunnableBase(self.options, self.checks)
+
+              if should_run:
+                command = tester.getCommand(self.options)
+                # Tests that passed in the run being resumed are not run again, they are
+                # reported once the runner knows which shard they belong to
+                if self.resumeTest(tester):
+                  self.runner.run(tester, command, '[RESUMED] OK')
+                  continue
+                # The first part of a recover test does not run again when its output can be restored,
+                # it stays in the graph so it is placed in the shard of the second part
+                if self.restoreRecoverOutput(tester, command, os.path.join(dirpath, file)):
+                  self.runner.run(tester, command, '[CACHED] OK')
                   continue
+                # This method adds the job to the runner's dependency graph, nothing is launched
+                # until every test has been found and self.runner.join() is called.
+                # RunParallel will call self.testOutputAndFinish when the test has completed running
+                self.runner.run(tester, command)
+              else: # This job is skipped - notify the runner
+                if reason != '' and self.last_run != None:
+                  self.last_run.record(tester.parameters()['test_name'], self.parseResult(reason)[1])
+                if reason != '' and self.inShard(tester.parameters()['test_name']):
+                  if (self.options.report_skipped and reason.find('skipped') != -1) or reason.find('skipped') == -1:
+                    self.handleTestResult(tester.parameters(), '', reason)
+                self.runner.jobSkipped(tester.parameters()['test_name'])
+          os.chdir(saved_cwd)
+          sys.path.pop()
+    except KeyboardInterrupt:
+      print '\nExiting due to keyboard interrupt...'
+      sys.exit(0)
 
-                # Clear out the testers, we won't need them to stick around in the warehouse
-                self.warehouse.clear()
-
-                if self.options.enable_recover:
-                  testers = self.appendRecoverableTests(testers)
-
-                # Handle PBS tests.cluster file
-                if self.options.pbs:
-                  (tester, command) = self.createClusterLauncher(dirpath, testers)
-                  if command is not None:
-                    self.runner.run(tester, command)
-                else:
-                  # Go through the Testers and run them
-                  for tester in testers:
-                    # Double the alloted time for tests when running with the valgrind option
-                    tester.setValgrindMode(self.options.valgrind_mode)
-
-                    # When running in valgrind mode, we end up with a ton of output for each failed
-                    # test.  Therefore, we limit the number of fails...
-                    if self.options.valgrind_mode and self.num_failed > self.options.valgrind_max_fails:
-                      (should_run, reason) = (False, 'Max Fails Exceeded')
-                    elif self.num_failed > self.options.max_fails:
-                      (should_run, reason) = (False, 'Max Fails Exceeded')
-                    elif tester.parameters().isValid('error_code'):
-                      (should_run, reason) = (False, 'skipped (Parser Error)')
-                    else:
-                      (should_run, reason) = tester.checkRunnableBase(self.options, self.checks)
-
-                    if should_run:
-                      command = tester.getCommand(self.options)
-                      # This method spawns another process and allows this loop to continue looking for tests
-                      # RunParallel will call self.testOutputAndFinish when the test has completed running
-                      # This method will block when the maximum allowed parallel processes are running
-                      self.runner.run(tester, command)
-                    else: # This job is skipped - notify the runner
-                      if reason != '':
-                        if (self.options.report_skipped and reason.find('skipped') != -1) or reason.find('skipped') == -1:
-                          self.handleTestResult(tester.parameters(), '', reason)
-                      self.runner.jobSkipped(tester.parameters()['test_name'])
-                os.chdir(saved_cwd)
-                sys.path.pop()
+    # Launch everything that was found and wait for all tests to finish
+    try:
+      self.runner.join()
     except KeyboardInterrupt:
       print '\nExiting due to keyboard interrupt...'
+      self.runner.killJobs()
+      if self.run_journal != None:
+        self.run_journal.close()
+        print 'Run again with --resume to skip the tests that passed so far'
       sys.exit(0)
 
-    self.runner.join()
-    # Wait for all tests to finish
+    if self.runtime_history != None:
+      self.runtime_history.save()
+    if self.last_run != None:
+      self.last_run.save()
+    if self.run_journal != None:
+      self.run_journal.close()
+    if self.artifact_cache != None:
+      self.artifact_cache.save()
+      self.dependency_index.save()
+    if self.file_digests != None:
+      self.file_digests.save()
     if self.options.pbs and self.options.processingPBS == False:
       print '\n< checking batch status >\n'
       self.options.processingPBS = True
@@ -253,6 +355,126 @@ class TestHarness:
 
     return
 
+  ## Find and parse all of the test specification files below self.base_dir
+  #
+  # Walking the tree and reading the specification files are the slow parts on network
+  # filesystems, so both are spread over a process pool when running with multiple jobs.
+  # The Testers themselves are built here, in walk order, once every file has been read.
+  # Returns a list of (dirpath, filename, testers) tuples.
+  def discoverTests(self, find_only=False):
+    pool = None
+    if self.options.jobs > 1:
+      pool = multiprocessing.Pool(self.options.jobs)
+
+    try:
+      spec_files = self.findSpecFiles(pool)
+      if self.options.changed:
+        # Spec files are only read if something in them may have changed (or failed, with --failed)
+        failed = set()
+        if self.options.failed:
+          failed = self.last_run.failedSpecFiles()
+        spec_files = [spec_file for spec_file in spec_files if spec_file in failed or not self.last_run.specFileUnchanged(spec_file)]
+      trees = self.readSpecFiles(spec_files, pool)
+    finally:
+      if pool != None:
+        pool.terminate()
+
+    discovered = []
+    for (spec_file, root) in zip(spec_files, trees):
+      (dirpath, file) = os.path.split(spec_file)
+      saved_cwd = os.getcwd()
+      sys.path.append(os.path.abspath(dirpath))
+      os.chdir(dirpath)
+
+      # Build a Parser to turn the already read tree into objects
+      parser = Parser(self.factory, self.warehouse)
+
+      # Parse it
+      self.error_code = self.error_code | parser.parse(file, root)
+
+      # Retrieve the tests from the warehouse
+      testers = self.warehouse.getActiveObjects()
+
+      # Augment the Testers with additional information directly from the TestHarness
+      for tester in testers:
+        self.augmentParameters(file, tester)
+
+      if find_only:
+        self.warehouse.markAllObjectsInactive()
+      else:
+        # Clear out the testers, we won't need them to stick around in the warehouse
+        self.warehouse.clear()
+
+      os.chdir(saved_cwd)
+      sys.path.pop()
+
+      discovered.append((dirpath, file, testers))
+
+    return discovered
+
+  ## Return the paths of all of the test specification files that should be read, in walk order
+  #
+  # Each directory directly below self.base_dir is walked separately (in parallel if a pool
+  # is supplied). Paths filtered out by the test names on the command line are dropped
+  # before anything is read.
+  def findSpecFiles(self, pool=None):
+    # Only the spec files with failed tests are needed, there is no need to walk the tree
+    if self.options.failed and not self.options.changed:
+      spec_files = [spec_file for spec_file in sorted(self.last_run.failedSpecFiles()) if os.path.isfile(spec_file)]
+      return [spec_file for spec_file in spec_files if not self.prunePath(spec_file)]
+
+    spec_files = []
+    try:
+      entries = os.listdir(self.base_dir)
+    except OSError:
+      entries = []
+
+    if self.options.input_file_name in entries and os.path.isfile(os.path.join(self.base_dir, self.options.input_file_name)):
+      spec_files.append(os.path.join(self.base_dir, self.options.input_file_name))
+
+    work = []
+    for entry in entries:
+      if os.path.isdir(os.path.join(self.base_dir, entry)):
+        work.append((os.path.join(self.base_dir, entry), self.base_dir, self.options.input_file_name))
+
+    if pool != None and len(work) > 1:
+      results = pool.map_async(findSpecFilesIn, work).get(TIMEOUT_FOREVER)
+    else:
+      results = map(findSpecFilesIn, work)
+
+    for result in results:
+      spec_files.extend(result)
+
+    return [spec_file for spec_file in spec_files if not self.prunePath(spec_file)]
+
+  ## Read the given test specification files, in parallel if a pool is supplied
+  #
+  # Files that have not changed since the last run are taken from the spec cache.
+  # Returns a list with the root GPNode (or the ParseException raised) for each file.
+  def readSpecFiles(self, spec_files, pool=None):
+    if self.spec_cache != None:
+      trees = [self.spec_cache.lookup(spec_file) for spec_file in spec_files]
+    else:
+      trees = [None] * len(spec_files)
+
+    missing = [spec_file for (spec_file, root) in zip(spec_files, trees) if root == None]
+    if pool != None and len(missing) > 1:
+      read = pool.map_async(readSpecFile, missing).get(TIMEOUT_FOREVER)
+    else:
+      read = map(readSpecFile, missing)
+
+    read = iter(read)
+    for i in range(len(trees)):
+      if trees[i] == None:
+        trees[i] = read.next()
+        if self.spec_cache != None:
+          self.spec_cache.store(spec_files[i], trees[i])
+
+    if self.spec_cache != None:
+      self.spec_cache.save()
+
+    return trees
+
   def createClusterLauncher(self, dirpath, testers):
     self.options.test_serial_number = 0
     command = None
@@ -343,6 +565,7 @@ class TestHarness:
         # Part 1:
         part1_params = part1.parameters()
         part1_params['test_name'] += '_part1'
+        self.recover_part1.add(part1_params['test_name'])
         part1_params['cli_args'].append('--half-transient :Outputs/checkpoint=true')
         part1_params['skip_checks'] = True
 
@@ -358,22 +581,159 @@ class TestHarness:
     testers.extend(new_tests)
     return testers
 
+  ## Restore the output of the first part of a recover test from an earlier run, returns True if it was
+  #
+  # The output is reused when the executable (and its libraries), the input files (and the files
+  # they reference), the gold files, the depend_files and the command line are all unchanged,
+  # see ArtifactCache. Otherwise the key is remembered so the output is
+  # stored once the test passes.
+  def restoreRecoverOutput(self, tester, command, spec_file):
+    test_name = tester.specs['test_name']
+    if self.artifact_cache == None or test_name not in self.recover_part1:
+      return False
+
+    files = self.dependency_index.getDependencies(tester.specs, spec_file)
+    # Other tests in the spec file do not matter, the parameters of this one are part of the command
+    files.discard(os.path.abspath(spec_file))
+    # Only the files the test reads: whatever it writes (see ArtifactCache.collect) is rewritten
+    # by part2 and by every run, and would change the key each time
+    output_prefix = os.path.abspath(os.path.join(tester.specs['test_dir'], ArtifactCache.outputFileBase(tester.specs)))
+    files = [path for path in files if not path.startswith(output_prefix)]
+    key = self.artifact_cache.computeKey(command, files, tester.specs['executable'])
+    if not self.artifact_cache.restore(key, tester.specs['test_dir']):
+      self.artifact_keys[test_name] = key
+      return False
+
+    # A failure of part2 may be caused by the restored output, it is not used again
+    self.restored_keys[test_name[:-len('_part1')]] = key
+    return True
+
+  ## Return whether a test passed in the run being resumed and does not need to run again (--resume)
+  def resumeTest(self, tester):
+    return self.options.resume and self.run_journal.passed(tester.specs)
+
+  ## Store the output of the first part of a recover test that passed, see restoreRecoverOutput
+  def storeRecoverOutput(self, tester, start):
+    test_name = tester.specs['test_name']
+    if test_name not in self.artifact_keys:
+      return
+    # The files written since the test was launched, the result may be reported long after
+    # the test finished (see PostProcessPool) so the time is recorded by the runner
+    since = self.runner.getResourceUsage(test_name).get('launched', start)
+    files = self.artifact_cache.collect(tester.specs['test_dir'], ArtifactCache.outputFileBase(tester.specs), since)
+    self.artifact_cache.store(self.artifact_keys.pop(test_name), tester.specs['test_dir'], files)
+
+  ## Return the testers of a spec file selected by --failed, --changed and --since, along with the prereqs they need
+  #
+  # The tests depending on a test affected by --since are affected as well, since they
+  # use its output.
+  def selectTests(self, testers, spec_file):
+    if not (self.options.failed or self.options.changed or self.options.since):
+      return testers
+
+    selected = set()
+    affected = set()
+    for tester in testers:
+      name = tester.specs['test_name']
+      if (self.options.failed and self.last_run.isFailed(name)) or (self.options.changed and self.last_run.isChanged(name)):
+        selected.add(name)
+      if self.options.since and self.isAffected(tester, spec_file):
+        affected.add(name)
+
+    by_name = dict([(tester.specs['test_name'], tester) for tester in testers])
+    while True:
+      dependents = set([tester.specs['test_name'] for tester in testers if len(set(tester.specs['prereq'] or []) & affected)])
+      if dependents <= affected:
+        break
+      affected |= dependents
+    selected |= affected
+
+    stack = list(selected)
+    while len(stack):
+      tester = by_name[stack.pop()]
+      for prereq in tester.specs['prereq'] or []:
+        if prereq in by_name and prereq not in selected:
+          selected.add(prereq)
+          stack.append(prereq)
+
+    return [t for t in testers if t.specs['test_name'] in selected]
+
+  ## Work out which applications are affected by the changes that are not test inputs (--since)
+  #
+  # A changed file no test depends on (source code, mostly) affects every test of the
+  # application it belongs to: the nearest directory above it with a Makefile. When that
+  # directory holds no tests at all it is a library used by everything (the framework) and
+  # every test is affected. Unused files among the tests themselves are ignored.
+  def findAffectedApps(self, discovered):
+    spec_dirs = set()
+    known = set()
+    for (dirpath, file, testers) in discovered:
+      spec_dirs.add(os.path.abspath(dirpath))
+      for tester in testers:
+        known.update(self.dependency_index.getDependencies(tester.specs, os.path.join(dirpath, file)))
+    self.dependency_index.save()
+
+    self.affected_dirs = set()
+    self.affected_all = False
+    for path in sorted(self.changed_files - known):
+      if len([spec_dir for spec_dir in spec_dirs if path.startswith(spec_dir + os.sep)]):
+        continue
+
+      root = os.path.dirname(path)
+      while not os.path.isfile(os.path.join(root, 'Makefile')) and os.path.dirname(root) != root:
+        root = os.path.dirname(root)
+      if not os.path.isfile(os.path.join(root, 'Makefile')):
+        continue
+
+      if len([spec_dir for spec_dir in spec_dirs if spec_dir.startswith(root + os.sep)]):
+        self.affected_dirs.add(root)
+      else:
+        self.affected_all = True
+
+    print 'Running the tests affected by the %d files changed since %s' % (len(self.changed_files), self.options.since)
+    if self.affected_all:
+      print 'Changes to code used by every application, all tests are affected'
+    for root in sorted(self.affected_dirs):
+      print 'Changes to the code in %s, all of its tests are affected' % root
+
+  ## Return whether a test is affected by the changes since the --since revision
+  def isAffected(self, tester, spec_file):
+    if self.affected_all:
+      return True
+    for root in self.affected_dirs:
+      if spec_file.startswith(root + os.sep):
+        return True
+    return len(self.dependency_index.getDependencies(tester.specs, spec_file) & self.changed_files) != 0
+
+  # When running in valgrind mode, we end up with a ton of output for each failed
+  # test.  Therefore, we limit the number of fails...
+  def maxFailsExceeded(self):
+    if self.options.valgrind_mode and self.num_failed > self.options.valgrind_max_fails:
+      return True
+    return self.num_failed > self.options.max_fails
+
   ## Finish the test by inspecting the raw output
   def testOutputAndFinish(self, tester, retcode, output, start=0, end=0):
+    (reason, output) = self.processTestOutput(tester, retcode, output)
+    return self.reportTestResult(tester, reason, output, start, end)
+
+  ## Inspect the raw output of a test, returning the tuple (reason, output) where reason is empty if it passed
+  def processTestOutput(self, tester, retcode, output):
+    if self.options.pbs and self.options.processingPBS == False:
+      return self.buildPBSBatch(output, tester)
+    elif self.options.dry_run:
+      output += '\n'.join(tester.processResultsCommand(self.moose_dir, self.options))
+      return ('DRY_RUN', output)
+    return tester.processResults(self.moose_dir, retcode, self.options, output)
+
+  ## Report the result of a processed test, returning True if it passed
+  def reportTestResult(self, tester, reason, output, start=0, end=0):
     caveats = []
     test = tester.specs  # Need to refactor
 
     if test.isValid('caveats'):
       caveats = test['caveats']
 
-    if self.options.pbs and self.options.processingPBS == False:
-      (reason, output) = self.buildPBSBatch(output, tester)
-    elif self.options.dry_run:
-      reason = 'DRY_RUN'
-      output += '\n'.join(tester.processResultsCommand(self.moose_dir, self.options))
-    else:
-      (reason, output) = tester.processResults(self.moose_dir, retcode, self.options, output)
-
     if self.options.scaling and test['scale_refine']:
       caveats.append('scaled')
 
@@ -396,23 +756,47 @@ class TestHarness:
     else:
       result = 'FAILED (%s)' % reason
       did_pass = False
+
+    if self.artifact_cache != None:
+      if did_pass and reason == '':
+        self.storeRecoverOutput(tester, start)
+      elif not did_pass and test['test_name'] in self.restored_keys:
+        self.artifact_cache.discard(self.restored_keys[test['test_name']])
+
     if self.options.pbs and self.options.processingPBS == False and did_pass == True:
       # Handle the launch result, but do not add it to the results table (except if we learned that QSUB failed to launch for some reason)
-      self.handleTestResult(tester.specs, output, result, start, end, False)
+      self.handleTestResult(tester.specs, output, result, start, end, False, tester.output_matches)
       return did_pass
     else:
-      self.handleTestResult(tester.specs, output, result, start, end)
+      self.handleTestResult(tester.specs, output, result, start, end, matches=tester.output_matches)
       return did_pass
 
-  def getTiming(self, output):
+  ## Return the (pattern, flags) tuples searched for in the output of every test as it runs
+  def getOutputPatterns(self):
+    patterns = []
+    if self.options.timing or self.options.results_json:
+      patterns.append((TIMING_PATTERN, 0))
+    if self.options.store_time or self.options.perf_check != None:
+      patterns.append((SOLVE_TIME_PATTERN, 0))
+    return patterns
+
+  # The matches are those found while the test ran (see OutputCapture.getMatches), the
+  # output is only searched when the pattern was not searched for then
+  def getTiming(self, output, matches={}):
     time = ''
-    m = re.search(r"Active time=(\S+)", output)
+    if (TIMING_PATTERN, 0) in matches:
+      m = matches[(TIMING_PATTERN, 0)]
+    else:
+      m = re.search(TIMING_PATTERN, output)
     if m != None:
       return m.group(1)
 
-  def getSolveTime(self, output):
+  def getSolveTime(self, output, matches={}):
     time = ''
-    m = re.search(r"solve().*", output)
+    if (SOLVE_TIME_PATTERN, 0) in matches:
+      m = matches[(SOLVE_TIME_PATTERN, 0)]
+    else:
+      m = re.search(SOLVE_TIME_PATTERN, output)
     if m != None:
       return m.group().split()[5]
 
@@ -564,35 +948,38 @@ class TestHarness:
 
   ## Update global variables and print output based on the test result
   # Containing OK means it passed, skipped means skipped, anything else means it failed
-  def handleTestResult(self, specs, output, result, start=0, end=0, add_to_table=True):
+  #
+  # matches holds the pattern matches found in the output of the test while it ran (see getOutputPatterns).
+  # executed is False for results taken from an earlier run, which are not passed to postRun
+  def handleTestResult(self, specs, output, result, start=0, end=0, add_to_table=True, matches={}, executed=True):
     timing = ''
 
     if self.options.timing:
-      timing = self.getTiming(output)
-    elif self.options.store_time:
-      timing = self.getSolveTime(output)
+      timing = self.getTiming(output, matches)
+    elif self.options.store_time or self.options.perf_check != None:
+      timing = self.getSolveTime(output, matches)
+
+    # Resources used by the test, once it ran
+    usage = ''
+    if add_to_table:
+      usage = formatUsage(self.runner.getResourceUsage(specs['test_name']))
+
+    # Files the output of the test is written to
+    output_files = []
 
     # Only add to the test_table if told to. We now have enough cases where we wish to print to the screen, but not
     # in the 'Final Test Results' area.
     if add_to_table:
       self.test_table.append( (specs, output, result, timing, start, end) )
-      if result.find('OK') != -1 or result.find('DRY_RUN') != -1:
-        self.num_passed += 1
-      elif result.find('skipped') != -1:
-        self.num_skipped += 1
-      elif result.find('deleted') != -1:
-        self.num_skipped += 1
-      elif result.find('LAUNCHED') != -1 or result.find('RUNNING') != -1 or result.find('QUEUED') != -1 or result.find('EXITING') != -1:
-        self.num_pending += 1
-      else:
-        self.num_failed += 1
+      self.countResult(result)
 
-    self.postRun(specs, timing)
+    if executed:
+      self.postRun(specs, result, timing, start, end, self.runner.getResourceUsage(specs['test_name']))
 
     if self.options.show_directory:
-      print printResult(specs['relative_path'] + '/' + specs['test_name'].split('/')[-1], result, timing, start, end, self.options)
+      print printResult(specs['relative_path'] + '/' + specs['test_name'].split('/')[-1], result, timing, start, end, self.options, usage=usage)
     else:
-      print printResult(specs['test_name'], result, timing, start, end, self.options)
+      print printResult(specs['test_name'], result, timing, start, end, self.options, usage=usage)
 
     if self.options.verbose or ('FAILED' in result and not self.options.quiet):
       output = output.replace('\r', '\n')  # replace the carriage returns with newlines
@@ -610,26 +997,146 @@ class TestHarness:
 
       # Print result line again at the bottom of the output for failed tests
       if self.options.show_directory:
-        print printResult(specs['relative_path'] + '/' + specs['test_name'].split('/')[-1], result, timing, start, end, self.options), "(reprint)"
+        print printResult(specs['relative_path'] + '/' + specs['test_name'].split('/')[-1], result, timing, start, end, self.options, usage=usage), "(reprint)"
       else:
-        print printResult(specs['test_name'], result, timing, start, end, self.options), "(reprint)"
+        print printResult(specs['test_name'], result, timing, start, end, self.options, usage=usage), "(reprint)"
 
 
     if not 'skipped' in result:
       if self.options.file:
         if self.options.show_directory:
-          self.file.write(printResult( specs['relative_path'] + '/' + specs['test_name'].split('/')[-1], result, timing, start, end, self.options, color=False) + '\n')
+          self.file.write(printResult( specs['relative_path'] + '/' + specs['test_name'].split('/')[-1], result, timing, start, end, self.options, color=False, usage=usage) + '\n')
           self.file.write(output)
         else:
-          self.file.write(printResult( specs['test_name'], result, timing, start, end, self.options, color=False) + '\n')
+          self.file.write(printResult( specs['test_name'], result, timing, start, end, self.options, color=False, usage=usage) + '\n')
           self.file.write(output)
 
       if self.options.sep_files or (self.options.fail_files and 'FAILED' in result) or (self.options.ok_files and result.find('OK') != -1):
         fname = os.path.join(specs['test_dir'], specs['test_name'].split('/')[-1] + '.' + result[:6] + '.txt')
         f = open(fname, 'w')
-        f.write(printResult( specs['test_name'], result, timing, start, end, self.options, color=False) + '\n')
+        f.write(printResult( specs['test_name'], result, timing, start, end, self.options, color=False, usage=usage) + '\n')
         f.write(output)
         f.close()
+        output_files.append(fname)
+
+    if add_to_table and self.last_run != None:
+      self.last_run.record(specs['test_name'], self.parseResult(result)[1])
+
+    if add_to_table and self.run_journal != None:
+      self.run_journal.record(specs, self.parseResult(result)[1])
+
+    if add_to_table and self.results_json != None:
+      self.writeResultRecord(specs, output, result, start, end, matches, output_files)
+
+  ## Append the record of a finished test to the --results-json file (one JSON object per line)
+  #
+  # The file is buffered so nothing but the formatting is done per test, it is flushed when
+  # the buffer fills up and at the end of the run.
+  def writeResultRecord(self, specs, output, result, start, end, matches, output_files):
+    (caveats, status, reason) = self.parseResult(result)
+
+    active_time = self.getTiming(output, matches)
+    if active_time != None:
+      active_time = float(active_time)
+
+    usage = self.runner.getResourceUsage(specs['test_name'])
+    record = {'name' : specs['test_name'], 'status' : status, 'reason' : reason, 'caveats' : caveats,
+              'start' : start, 'end' : end, 'wall_time' : end - start, 'active_time' : active_time,
+              'slots' : usage.get('slots'), 'max_rss' : usage.get('max_rss'), 'peak_rss' : usage.get('peak_rss'),
+              'user_time' : usage.get('user_time'), 'sys_time' : usage.get('sys_time'),
+              'read_bytes' : usage.get('read_bytes'), 'write_bytes' : usage.get('write_bytes'), 'output_files' : output_files}
+    self.results_json.write(json.dumps(record) + '\n')
+
+  ## Add a result to the number of passed, skipped, pending or failed tests
+  def countResult(self, result):
+    if result.find('OK') != -1 or result.find('DRY_RUN') != -1:
+      self.num_passed += 1
+    elif result.find('skipped') != -1:
+      self.num_skipped += 1
+    elif result.find('deleted') != -1:
+      self.num_skipped += 1
+    elif result.find('LAUNCHED') != -1 or result.find('RUNNING') != -1 or result.find('QUEUED') != -1 or result.find('EXITING') != -1:
+      self.num_pending += 1
+    else:
+      self.num_failed += 1
+
+  ## Split a result "[CAVEATS] STATUS (reason)" back up into the tuple (caveats, status, reason)
+  #
+  # The status is one of OK, DRY_RUN, FAILED, SKIPPED, DELETED, LAUNCHED, RUNNING, QUEUED
+  # or EXITING. Anything else counts as a failure, as in countResult().
+  def parseResult(self, result):
+    m = re.match(r'(?:\[(.*?)\] )?(.*)$', result)
+    caveats = []
+    if m.group(1):
+      caveats = m.group(1).split(', ')
+    status = m.group(2)
+    m = re.match(r'(OK|DRY_RUN|FAILED|skipped|deleted|LAUNCHED|RUNNING|QUEUED|EXITING)(?: \((.*)\))?$', status)
+    if m:
+      return (caveats, m.group(1).upper(), m.group(2) or '')
+    return (caveats, 'FAILED', status)
+
+  ## Return whether a test is reported by this shard (--shard), see RunParallel.inShard
+  def inShard(self, test_name):
+    return self.runner.inShard(test_name)
+
+  ## Write the results of this run to the --results-file, see mergeResults()
+  def writeResults(self, filename, seconds):
+    tests = []
+    for (specs, output, result, timing, start, end) in self.test_table:
+      test = {'test_name' : specs['test_name'], 'relative_path' : specs['relative_path'], 'result' : result,
+              'timing' : timing, 'start' : start, 'end' : end, 'output' : ''}
+      # Only the output of failed tests is kept, like --sep-files-fail
+      if 'FAILED' in result:
+        test['output'] = output
+      tests.append(test)
+
+    f = open(filename, 'w')
+    json.dump({'shard' : self.options.shard, 'seconds' : seconds, 'error_code' : self.error_code, 'tests' : tests}, f)
+    f.close()
+
+  ## Print the summary of the results files written by several shards (--merge-results)
+  #
+  # The results are reported as if they came from one run that took as long as the slowest
+  # shard. Missing shards and failed parses are errors.
+  def mergeResults(self, filenames):
+    shards = set()
+    count = None
+    seconds = 0.0
+    for filename in filenames:
+      try:
+        f = open(filename)
+        results = json.load(f)
+        f.close()
+      except (IOError, ValueError), e:
+        print 'ERROR: Unable to read the results file ' + filename + ': ' + str(e)
+        sys.exit(1)
+
+      if results['shard'] != None:
+        shards.add(results['shard'][0])
+        count = results['shard'][1]
+      seconds = max(seconds, results['seconds'])
+      self.error_code = self.error_code | results['error_code']
+
+      for test in results['tests']:
+        specs = {'test_name' : test['test_name'], 'relative_path' : test['relative_path']}
+        self.test_table.append( (specs, test['output'], test['result'], test['timing'], test['start'], test['end']) )
+        self.countResult(test['result'])
+
+        if 'FAILED' in test['result'] and not self.options.quiet:
+          print printResult(test['test_name'], test['result'], test['timing'], test['start'], test['end'], self.options)
+          if self.options.verbose:
+            print test['output']
+
+    self.start_time = clock() - seconds
+    self.cleanup()
+
+    if count != None and len(shards) != count:
+      missing = sorted(set(range(1, count + 1)) - shards)
+      print colorText('Missing results for shard(s) ' + ', '.join([str(i) for i in missing]) + ' of ' + str(count), 'RED',
+                      colored=self.options.colored, code=self.options.code)
+      self.error_code = self.error_code | 0x80
+    if self.num_failed:
+      self.error_code = self.error_code | 0x80
 
   # Write the app_name to a file, if the tests passed
   def writeState(self, app_name):
@@ -646,10 +1153,11 @@ class TestHarness:
     if self.options.verbose or (self.num_failed != 0 and not self.options.quiet):
       print '\n\nFinal Test Results:\n' + ('-' * (TERM_COLS-1))
       for (test, output, result, timing, start, end) in sorted(self.test_table, key=lambda x: x[2], reverse=True):
+        usage = formatUsage(self.runner.getResourceUsage(test['test_name']))
         if self.options.show_directory:
-          print printResult(test['relative_path'] + '/' + specs['test_name'].split('/')[-1], result, timing, start, end, self.options)
+          print printResult(test['relative_path'] + '/' + specs['test_name'].split('/')[-1], result, timing, start, end, self.options, usage=usage)
         else:
-          print printResult(test['test_name'], result, timing, start, end, self.options)
+          print printResult(test['test_name'], result, timing, start, end, self.options, usage=usage)
 
     time = clock() - self.start_time
     print '-' * (TERM_COLS-1)
@@ -679,13 +1187,93 @@ class TestHarness:
       print '\nYour PBS batch file:', self.options.pbs
     if self.file:
       self.file.close()
+    if self.results_json != None:
+      self.results_json.close()
+    if self.options.results_file:
+      self.writeResults(os.path.join(self.output_dir, self.options.results_file), time)
 
     if self.num_failed == 0:
       self.writeState(self.executable)
 
+  ## Return the result of a configuration probe, reusing the result of an earlier run when possible
+  #
+  # probe is called without arguments and returns a tuple (result, paths), see ConfigCache
+  def probeConfig(self, key, probe):
+    if self.config_cache != None:
+      return self.config_cache.get(key, probe)
+    return probe()[0]
+
+  ## Probe for the initialized submodules, the result changes when the git config or modules do
+  def probeSubmodules(self):
+    submodules = getInitializedSubmodules(self.run_tests_dir)
+    git_dir = findGitDir(self.run_tests_dir)
+    if git_dir == None:
+      return (submodules, [])
+    return (submodules, [os.path.join(git_dir, 'config'), os.path.join(git_dir, 'modules'), \
+                         os.path.join(os.path.dirname(git_dir), '.gitmodules')])
+
   def initialize(self, argv, app_name):
-    # Initialize the parallel runner with how many tests to run in parallel
-    self.runner = RunParallel(self, self.options.jobs, self.options.load)
+    # The runtimes of previous runs are used to order and pack the jobs
+    self.runtime_history = None
+    if RuntimeHistory.sqlite != None and not self.options.pbs:
+      if self.options.history_file:
+        self.runtime_history = RuntimeHistory.RuntimeHistory(os.path.abspath(self.options.history_file), app_name)
+      elif not self.options.no_cache:
+        self.runtime_history = RuntimeHistory.RuntimeHistory(os.path.join(self.cache_dir, 'runtime_history.sqlite'), app_name)
+
+    # The runtimes the shards are balanced with (--shard-history), only ever read so every shard sees the same
+    self.shard_history = None
+    if self.options.shard_history:
+      self.shard_history = RuntimeHistory.RuntimeHistory(os.path.abspath(self.options.shard_history), app_name)
+
+    # The files changed since the --since revision and the files each test depends on
+    self.changed_files = None
+    self.dependency_index = None
+    if self.options.since:
+      self.changed_files = DependencyIndex.changedFiles(self.options.since, self.run_tests_dir)
+      if self.changed_files == None:
+        print 'ERROR: Unable to find the files changed since ' + self.options.since
+        sys.exit(1)
+      if self.options.no_cache:
+        self.dependency_index = DependencyIndex.DependencyIndex()
+      else:
+        self.dependency_index = DependencyIndex.DependencyIndex(self.cache_dir)
+
+    # The digests of the files the cached results below are keyed on
+    self.file_digests = None
+    if not (self.options.no_cache or self.options.pbs or self.options.dry_run):
+      self.file_digests = FileDigests(os.path.join(self.cache_dir, 'file_digests.pickle'))
+
+    # The outcome of the last run of each test, for --failed and --changed
+    self.last_run = None
+    if self.file_digests != None:
+      self.last_run = LastRunState(self.cache_dir, self.file_digests)
+
+    # The results of this run as they finish, so it can be resumed if it is interrupted
+    self.run_journal = None
+    if self.last_run != None and not self.options.worker:
+      journal_name = 'run_journal.json'
+      if self.options.shard:
+        journal_name = 'run_journal.%d_of_%d.json' % self.options.shard
+      self.run_journal = RunJournal(os.path.join(self.cache_dir, journal_name), self.last_run, self.file_digests, self.options.resume)
+
+    # The output of the first part of recover tests, reused while nothing it depends on changes
+    self.artifact_cache = None
+    self.recover_part1 = set()
+    self.artifact_keys = {}
+    self.restored_keys = {}
+    if self.options.enable_recover and self.file_digests != None:
+      self.artifact_cache = ArtifactCache.ArtifactCache(self.cache_dir, self.file_digests)
+      if self.dependency_index == None:
+        self.dependency_index = DependencyIndex.DependencyIndex(self.cache_dir)
+
+    # Initialize the parallel runner with how many tests to run in parallel, or hand the
+    # tests out to workers on other hosts
+    if self.options.coordinator:
+      address = RunDistributed.parseAddress(self.options.coordinator, 'localhost')
+      self.runner = RunDistributed.RunDistributed(self, address, RunDistributed.getAuthKey(True))
+    else:
+      self.runner = RunParallel(self, self.options.jobs, self.options.load)
 
     ## Save executable-under-test name to self.executable
     self.executable = os.getcwd() + '/' + app_name + '-' + self.options.method
@@ -701,12 +1289,27 @@ class TestHarness:
         if ex.errno == errno.EEXIST: pass
         else: raise
 
+    self.spec_cache = None
+    if not self.options.no_cache:
+      self.spec_cache = SpecCache(self.cache_dir)
+
     # Open the file to redirect output to and set the quiet option for file output
     if self.options.file:
       self.file = open(os.path.join(self.output_dir, self.options.file), 'w')
     if self.options.file or self.options.fail_files or self.options.sep_files:
       self.options.quiet = True
 
+    # Stream a record of every finished test to this file
+    self.results_json = None
+    if self.options.results_json:
+      self.results_json = open(os.path.join(self.output_dir, self.options.results_json), 'w', RESULTS_JSON_BUFFER)
+
+    # Time the phases of the harness itself
+    self.profiler = None
+    if self.options.profile_harness:
+      self.profiler = HarnessProfiler(self.init_time)
+      self.profiler.instrument(self, self.factory.objects.values())
+
   ## Parse command line options and assign them to self.options
   def parseCLArgs(self, argv):
     parser = argparse.ArgumentParser(description='A tool used to test MOOSE based applications')
@@ -726,6 +1329,9 @@ class TestHarness:
 #    parser.add_argument('--dofs', action='store', dest='dofs', help='This option is for automatic scaling which is not currently implemented in MOOSE 2.0')
     parser.add_argument('--dbfile', nargs='?', action='store', dest='dbFile', help='Location to timings data base file. If not set, assumes $HOME/timingDB/timing.sqlite')
     parser.add_argument('-l', '--load-average', action='store', type=float, dest='load', default=64.0, help='Do not run additional tests if the load average is at least LOAD')
+    parser.add_argument('--max-pressure', action='store', type=float, dest='max_pressure', default=None, help='Do not run additional tests while tasks wait for the CPU more than MAX_PRESSURE percent of the time (Linux pressure stall information, the load average is used where it is not available). Off by default, the load average is used instead. Tests are always held back while their peak memory use in earlier runs does not fit in the available memory')
+    parser.add_argument('--post-jobs', action='store', type=int, dest='post_jobs', help='Check the output of finished tests (exodiff, csvdiff, ...) on POST_JOBS threads while the next tests run (default: the number of jobs, 0 checks it before starting more tests)')
+    parser.add_argument('--app-server', action='store_true', dest='app_server', help='Run the tests that only check for an error (RunException) in long-lived processes of their application instead of starting a process for each of them. Requires an application with the --server option')
     parser.add_argument('-t', '--timing', action='store_true', dest='timing', help='Report Timing information for passing tests')
     parser.add_argument('-s', '--scale', action='store_true', dest='scaling', help='Scale problems that have SCALE_REFINE set')
     parser.add_argument('-i', nargs=1, action='store', type=str, dest='input_file_name', default='tests', help='The default test specification file to look for (default="tests").')
@@ -754,6 +1360,18 @@ class TestHarness:
     parser.add_argument('--cli-args', nargs='?', type=str, dest='cli_args', help='Append the following list of arguments to the command line (Encapsulate the command in quotes)')
 
     parser.add_argument('--dry-run', action='store_true', dest='dry_run', help="Pass --dry-run to print commands to run, but don't actually run them")
+    parser.add_argument('--cache-dir', nargs=1, metavar='directory', dest='cache_dir', help='Directory used to store data that is reused between runs (default: .testharness_cache next to run_tests)')
+    parser.add_argument('--no-cache', action='store_true', dest='no_cache', help='Do not read or write the test specification and configuration caches')
+    parser.add_argument('--external-exodiff', action='store_true', dest='external_exodiff', help='Always run the exodiff executable instead of comparing Exodus files in process when possible')
+    parser.add_argument('--coordinator', metavar='[HOST:]PORT', dest='coordinator', help='Hand the tests out to workers started with --worker instead of running them here. Listens on localhost unless HOST is given (0.0.0.0 for all interfaces). The workers authenticate with the key in $TESTHARNESS_AUTHKEY (one is generated and printed if it is not set)')
+    parser.add_argument('--worker', metavar='HOST:PORT', dest='worker', help='Run the tests handed out by the coordinator listening on HOST:PORT. The workers need the same paths as the coordinator (a shared file system or identical checkouts)')
+    parser.add_argument('--failed', action='store_true', dest='failed', help='Run only the tests that failed the last time they ran (and the tests they depend on)')
+    parser.add_argument('--changed', action='store_true', dest='changed', help='Run only the tests whose spec block, input or gold files changed since they last ran (and the tests they depend on). Combined with --failed both are run')
+    parser.add_argument('--resume', action='store_true', dest='resume', help='Resume the last run (after it was interrupted, say): the tests that passed in it are not run again, unless the executable (or a library it loads) or their spec block, input or gold files changed since. Adds to the results of that run, so it can be resumed again')
+    parser.add_argument('--since', metavar='rev', dest='since', help='Run only the tests affected by the changes (committed or not) since the git revision REV: tests whose spec file, input files (and the meshes and files they include), depend_files or gold files changed, and every test of an application whose code changed')
+    parser.add_argument('--shard', metavar='i/N', dest='shard', help='Run only the i-th of N parts of the tests (1 <= i <= N). Tests that depend on each other stay together. Every shard must be run with the same tests (and the same --shard-history)')
+    parser.add_argument('--shard-history', metavar='file', dest='shard_history', help='Balance the parts of --shard with the runtimes in FILE, a copy of a --history-file database that is not written by any of the shards. Without it the tests are split by hashing their names')
+    parser.add_argument('--history-file', nargs=1, metavar='file', dest='history_file', help='The sqlite database of test runtimes used to schedule the tests, may be shared between runs (default: runtime_history.sqlite in the cache directory)')
 
     outputgroup = parser.add_argument_group('Output Options', 'These options control the output of the test harness. The sep-files options write output to files named test_name.TEST_RESULT.txt. All file output will overwrite old files')
     outputgroup.add_argument('-v', '--verbose', action='store_true', dest='verbose', help='show the output of every test')
@@ -763,10 +1381,16 @@ class TestHarness:
     outputgroup.add_argument('-o', '--output-dir', nargs=1, metavar='directory', dest='output_dir', default='', help='Save all output files in the directory, and create it if necessary')
     outputgroup.add_argument('-f', '--file', nargs=1, action='store', dest='file', help='Write verbose output of each test to FILE and quiet output to terminal')
     outputgroup.add_argument('-x', '--sep-files', action='store_true', dest='sep_files', help='Write the output of each test to a separate file. Only quiet output to terminal. This is equivalant to \'--sep-files-fail --sep-files-ok\'')
+    outputgroup.add_argument('--resources', action='store_true', dest='resources', help='Show the peak memory use (summed over all processes), CPU time and bytes read from and written to storage of every test')
     outputgroup.add_argument('--sep-files-ok', action='store_true', dest='ok_files', help='Write the output of each passed test to a separate file')
     outputgroup.add_argument('-a', '--sep-files-fail', action='store_true', dest='fail_files', help='Write the output of each FAILED test to a separate file. Only quiet output to terminal.')
-    outputgroup.add_argument("--store-timing", action="store_true", dest="store_time", help="Store timing in the SQL database: $HOME/timingDB/timing.sqlite A parent directory (timingDB) must exist.")
+    outputgroup.add_argument("--store-timing", action="store_true", dest="store_time", help="Store the timing (solve time, or wall time when a test does not print one) and resource usage of every passing test in the SQL database: $HOME/timingDB/timing.sqlite A parent directory (timingDB) must exist.")
+    outputgroup.add_argument('--perf-check', nargs='?', metavar='sigmas', type=float, dest='perf_check', const=3.0, help='Report the tests whose solve time (or wall time if they do not print one) is more than SIGMAS (default 3) standard deviations slower than in the last runs stored with --store-timing, and exit with an error if there are any')
     outputgroup.add_argument("--revision", nargs=1, action="store", type=str, dest="revision", help="The current revision being tested. Required when using --store-timing.")
+    outputgroup.add_argument('--results-json', nargs=1, metavar='file', dest='results_json', help='Append a JSON record of every test (name, status, reason, caveats, start and end time, wall and Active time, slots, peak RSS in KB of the largest process and of all processes, user and system time, bytes read and written and output files) to FILE as it finishes, one per line')
+    outputgroup.add_argument('--results-file', nargs=1, metavar='file', dest='results_file', help='Write the results to FILE, to be combined with the results of other shards by --merge-results')
+    outputgroup.add_argument('--merge-results', nargs='+', metavar='file', dest='merge_results', help='Print the combined summary of the files written with --results-file (one per shard) instead of running tests')
+    outputgroup.add_argument('--profile-harness', nargs='?', metavar='file', dest='profile_harness', const='harness_profile.folded', help='Time the phases of the TestHarness itself (parsing, checks, building commands, launching, checking the output, reporting) for every type of test. A summary is printed at the end and the collapsed stacks for flamegraph.pl or speedscope are written to FILE (default: harness_profile.folded)')
     outputgroup.add_argument("--yaml", action="store_true", dest="yaml", help="Dump the parameters for the testers in Yaml Format")
     outputgroup.add_argument("--dump", action="store_true", dest="dump", help="Dump the parameters for the testers in GetPot Format")
 
@@ -798,11 +1422,39 @@ class TestHarness:
     if opts.store_time and not (opts.revision):
       print 'ERROR: --store-timing is specified but no revision'
       sys.exit(1)
-    if opts.store_time:
+    if opts.store_time or opts.perf_check != None:
       # timing returns Active Time, while store_timing returns Solve Time.
       # Thus we need to turn off timing.
       opts.timing = False
       opts.scaling = True
+    if opts.coordinator and (opts.worker or opts.pbs):
+      print 'ERROR: --coordinator can not be used with --worker or --pbs'
+      sys.exit(1)
+    if type(opts.merge_results) == str:
+      # Undo the conversion of single item lists in parseCLArgs
+      opts.merge_results = [opts.merge_results]
+    if (opts.failed or opts.changed or opts.resume) and (opts.no_cache or opts.pbs or opts.dry_run):
+      print 'ERROR: --failed, --changed and --resume need the cache of the last run and can not be used with --no-cache, --pbs or --dry-run'
+      sys.exit(1)
+    if opts.shard:
+      if opts.pbs:
+        print 'ERROR: --shard can not be used with --pbs'
+        sys.exit(1)
+      opts.shard = Shards.parseShard(opts.shard)
+    if opts.shard_history:
+      if not opts.shard:
+        print 'ERROR: --shard-history can only be used with --shard'
+        sys.exit(1)
+      if RuntimeHistory.sqlite == None or not os.path.isfile(opts.shard_history):
+        print 'ERROR: Unable to read the runtime history ' + opts.shard_history
+        sys.exit(1)
+      # Each shard would see the history as it was when it started
+      if opts.history_file and os.path.abspath(opts.history_file) == os.path.abspath(opts.shard_history):
+        print 'ERROR: --shard-history can not be the --history-file of the run, which is written at the end of it'
+        sys.exit(1)
+    if opts.worker and RunDistributed.getAuthKey() == None:
+      print 'ERROR: --worker requires the key printed by the coordinator in $' + RunDistributed.AUTHKEY_VARIABLE
+      sys.exit(1)
     if opts.valgrind_mode and (opts.parallel > 1 or opts.nthreads > 1):
       print 'ERROR: --parallel and/or --threads can not be used with --valgrind'
       sys.exit(1)
@@ -834,7 +1486,7 @@ class TestHarness:
     if opts.heavy_tests:
       self.options.report_skipped = False
 
-  def postRun(self, specs, timing):
+  def postRun(self, specs, result, timing, start, end, usage):
     return
 
   def preRun(self):
@@ -847,6 +1499,10 @@ class TestHarness:
     if self.options.pbs_cleanup:
       self.cleanPBSBatch()
       sys.exit(0)
+    if self.options.merge_results:
+      self.error_code = 0x0
+      self.mergeResults(self.options.merge_results)
+      sys.exit(self.error_code)
 
   def getOptions(self):
     return self.options
@@ -854,73 +1510,106 @@ class TestHarness:
 #################################################################################################################################
 # The TestTimer TestHarness
 # This method finds and stores timing for individual tests.  It is activated with --store-timing
+# and --perf-check, which compares the timing of the tests with the runs stored before
 #################################################################################################################################
 
-CREATE_TABLE = """create table timing
-(
-  app_name text,
-  test_name text,
-  revision text,
-  date int,
-  seconds real,
-  scale int,
-  load real
-);"""
-
 class TestTimer(TestHarness):
   def __init__(self, argv, app_name, moose_dir):
     TestHarness.__init__(self, argv, app_name, moose_dir)
-    try:
-      from sqlite3 import dbapi2 as sqlite
-    except:
-      print 'Error: --store-timing requires the sqlite3 python module.'
+    if TimingDatabase.sqlite == None:
+      print 'Error: --store-timing and --perf-check require the sqlite3 python module.'
       sys.exit(1)
     self.app_name = app_name
     self.db_file = self.options.dbFile
     if not self.db_file:
       home = os.environ['HOME']
       self.db_file = os.path.join(home, 'timingDB/timing.sqlite')
-      if not os.path.exists(self.db_file):
+      if not os.path.exists(self.db_file) and self.options.store_time:
         print 'Warning: creating new database at default location: ' + str(self.db_file)
-        self.createDB(self.db_file)
       else:
         print 'Warning: Assuming database location ' + self.db_file
+    if not os.path.exists(self.db_file) and not self.options.store_time:
+      print 'ERROR: --perf-check needs the timing database written by --store-timing: ' + self.db_file
+      sys.exit(1)
 
-  def createDB(self, fname):
-    from sqlite3 import dbapi2 as sqlite
-    print 'Creating empty database at ' + fname
-    con = sqlite.connect(fname)
-    cr = con.cursor()
-    cr.execute(CREATE_TABLE)
-    con.commit()
+    ## Tests slower than their baseline as (test_name, seconds, mean, stddev, runs) tuples
+    self.regressions = []
 
   def preRun(self):
-    from sqlite3 import dbapi2 as sqlite
-    # Delete previous data if app_name and repo revision are found
-    con = sqlite.connect(self.db_file)
-    cr = con.cursor()
-    cr.execute('delete from timing where app_name = ? and revision = ?', (self.app_name, self.options.revision))
-    con.commit()
-
-  # After the run store the results in the database
-  def postRun(self, test, timing):
-    from sqlite3 import dbapi2 as sqlite
-    con = sqlite.connect(self.db_file)
-    cr = con.cursor()
-
-    timestamp = int(time.time())
-    load = os.getloadavg()[0]
-
-    # accumulate the test results
-    data = []
-    sum_time = 0
-    num = 0
-    parse_failed = False
-    # Were only interested in storing scaled data
-    if timing != None and test['scale_refine'] != 0:
-      sum_time += float(timing)
-      num += 1
-      data.append( (self.app_name, test['test_name'].split('/').pop(), self.options.revision, timestamp, timing, test['scale_refine'], load) )
-    # Insert the data into the database
-    cr.executemany('insert into timing values (?,?,?,?,?,?,?)', data)
-    con.commit()
+    self.timing_db = TimingDatabase.TimingDatabase(self.db_file, self.app_name)
+    TestHarness.preRun(self)
+
+  # After each test store the results in the database
+  def postRun(self, specs, result, timing, start, end, usage):
+    # Only complete runs are representative of how long a test takes
+    if self.parseResult(result)[1] != 'OK' or not specs['should_execute']:
+      return
+
+    # The solve time when the test reports it, the wall time otherwise
+    if timing:
+      seconds = float(timing)
+    else:
+      seconds = end - start
+    # The full name, the names of tests in different directories of an app can be the same
+    test_name = specs['test_name']
+    scale = 0
+    if self.options.scaling:
+      scale = specs['scale_refine']
+
+    if self.options.perf_check != None:
+      baseline = self.timing_db.checkRegression(test_name, scale, seconds, self.options.perf_check)
+      if baseline != None:
+        self.regressions.append((specs['test_name'], seconds) + baseline)
+
+    if self.options.store_time:
+      self.timing_db.record(test_name, self.options.revision, seconds, scale, usage)
+
+  def cleanup(self):
+    self.timing_db.save()
+    self.timing_db.close()
+
+    TestHarness.cleanup(self)
+
+    if len(self.regressions):
+      print '\nPerformance regressions (more than %g standard deviations slower than the last %d runs):' % (self.options.perf_check, TimingDatabase.PERF_WINDOW)
+      for (test_name, seconds, mean, stddev, runs) in self.regressions:
+        print colorText('  %s: %.3fs, baseline %.3fs +/- %.3fs over %d runs' % (test_name, seconds, mean, stddev, runs), 'YELLOW',
+                        colored=self.options.colored, code=self.options.code)
+      self.error_code = self.error_code | 0x40
+
+#################################################################################################################################
+# The TestWorker TestHarness
+# This runs the tests handed out by a coordinator (see RunDistributed). It is activated with --worker
+#################################################################################################################################
+
+class TestWorker(TestHarness):
+  def __init__(self, argv, app_name, moose_dir):
+    TestHarness.__init__(self, argv, app_name, moose_dir)
+    self.worker = RunDistributed.Worker(self, RunDistributed.parseAddress(self.options.worker, 'localhost'), RunDistributed.getAuthKey())
+
+  # The tests are found by the coordinator, just run what it hands out
+  def findAndRunTests(self, find_only=False):
+    self.error_code = 0x0
+    self.start_time = clock()
+
+    try:
+      if not self.worker.run():
+        self.error_code = 0x80
+    except KeyboardInterrupt:
+      print '\nExiting due to keyboard interrupt...'
+      self.worker.killJobs()
+      sys.exit(0)
+
+    if self.runtime_history != None:
+      self.runtime_history.save()
+
+  # The result is reported by the coordinator, only send it back and print a line for it here
+  def reportTestResult(self, tester, reason, output, start=0, end=0):
+    self.worker.sendResult(tester, reason, output, end - start)
+
+    if reason == '':
+      result = 'OK'
+    else:
+      result = 'FAILED (%s)' % reason
+    print printResult(tester.specs['test_name'], result, '', start, end, self.options)
+    return reason == ''
@@ -0,0 +1,120 @@
+import os, math, time
+
+try:
+  from sqlite3 import dbapi2 as sqlite
+except ImportError:
+  sqlite = None
+
+## Number of earlier runs of a test its performance is compared with
+PERF_WINDOW = 10
+
+## Fewer earlier runs than this are not enough to tell a regression from noise
+PERF_MIN_RUNS = 5
+
+## A test has to be at least this fraction slower than its baseline to count as a regression
+PERF_MIN_CHANGE = 0.1
+
+CREATE_TABLE = """create table if not exists timing
+(
+  app_name text,
+  test_name text,
+  revision text,
+  date int,
+  seconds real,
+  scale int,
+  load real,
+  peak_rss int,
+  cpu_time real,
+  read_bytes int,
+  write_bytes int
+);"""
+
+## Columns added to the timing table after it was first created, with their types
+ADDED_COLUMNS = [('peak_rss', 'int'), ('cpu_time', 'real'), ('read_bytes', 'int'), ('write_bytes', 'int')]
+
+CREATE_INDEX = 'create index if not exists timing_app_test_date on timing (app_name, test_name, date);'
+
+## The performance of every test across revisions (--store-timing), also read by timing_utils.py
+#
+# One connection is kept open for the whole run. Measurements are collected in memory and
+# written in a single transaction by save(), replacing any earlier measurement of the same
+# test at the same revision (but not those of other tests, which other runs may have stored).
+class TimingDatabase:
+  def __init__(self, filename, app_name):
+    self.app_name = app_name
+
+    ## Measurements waiting to be written as rows of the timing table
+    self.pending = []
+
+    self.con = sqlite.connect(filename, timeout=30)
+    cr = self.con.cursor()
+    cr.execute(CREATE_TABLE)
+
+    # Databases created before the resource usage was stored lack its columns
+    cr.execute('pragma table_info(timing)')
+    columns = [row[1] for row in cr.fetchall()]
+    for (name, column_type) in ADDED_COLUMNS:
+      if name not in columns:
+        cr.execute('alter table timing add column ' + name + ' ' + column_type)
+
+    cr.execute(CREATE_INDEX)
+    self.con.commit()
+
+  ## Record the measurement of a test, usage is a dictionary as kept by RunParallel.resource_usage
+  def record(self, test_name, revision, seconds, scale, usage):
+    try:
+      load = os.getloadavg()[0]
+    except (AttributeError, OSError):
+      load = None
+
+    cpu_time = None
+    if 'user_time' in usage:
+      cpu_time = usage['user_time'] + usage['sys_time']
+    self.pending.append((self.app_name, test_name, revision, int(time.time()), seconds, scale, load,
+                         usage.get('peak_rss'), cpu_time, usage.get('read_bytes'), usage.get('write_bytes')))
+
+  ## Return the (mean, standard deviation, runs) of the time of the last runs of a test, or None
+  # if there are not enough of them
+  def getBaseline(self, test_name, scale):
+    cr = self.con.cursor()
+    cr.execute('select seconds from timing where app_name = ? and test_name = ? and scale = ? and seconds is not null order by date desc limit ?',
+               (self.app_name, test_name, scale, PERF_WINDOW))
+    values = [row[0] for row in cr.fetchall()]
+    if len(values) < PERF_MIN_RUNS:
+      return None
+
+    mean = sum(values) / len(values)
+    stddev = math.sqrt(sum([(value - mean) ** 2 for value in values]) / (len(values) - 1))
+    return (mean, stddev, len(values))
+
+  ## Return the baseline of a test if the given time is a regression of more than sigmas
+  # standard deviations from it, or None
+  def checkRegression(self, test_name, scale, seconds, sigmas):
+    baseline = self.getBaseline(test_name, scale)
+    if baseline == None:
+      return None
+    (mean, stddev, runs) = baseline
+    if seconds > mean + max(sigmas * stddev, PERF_MIN_CHANGE * mean):
+      return baseline
+    return None
+
+  ## Write the pending measurements in one transaction
+  #
+  # The new rows are inserted before the rows they replace are deleted, so they always get
+  # rowids larger than any row before them (timing_utils.py regenerates the tests with rows
+  # beyond the largest rowid it saw).
+  def save(self):
+    if len(self.pending) == 0:
+      return
+    cr = self.con.cursor()
+    cr.execute('select max(rowid) from timing')
+    last = cr.fetchone()[0] or 0
+    cr.executemany('insert into timing (app_name, test_name, revision, date, seconds, scale, load, peak_rss, cpu_time, read_bytes, write_bytes) values (?,?,?,?,?,?,?,?,?,?,?)',
+                   self.pending)
+    cr.executemany('delete from timing where app_name = ? and test_name = ? and revision = ? and rowid <= ?',
+                   [(row[0], row[1], row[2], last) for row in self.pending])
+    self.con.commit()
+    self.pending = []
+
+  def close(self):
+    self.con.close()
@@ -1,5 +1,21 @@
-import os, sys, traceback
-import xml.etree.ElementTree as xml
+import os, re, sys, traceback, base64, struct, zlib
+
+try:
+  import xml.etree.cElementTree as xml
+except ImportError:
+  import xml.etree.ElementTree as xml
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+## The struct format characters of the VTK data types
+VTK_TYPES = {'Int8' : 'b', 'UInt8' : 'B', 'Int16' : 'h', 'UInt16' : 'H', 'Int32' : 'i', 'UInt32' : 'I',
+             'Int64' : 'q', 'UInt64' : 'Q', 'Float32' : 'f', 'Float64' : 'd'}
+
+## The number of bytes read at a time while looking for the AppendedData of a file
+SCAN_CHUNK = 1 << 20
 
 ##
 # Stores error information needed for printing diff messages
@@ -13,8 +29,70 @@ class XMLError(object):
     self.error = err
     self.message = msg
 
+##
+# Stores the parts of an XML element needed for the comparison
+class XMLBlock(object):
+
+  ##
+  # Constructor.
+  # @param tag The tag of the element
+  # @param attrib A dict of the element attributes
+  # @param text The text of the element (None if it has none)
+  def __init__(self, tag, attrib, text=None):
+    self.tag = tag
+    self.attrib = attrib
+    self.text = text
+
+    # The values of the block once they have been extracted from the text
+    self.values = None
+    self.extracted = False
+
+##
+# The appended data of a VTK file, read from the file when it is sliced
+#
+# The appended data holds the values of the whole file, so rather than keeping it in memory
+# only the part of it needed by each DataArray is read.
+class AppendedData(object):
+
+  ##
+  # Constructor.
+  # @param filename The name of the XML file
+  # @param start The position in the file the offsets of the data are counted from
+  def __init__(self, filename, start):
+    self.filename = filename
+    self.start = start
+
+  ##
+  # Return the data starting at offset as a new AppendedData object
+  def at(self, offset):
+    return AppendedData(self.filename, self.start + offset)
+
+  ##
+  # Read a slice of the data
+  def __getitem__(self, index):
+    f = open(self.filename, 'rb')
+    try:
+      f.seek(self.start + index.start)
+      return f.read(index.stop - index.start)
+    finally:
+      f.close()
+
+##
+# Raised when the data of a VTK DataArray can not be decoded
+class XMLDecodeError(Exception):
+  pass
+
 ##
 # A class for finding difference between XML documents
+#
+# Both files are streamed through the parser in step: each block of the master file is
+# compared with the next block of the second file with the same tag and attributes as
+# soon as it has been read. The blocks of the second file skipped on the way are kept
+# until a block of the master file matches them, so files with the blocks in the same
+# order (like the VTK files written by MOOSE) are compared a block at a time. The text of
+# the blocks is compared as arrays of values, VTK DataArray blocks stored in the binary
+# (base64, optionally zlib compressed) and appended (base64) formats are decoded first,
+# the appended data is read from the files as each DataArray needs it.
 class XMLDiffer(object):
 
   ##
@@ -25,7 +103,8 @@ class XMLDiffer(object):
   # Optional Arguments:
   #   abs_zero: Any value less than this is assumed zero (default: 1e-11)
   #   rel_tol: Relative tolerance to check numeric values against (default: 5.5e-6)
-  #   max_values: The maximum number of values to test
+  #   max_values: The maximum number of values to test in each block (default: all)
+  #   max_errors: Stop the comparison once this many errors are found (default: no limit)
   def __init__(self, file1, file2, **kwargs):
 
     # Store the file names
@@ -35,16 +114,47 @@ class XMLDiffer(object):
     self._abs_zero = float(kwargs.pop('abs_zero', 1e-11))
     self._rtol = float(kwargs.pop('rel_tol', 5.5e-6))
     self._ignored_attributes = kwargs.pop('ignored_attributes', [])
+    self._max_values = kwargs.pop('max_values', None)
+    self._max_errors = kwargs.pop('max_errors', None)
 
     # Storage for XMLError objects
     self._errors = []
 
-    # Extract the XML tree from the files
-    self._root1 = self._extractXML(file1)
-    self._root2 = self._extractXML(file2)
-
-    # Perform the comparison
-    self._compare()
+    # The blocks of the second file read ahead of the master file and not matched yet, by tag
+    self._pending = {}
+
+    # The encoding settings (from the root element) and appended data of each file
+    self._info = [{'filename' : file1}, {'filename' : file2}]
+
+    # Check the files and stream the master file past the second file
+    error1 = self._checkFile(file1)
+    error2 = self._checkFile(file2)
+
+    self._stream = None
+    self._stream_error = None
+    if error2 == None:
+      self._stream = self._iterXML(file2, self._info[1])
+
+    errors = []
+    if error1 == None:
+      try:
+        errors = self._compare(file1, error2 == None)
+      except xml.ParseError:
+        error1 = self._parseError(file1)
+
+    # The rest of the second file is only parsed to check it
+    while self._nextBlock() != None:
+      pass
+    if self._stream_error != None:
+      error2 = self._stream_error
+
+    # Parser errors are reported before any differences
+    for e in [error1, error2]:
+      if e != None:
+        self._addError(e)
+    if error1 == None and error2 == None:
+      for e in errors:
+        self._addError(e)
 
   ##
   # Check the comparison status (public)
@@ -99,106 +209,178 @@ class XMLDiffer(object):
       self._errors.append(obj)
 
   ##
-  # Reads the XML file (private)
+  # Check for file existence (private)
   # @param filename The name of the XML file to read
-  # @return An xml.etree.ElementTree root object
-  def _extractXML(self, filename):
-
-    # Check for file existence
+  # @return An XMLError object if the file does not exist, otherwise None
+  def _checkFile(self, filename):
     if not os.path.isfile(filename):
-      self._addError('Could not open ' + filename + ', the file does not exist.')
-      return None
+      return XMLError('Could not open ' + filename + ', the file does not exist.', [])
+    return None
 
-    # Get the root object of the XML tree
-    try:
-      root = xml.parse(filename).getroot()
+  ##
+  # Create the error for a parser error that was just caught (private)
+  # @param filename The name of the XML file being read
+  def _parseError(self, filename):
+    err = 'An XML parser error occurred attempting to read XML tree from ' + filename + '.'
+    msg = traceback.format_exc().splitlines()
+    return XMLError(err, msg)
 
-    # Catch parser errors
+  ##
+  # Stream the elements of an XML file (private)
+  # @param filename The name of the XML file to read
+  # @param info The dict to store the encoding settings and appended data of the file in
+  # @return A generator of (order, element) pairs, where order is the position of the
+  #         element in document order. Each element is complete (including its text),
+  #         it is cleared once the caller is done with it. The AppendedData element and
+  #         those containing it are returned without their text and children.
+  def _iterXML(self, filename, info):
+    order = []
+    elems = []
+    count = 0
+    for event, elem in xml.iterparse(filename, events=('start', 'end')):
+      if event == 'start':
+        if count == 0:
+          info['header_type'] = elem.attrib.get('header_type', 'UInt32')
+          info['byte_order'] = elem.attrib.get('byte_order', 'LittleEndian')
+          info['compressor'] = elem.attrib.get('compressor', '')
+        order.append(count)
+        elems.append(elem)
+        count += 1
+
+        # The rest of the file is the appended data, it is not parsed but read from the file
+        # by the DataArray blocks that need it (see AppendedData)
+        if elem.tag == 'AppendedData':
+          while len(elems):
+            yield order.pop(), elems.pop()
+          return
+
+      else:
+        elems.pop()
+        yield order.pop(), elem
+        elem.clear()
+
+  ##
+  # Read the next block of the second file (private)
+  # @return The XMLBlock object, None at the end of the file or if it could not be parsed
+  def _nextBlock(self):
+    if self._stream == None:
+      return None
+    try:
+      order, elem = self._stream.next()
+      return XMLBlock(elem.tag, dict(elem.attrib), elem.text)
+    except StopIteration:
+      self._stream = None
     except xml.ParseError:
-      err = 'An XML parser error occurred attempting to read XML tree from ' + filename + '.'
-      msg = traceback.format_exc().splitlines()
-      self._addError(err, msg)
-      root = None
+      self._stream = None
+      self._stream_error = self._parseError(self._file[1])
+    return None
 
-    # Return the object
-    return root
+  ##
+  # Find the appended data of a file (private)
+  # @param filename The name of the XML file
+  # @return A pair of the encoding and the AppendedData object, None if the file has no AppendedData
+  def _findAppended(self, filename):
+    f = open(filename, 'rb')
+    try:
+      # The data starts after the underscore following the start tag
+      position = 0
+      tail = ''
+      while True:
+        chunk = f.read(SCAN_CHUNK)
+        if chunk == '':
+          return None
+        data = tail + chunk
+        i = data.find('<AppendedData')
+        if i != -1:
+          start = position - len(tail) + i
+          f.seek(start)
+          m = re.match(r'<AppendedData\b([^>]*)>\s*_', f.read(SCAN_CHUNK))
+          if m == None:
+            return None
+          encoding = re.search(r'encoding\s*=\s*["\']([^"\']*)', m.group(1))
+          if encoding == None:
+            return ('base64', AppendedData(filename, start + m.end()))
+          return (encoding.group(1), AppendedData(filename, start + m.end()))
+        tail = data[-len('<AppendedData'):]
+        position += len(chunk)
+    finally:
+      f.close()
 
   ##
   # Perform the block by block comparison (private)
-  def _compare(self):
+  # @param filename The name of the master file
+  # @param compare When False the master file is only parsed
+  # @return A list of XMLError objects in the document order of the master file
+  def _compare(self, filename, compare):
 
-    # Define local variables
-    root = [self._root1, self._root2]
-    name = ['file 1', 'file 2']
-
-    # Do nothing if the objects do not exist
-    if root[0] == None or root[1] == None:
-      return
+    # Pairs of (order, XMLError)
+    errors = []
 
     # Loop through each tree object in the master file
-    for elem0 in root[0].getiterator():
-
-      # Initialize the result and error storage
-      results = []
-      errors  = []
-
-      # Loop through all blocks in the second file with the current tag
-      for elem1 in root[1].getiterator(elem0.tag):
-
-        # Perform the comparison
-        r, e = self._compareBlock(elem0, elem1)
-
-        # Append the test results
-        results.append(r)
-        errors.append(e)
-
-      # If all results are False, there was no match
-      if not any(results):
+    for order, elem in self._iterXML(filename, self._info[0]):
+      if not compare:
+        continue
 
-        # Filter out errors (elem.text failure)
-        errors = filter(None, errors)
+      for e in self._compareNext(XMLBlock(elem.tag, dict(elem.attrib), elem.text)):
+        errors.append((order, e))
 
-        # If no errors exist there was no block or block with identical attributes located
-        if len(errors) == 0:
-          msg = self._getAttrib(elem0)
-          if len(msg) == 0:
-            err = 'Unable to locate an XML Block with the tag "' + elem0.tag + '" in file 2.'
-            self._addError(err)
-          else:
-            err = 'Unable to locate an XML Block with the tag "' + elem0.tag + '" and the following attributes in file 2.'
-            self._addError(err, msg)
+      # Stop once the error budget is used up
+      if self._max_errors != None and len(errors) >= self._max_errors:
+        break
 
-        # Had a text error within similar blocks
-        else:
-          for e in errors:
-            self._addError(e)
+    errors.sort(key=lambda error: error[0])
+    return [error[1] for error in errors[:self._max_errors]]
 
+  ##
+  # Compare a block of the master file with the next block of the second file with the same tag and attributes (private)
+  #
+  # The blocks read ahead earlier are searched first, then the second file is read until such
+  # a block is found. The block found is used up by the comparison.
+  # @param elem0 The master XMLBlock object
+  # @return A list of XMLError objects, empty if the blocks match
+  def _compareNext(self, elem0):
+    elem1 = None
+    pending = self._pending.get(elem0.tag, [])
+    for i in xrange(len(pending)):
+      if self._matchAttributes(elem0, pending[i]):
+        elem1 = pending.pop(i)
+        break
+
+    while elem1 == None:
+      block = self._nextBlock()
+      if block == None:
+        break
+      if block.tag == elem0.tag and self._matchAttributes(elem0, block):
+        elem1 = block
+      else:
+        self._pending.setdefault(block.tag, []).append(block)
+
+    # Compare the text of the blocks
+    err = None
+    if elem1 != None:
+      result, err = self._compareText(elem0, elem1)
+      if result:
+        return []
+    if err != None:
+      return [err]
+
+    # There was no block with identical attributes (or with text, when the master block has some)
+    msg = self._getAttrib(elem0)
+    if len(msg) == 0:
+      err = 'Unable to locate an XML Block with the tag "' + elem0.tag + '" in file 2.'
+      return [XMLError(err, [])]
+    err = 'Unable to locate an XML Block with the tag "' + elem0.tag + '" and the following attributes in file 2.'
+    return [XMLError(err, msg)]
 
   ##
-  # Compares XML blocks (private)
-  # This function first compares the XML block attributes, if those match
-  # then the XML text is also compared.
+  # Compares the attributes of XML blocks (private)
+  # Perform attribute comparison in both directions: ensure that every attribute in the
+  # gold file is in the output file, and vice-versa.
   # @param elem0 The master XML element object
   # @param elem1 The XML element object to compare the master against
-  # @return A pair containing the test result (True or False) and an error indicator,
-  #         this 'indicator' is None if the result of the match is True or if the
-  #         attributes fail to match. When the text fails to match then it contains
-  #         the XMLError object.
-  def _compareBlock(self, elem0, elem1):
-
-    # Perform attribute comparison in both directions: ensure that
-    # every attribute in the gold file is in the output file, and
-    # vice-versa.
-    test_attrib = self._compareAttributes(elem0, elem1) and self._compareAttributes(elem1, elem0)
-
-    # If the attributes match, compare the text and return those results
-    if test_attrib:
-      test_text, err = self._compareText(elem0, elem1)
-      return test_text, err
-
-    # Otherwise the attributes do match
-    else:
-      return False, None
+  # @return True if the attributes match
+  def _matchAttributes(self, elem0, elem1):
+    return self._compareAttributes(elem0, elem1) and self._compareAttributes(elem1, elem0)
 
   ##
   # Perform attribute comparison (private)
@@ -216,6 +398,10 @@ class XMLDiffer(object):
       if key0 in self._ignored_attributes:
         continue
 
+      # The position of appended data depends on the size of the data before it
+      if key0 == 'offset' and elem0.attrib.get('format') == 'appended':
+        continue
+
       # Attribute is missing from the slave object, match fails
       if not elem1.attrib.has_key(key0):
         return  False
@@ -247,18 +433,24 @@ class XMLDiffer(object):
     result = True
     err = None
 
+    # Extract the values of the blocks
+    values = [None, None]
+    for i, elem in enumerate([elem0, elem1]):
+      try:
+        values[i] = self._getValues(elem, self._info[i])
+      except XMLDecodeError, ex:
+        err = 'Unable to decode the data of an XML block with the tag "' + elem.tag + '" and the following attributes in file ' + str(i + 1) + '.'
+        msg = self._getAttrib(elem)
+        msg.append(str(ex))
+        return (False, XMLError(err, msg))
+    (text0, text1) = values
+
     # Return if no text exists
-    if elem0.text == None and elem1.text == None:
+    if text0 is None and text1 is None:
       return (result, err)
-    elif elem0.text == None or elem1.text == None:
+    elif text0 is None or text1 is None:
       return (False, err)
 
-    # Convert the text to a list of strings
-    text0 = elem0.text.replace('\n', '').strip().split(' ')
-    text1 = elem1.text.replace('\n', '').strip().split(' ')
-    text0 = filter(None, text0)
-    text1 = filter(None, text1)
-
     # Check that the lengths are the same
     if len(text0) != len(text1):
       result = False
@@ -269,18 +461,181 @@ class XMLDiffer(object):
       err = XMLError(err, msg)
       return (False, err)
 
-    for i in xrange(len(text0)):
-      value, rel_diff = self._isClose(text0[i], text1[i])
-
-      if not value:
-        err = 'An XML block with the tag "' + elem0.tag + '" and the following attributes has differing values on file 2.'
-        msg = self._getAttrib(elem0)
-        msg.append('Index ' + str(i) + ' : ' + text0[i] + ' ~ ' + text1[i] + ', rel diff: ' + '%e' % rel_diff)
-        err = XMLError(err, msg)
-        return (False, err)
+    # Only test the first max_values values
+    count = len(text0)
+    if self._max_values != None:
+      count = min(count, int(self._max_values))
+
+    # Compare the values as numbers or, when they are not numbers, as strings
+    numbers0 = self._toNumbers(text0)
+    numbers1 = self._toNumbers(text1)
+    if numbers0 is None or numbers1 is None:
+      for i in xrange(count):
+        if text0[i] != text1[i]:
+          err = 'An XML block with the tag "' + elem0.tag + '" and the following attributes has differing values on file 2.'
+          msg = self._getAttrib(elem0)
+          msg.append('Index ' + str(i) + ' : ' + str(text0[i]) + ' ~ ' + str(text1[i]))
+          return (False, XMLError(err, msg))
+      return result, err
+
+    i = self._firstDifference(numbers0, numbers1, count)
+    if i != None:
+      value, rel_diff = self._isClose(numbers0[i], numbers1[i])
+      err = 'An XML block with the tag "' + elem0.tag + '" and the following attributes has differing values on file 2.'
+      msg = self._getAttrib(elem0)
+      msg.append('Index ' + str(i) + ' : ' + str(text0[i]) + ' ~ ' + str(text1[i]) + ', rel diff: ' + '%e' % rel_diff)
+      err = XMLError(err, msg)
+      return (False, err)
 
     return result, err
 
+  ##
+  # Get the values stored in a block (private)
+  # @param elem The XMLBlock object
+  # @param info The encoding settings and appended data of the file containing the block
+  # @return None if the block has no text, a list of strings for text blocks or a
+  #         sequence of numbers for binary and appended DataArray blocks
+  def _getValues(self, elem, info):
+    if elem.extracted:
+      return elem.values
+
+    # The appended data is compared through the DataArray blocks referring to it
+    if elem.tag == 'AppendedData':
+      values = None
+
+    elif elem.tag == 'DataArray' and elem.attrib.get('format') == 'binary':
+      values = self._decodeBinary(''.join((elem.text or '').split()), elem, info)
+
+    elif elem.tag == 'DataArray' and elem.attrib.get('format') == 'appended':
+      if 'appended' not in info:
+        info['appended'] = self._findAppended(info['filename'])
+      if info['appended'] == None:
+        raise XMLDecodeError('The file has no AppendedData')
+      (encoding, data) = info['appended']
+      if encoding != 'base64':
+        raise XMLDecodeError('Unsupported AppendedData encoding: ' + encoding)
+
+      # Offsets are counted from the character after the leading underscore
+      values = self._decodeBinary(data.at(int(elem.attrib.get('offset', 0))), elem, info)
+
+    elif elem.text == None:
+      values = None
+
+    # Convert the text to a list of strings
+    else:
+      values = filter(None, elem.text.replace('\n', '').strip().split(' '))
+
+    elem.values = values
+    elem.extracted = True
+    return values
+
+  ##
+  # Decode base64 encoded VTK binary data (private)
+  # @param data The base64 data, starting at the header of the block
+  # @param elem The DataArray XMLBlock object
+  # @param info The encoding settings of the file containing the block
+  # @return A sequence of numbers
+  def _decodeBinary(self, data, elem, info):
+    type = elem.attrib.get('type', 'Float64')
+    if type not in VTK_TYPES:
+      raise XMLDecodeError('Unsupported DataArray type: ' + type)
+
+    endian = '<'
+    if info['byte_order'] == 'BigEndian':
+      endian = '>'
+    header = endian + 'I'
+    if info['header_type'] == 'UInt64':
+      header = endian + 'Q'
+    size = struct.calcsize(header)
+
+    try:
+      if info['compressor'] != '':
+        # The header holds the number of blocks, the block size, the size of the last block
+        # and then the compressed size of each block
+        count = struct.unpack(header, self._decodeBase64(data, 0, size)[:size])[0]
+        header_size = (3 + count) * size
+        sizes = struct.unpack(endian + header[1] * (3 + count), self._decodeBase64(data, 0, header_size)[:header_size])[3:]
+        compressed = self._decodePayload(data, header_size, sum(sizes))
+        blocks = []
+        start = 0
+        for block_size in sizes:
+          blocks.append(zlib.decompress(compressed[start:start + block_size]))
+          start += block_size
+        payload = ''.join(blocks)
+      else:
+        nbytes = struct.unpack(header, self._decodeBase64(data, 0, size)[:size])[0]
+        payload = self._decodePayload(data, size, nbytes)
+
+      format = endian + VTK_TYPES[type]
+      count = len(payload) / struct.calcsize(format)
+      if numpy != None:
+        return numpy.frombuffer(payload, dtype=numpy.dtype(format), count=count)
+      return struct.unpack(endian + VTK_TYPES[type] * count, payload[:count * struct.calcsize(format)])
+
+    except (TypeError, struct.error, zlib.error), ex:
+      raise XMLDecodeError('Invalid binary data: ' + str(ex))
+
+  ##
+  # Decode enough base64 characters to obtain nbytes bytes (private)
+  def _decodeBase64(self, data, start, nbytes):
+    return base64.b64decode(data[start:start + 4 * ((nbytes + 2) / 3)])
+
+  ##
+  # Decode the data following a header of header_size bytes (private)
+  #
+  # VTK writes the header and the data as separate base64 strings, in which case the
+  # header ends in padding unless its size is a multiple of three. Otherwise both are
+  # encoded together.
+  def _decodePayload(self, data, header_size, nbytes):
+    start = 4 * ((header_size + 2) / 3)
+    if header_size % 3 == 0 or data[start - 1:start] == '=':
+      payload = self._decodeBase64(data, start, nbytes)
+    else:
+      payload = self._decodeBase64(data, 0, header_size + nbytes)[header_size:]
+
+    if len(payload) < nbytes:
+      raise XMLDecodeError('Expected ' + str(nbytes) + ' bytes of data, found ' + str(len(payload)))
+    return payload[:nbytes]
+
+  ##
+  # Convert a sequence of values to numbers (private)
+  # @return An array (or list if NumPy is not available) of floats, None if the values are not all numbers
+  def _toNumbers(self, values):
+    try:
+      if numpy != None:
+        return numpy.asarray(values, dtype=float)
+      return [float(value) for value in values]
+    except ValueError:
+      return None
+
+  ##
+  # Find the first value that fails the relative tolerance check (private)
+  # @param values0 The values of the master block
+  # @param values1 The values to compare against
+  # @param count The number of values to compare
+  # @return The index of the first differing value, or None if all values are close
+  def _firstDifference(self, values0, values1, count):
+    if numpy == None:
+      for i in xrange(count):
+        if not self._isClose(values0[i], values1[i])[0]:
+          return i
+      return None
+
+    # The same operations as _isClose, applied to all values at once
+    values0 = numpy.where(numpy.abs(values0[:count]) < self._abs_zero, 0.0, values0[:count])
+    values1 = numpy.where(numpy.abs(values1[:count]) < self._abs_zero, 0.0, values1[:count])
+    old_settings = numpy.seterr(all='ignore')
+    try:
+      rel_diff = numpy.abs((values0 - values1) / numpy.maximum(numpy.abs(values0), numpy.abs(values1)))
+      different = (rel_diff > self._rtol) & ~((values0 == 0) & (values1 == 0))
+    finally:
+      numpy.seterr(**old_settings)
+
+    indices = numpy.flatnonzero(different)
+    if len(indices):
+      return int(indices[0])
+    return None
+
   ##
   # Perform relative tolerance check between two numbers (private)
   # @param value0 A string or list of strings containing the first number
@@ -42,6 +42,11 @@ class AnalyzeJacobian(Tester):
     return command
 
 
+  def getOutputPatterns(self, options):
+    if self.specs.isValid('expect_out'):
+      return [(self.specs['expect_out'], re.MULTILINE | re.DOTALL)]
+    return []
+
   def processResults(self, moose_dir, retcode, options, output):
     reason = ''
     specs = self.specs
@@ -60,7 +65,4 @@ class AnalyzeJacobian(Tester):
     return (reason, output)
 
   def checkOutputForPattern(self, output, re_pattern):
-    if re.search(re_pattern, output, re.MULTILINE | re.DOTALL) == None:
-      return False
-    else:
-      return True
+    return self.searchOutput(output, re_pattern, re.MULTILINE | re.DOTALL) != None
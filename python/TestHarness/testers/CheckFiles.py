@@ -1,6 +1,6 @@
 from RunApp import RunApp
 from util import runCommand
-import os
+import os, re
 
 class CheckFiles(RunApp):
 
@@ -46,7 +46,8 @@ class CheckFiles(RunApp):
            fid = open(os.path.join(self.specs['test_dir'], file), 'r')
            contents = fid.read()
            fid.close()
-           if not self.checkOutputForPattern(contents, self.specs['file_expect_out']):
+           # The contents of the file, not the output of the test the patterns were searched for in
+           if re.search(self.specs['file_expect_out'], contents, re.MULTILINE | re.DOTALL) == None:
              reason = 'NO EXPECTED OUT IN FILE'
              break
 
@@ -1,5 +1,6 @@
 from RunApp import RunApp
 from util import runCommand
+import ExodusDiffer
 import os
 
 class Exodiff(RunApp):
@@ -51,6 +52,21 @@ class Exodiff(RunApp):
     return commands
 
 
+  # Compare a file with its gold file without starting exodiff. Returns True only if the
+  # files are known to be the same, exodiff is run to report any differences.
+  def compareInProcess(self, file, options):
+    if options.external_exodiff or len(self.specs['exodiff_opts']) or not ExodusDiffer.available():
+      return False
+
+    custom_cmp = None
+    if self.specs.isValid('custom_cmp'):
+      custom_cmp = os.path.join(self.specs['test_dir'], self.specs['custom_cmp'])
+
+    differ = ExodusDiffer.ExodusDiffer(os.path.join(self.specs['test_dir'], self.specs['gold_dir'], file),
+                                       os.path.join(self.specs['test_dir'], file),
+                                       self.specs['abs_zero'], self.specs['rel_err'], custom_cmp, self.specs['use_old_floor'])
+    return differ.diff()
+
   def processResults(self, moose_dir, retcode, options, output):
     (reason, output) = RunApp.processResults(self, moose_dir, retcode, options, output)
 
@@ -72,7 +88,11 @@ class Exodiff(RunApp):
       # Retrieve the commands
       commands = self.processResultsCommand(moose_dir, options)
 
-      for command in commands:
+      for file, command in zip(self.specs['exodiff'], commands):
+        if self.compareInProcess(file, options):
+          output += 'Compared in process: ' + os.path.join(self.specs['gold_dir'], file) + ' ' + file + '\nexodiff: Files are the same\n'
+          continue
+
         exo_output = runCommand(command)
 
         output += 'Running exodiff: ' + command + '\n' + exo_output + ' ' + ' '.join(self.specs['exodiff_opts'])
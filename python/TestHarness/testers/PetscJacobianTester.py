@@ -2,6 +2,8 @@ from RunApp import RunApp
 from util import runCommand
 import os, re
 
+JACOBIAN_PATTERN = "Norm of matrix ratio (\S+?),? difference (\S+) \(user-defined state\)"
+
 class PetscJacobianTester(RunApp):
 
   @staticmethod
@@ -22,8 +24,11 @@ class PetscJacobianTester(RunApp):
     RunApp.__init__(self, name, params)
     self.specs['cli_args'].append('-snes_type test')
 
+  def getOutputPatterns(self, options):
+    return RunApp.getOutputPatterns(self, options) + [(JACOBIAN_PATTERN, re.MULTILINE | re.DOTALL)]
+
   def processResults(self, moose_dir, retcode, options, output):
-    m = re.search("Norm of matrix ratio (\S+?),? difference (\S+) \(user-defined state\)", output, re.MULTILINE | re.DOTALL);
+    m = self.searchOutput(output, JACOBIAN_PATTERN, re.MULTILINE | re.DOTALL)
     if m:
       if float(m.group(1)) < float(self.specs['ratio_tol']) and float(m.group(2)) < float(self.specs['difference_tol']):
         reason = ''
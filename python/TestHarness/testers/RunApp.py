@@ -241,6 +241,20 @@ class RunApp(Tester):
     return os.path.join(self.specs['moose_dir'], 'scripts', 'cluster_launcher.py') + ' ' + options.pbs + '.cluster'
 
 
+  def getOutputPatterns(self, options):
+    specs = self.specs
+    patterns = []
+    if specs.isValid('expect_out'):
+      if specs['match_literal']:
+        patterns.append((re.escape(specs['expect_out']), 0))
+      else:
+        patterns.append((specs['expect_out'], re.MULTILINE | re.DOTALL))
+    if specs.isValid('absent_out'):
+      patterns.append((specs['absent_out'], re.MULTILINE | re.DOTALL))
+    for literal in specs['errors'] + ['ERROR SUMMARY: 0 errors']:
+      patterns.append((re.escape(literal), 0))
+    return patterns
+
   def processResults(self, moose_dir, retcode, options, output):
     reason = ''
     specs = self.specs
@@ -261,7 +275,7 @@ class RunApp(Tester):
       # We won't pay attention to the ERROR strings if EXPECT_ERR is set (from the derived class)
       # since a message to standard error might actually be a real error.  This case should be handled
       # in the derived class.
-      if options.valgrind_mode == '' and not specs.isValid('expect_err') and len( filter( lambda x: x in output, specs['errors'] ) ) > 0:
+      if options.valgrind_mode == '' and not specs.isValid('expect_err') and len( filter( lambda x: self.checkOutputForLiteral(output, x), specs['errors'] ) ) > 0:
         reason = 'ERRMSG'
       elif retcode == RunParallel.TIMEOUT:
         reason = 'TIMEOUT'
@@ -270,25 +284,22 @@ class RunApp(Tester):
       elif retcode != 0 and specs['should_crash'] == False:
         reason = 'CRASH'
       # Valgrind runs
-      elif retcode == 0 and self.shouldExecute() and options.valgrind_mode != '' and 'ERROR SUMMARY: 0 errors' not in output:
+      elif retcode == 0 and self.shouldExecute() and options.valgrind_mode != '' and not self.checkOutputForLiteral(output, 'ERROR SUMMARY: 0 errors'):
         reason = 'MEMORY ERROR'
       # PBS runs
-      elif retcode == 0 and options.pbs and 'command not found' in output:
+      elif retcode == 0 and options.pbs and self.checkOutputForLiteral(output, 'command not found'):
         reason = 'QSUB NOT FOUND'
 
     return (reason, output)
 
+  # Patterns from getOutputPatterns have been searched for while the test ran
   def checkOutputForPattern(self, output, re_pattern):
-    if re.search(re_pattern, output, re.MULTILINE | re.DOTALL) == None:
-      return False
-    else:
-      return True
+    return self.searchOutput(output, re_pattern, re.MULTILINE | re.DOTALL) != None
 
   def checkOutputForLiteral(self, output, literal):
-    if output.find(literal) == -1:
-      return False
-    else:
-      return True
+    if self.outputScanned(re.escape(literal)):
+      return self.getOutputMatch(re.escape(literal)) != None
+    return output.find(literal) != -1
 
   def deleteFilesAndFolders(self, test_dir, paths, delete_folders=True):
     # First delete the files (at the end of each of the paths)
@@ -1,3 +1,4 @@
+import re
 from RunApp import RunApp
 
 class RunException(RunApp):
@@ -24,6 +25,18 @@ class RunException(RunApp):
       return (False, reason)
     return RunApp.checkRunnable(self, options)
 
+  # Errors are caught by the application server, which goes on with the next test. The
+  # output and return code it reports are those of a process of its own
+  def canRunInServer(self, options):
+    return self.getProcs(options) == 1 and self.getThreads(options) == 1
+
+  def getOutputPatterns(self, options):
+    patterns = RunApp.getOutputPatterns(self, options)
+    for param in ['expect_err', 'expect_assert']:
+      if self.specs.isValid(param):
+        patterns.append((self.specs[param], re.MULTILINE | re.DOTALL))
+    return patterns
+
   def processResults(self, moose_dir, retcode, options, output):
     reason = ''
     specs = self.specs
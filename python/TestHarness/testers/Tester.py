@@ -1,6 +1,7 @@
 from util import *
 from InputParameters import InputParameters
 from MooseObject import MooseObject
+from OutputCapture import compilePattern
 
 class Tester(MooseObject):
 
@@ -66,6 +67,10 @@ class Tester(MooseObject):
       if item.upper() == 'SERIAL':
         mesh_mode[i] = 'REPLICATED'
 
+    # First matches of the patterns from getOutputPatterns found in the output of the
+    # test while it ran, keyed on the (pattern, flags) tuples (None if not found)
+    self.output_matches = {}
+
   # Method to return the input file if applicable to this Tester
   def getInputFile(self):
     return None
@@ -103,11 +108,42 @@ class Tester(MooseObject):
   def getProcs(self, options):
     return 1
 
+  # Override this method to allow the test to run in a long-lived process of its application
+  # (--app-server) instead of a process of its own. Only suitable for tests that merely check
+  # what the application reports, see AppServer
+  def canRunInServer(self, options):
+    return False
+
   # This method should return the executable command that will be executed by the tester
   def getCommand(self, options):
     return
 
 
+  # Override this method to return the regular expressions processResults searches the
+  # output for as a list of (pattern, flags) tuples. They are matched against the output
+  # while the test runs, which finds them even in the part of a long output that is
+  # trimmed. See getOutputMatch
+  def getOutputPatterns(self, options):
+    return []
+
+  # Return the first match of a pattern from getOutputPatterns found in the output
+  # of the test, or None
+  def getOutputMatch(self, pattern, flags=0):
+    return self.output_matches.get((pattern, flags))
+
+  # Whether the output of the test has already been searched for a pattern, in which
+  # case getOutputMatch has the answer
+  def outputScanned(self, pattern, flags=0):
+    return (pattern, flags) in self.output_matches
+
+  # Return the first match of a pattern in the output of the test or None. The output
+  # is only searched for patterns that were not searched for while the test ran
+  def searchOutput(self, output, pattern, flags=0):
+    if self.outputScanned(pattern, flags):
+      return self.getOutputMatch(pattern, flags)
+    return compilePattern(pattern, flags).search(output)
+
+
   # This method is called to return the commands (list) used for processing results
   def processResultsCommand(self, moose_dir, options):
     return []
@@ -162,8 +198,9 @@ class Tester(MooseObject):
         test_reason = skip_message
       reason = 'skipped (' + test_reason + ')'
       return (False, reason)
-    # If were testing for SCALE_REFINE, then only run tests with a SCALE_REFINE set
-    elif (options.store_time or options.scaling) and self.specs['scale_refine'] == 0:
+    # If were testing for SCALE_REFINE, then only run tests with a SCALE_REFINE set (the timing
+    # modes scale the tests that have one and run all of the others as well)
+    elif options.scaling and not (options.store_time or options.perf_check != None) and self.specs['scale_refine'] == 0:
       return (False, reason)
     # If we're testing with valgrind, then skip tests that require parallel or threads or don't meet the valgrind setting
     elif options.valgrind_mode != '':
@@ -221,10 +258,6 @@ class Tester(MooseObject):
       reason = 'skipped (HEAVY)'
       return (False, reason)
 
-    # Check for positive scale refine values when using store timing options
-    if self.specs['scale_refine'] == 0 and options.store_time:
-      return (False, reason)
-
     # There should only be one entry in self.specs['dof_id_bytes']
     for x in self.specs['dof_id_bytes']:
       if x != 'ALL' and not x in checks['dof_id_bytes']:
@@ -1,4 +1,5 @@
-import platform, os, re
+import platform, os, re, errno, tempfile, hashlib
+import cPickle as pickle
 from subprocess import *
 from time import strftime, gmtime, ctime, localtime, asctime
 from utils import colorText
@@ -98,7 +99,7 @@ def runCommand(cmd, cwd=None):
 # 1) options.colored is False,
 # 2) the environment variable BITTEN_NOCOLOR is true, or
 # 3) the color parameter is False.
-def printResult(test_name, result, timing, start, end, options, color=True):
+def printResult(test_name, result, timing, start, end, options, color=True, usage=''):
   f_result = ''
 
   cnt = (TERM_COLS-2) - len(test_name + result)
@@ -156,6 +157,9 @@ def printResult(test_name, result, timing, start, end, options, color=True):
   # Tack on the timing if it exists
   if timing:
     f_result += ' [' + '%0.3f' % float(timing) + 's]'
+  # And the resources used by the test when asked for
+  if usage and options.resources:
+    f_result += ' [' + usage + ']'
   if options.debug_harness:
     f_result += ' Start: ' + '%0.3f' % start + ' End: ' + '%0.3f' % end
   return f_result
@@ -183,7 +187,8 @@ def getPlatforms():
     platforms.add(raw_uname[0].upper())
   return platforms
 
-def runExecutable(libmesh_dir, location, bin, args):
+## Return the path to one of libMesh's executables
+def findExecutable(libmesh_dir, location, bin):
   # Installed location of libmesh executable
   libmesh_installed   = libmesh_dir + '/' + location + '/' + bin
 
@@ -209,7 +214,10 @@ def runExecutable(libmesh_dir, location, bin, args):
     print "Error! Could not find '" + bin + "' in any of the usual libmesh's locations!"
     exit(1)
 
-  return runCommand(libmesh_exe + " " + args).rstrip()
+  return libmesh_exe
+
+def runExecutable(libmesh_dir, location, bin, args):
+  return runCommand(findExecutable(libmesh_dir, location, bin) + " " + args).rstrip()
 
 
 def getCompilers(libmesh_dir):
@@ -237,9 +245,14 @@ def getCompilers(libmesh_dir):
 
   return compilers
 
-def getPetscVersion(libmesh_dir):
-  major_version = getLibMeshConfigOption(libmesh_dir, 'petsc_major')
-  minor_version = getLibMeshConfigOption(libmesh_dir, 'petsc_minor')
+## Return the PETSc version libMesh was configured with
+#
+# config_options may be passed in if getLibMeshConfigOptions() has already been called
+def getPetscVersion(libmesh_dir, config_options=None):
+  if config_options == None:
+    config_options = getLibMeshConfigOptions(libmesh_dir)
+  major_version = set(config_options['petsc_major'])
+  minor_version = set(config_options['petsc_minor'])
   if len(major_version) != 1 or len(minor_version) != 1:
     print "Error determining PETSC version"
     exit(1)
@@ -280,50 +293,57 @@ def getIfAsioExists(moose_dir):
     option_set.add('FALSE')
   return option_set
 
-def getLibMeshConfigOption(libmesh_dir, option):
-  # Some tests work differently with parallel mesh enabled
-  # We need to detect this condition
-  option_set = set(['ALL'])
-
+## Return the path to libmesh_config.h
+def findLibMeshConfigFile(libmesh_dir):
   filenames = [
     libmesh_dir + '/include/base/libmesh_config.h',   # Old location
     libmesh_dir + '/include/libmesh/libmesh_config.h' # New location
     ];
 
-  success = 0
   for filename in filenames:
-    if success == 1:
-      break
+    if os.path.isfile(filename):
+      return filename
 
-    try:
-      f = open(filename)
-      contents = f.read()
-      f.close()
+  print "Error! Could not find libmesh_config.h in any of the usual locations!"
+  exit(1)
 
-      info = LIBMESH_OPTIONS[option]
-      m = re.search(info['re_option'], contents)
-      if m != None:
-        if 'options' in info:
-          for value, option in info['options'].iteritems():
-            if m.group(1) == option:
-              option_set.add(value)
-        else:
-          option_set.clear()
-          option_set.add(m.group(1))
-      else:
-        option_set.add(info['default'])
+## Return the option set of every entry in LIBMESH_OPTIONS, keyed on the option name
+#
+# libmesh_config.h is only read once no matter how many options are checked.
+def getLibMeshConfigOptions(libmesh_dir):
+  filename = findLibMeshConfigFile(libmesh_dir)
+  try:
+    f = open(filename)
+    contents = f.read()
+    f.close()
+  except IOError, e:
+    print "Error! Unable to read", filename, ":", e.strerror
+    exit(1)
 
-      success = 1
+  options = {}
+  for option, info in LIBMESH_OPTIONS.iteritems():
+    # Some tests work differently with parallel mesh enabled
+    # We need to detect this condition
+    option_set = set(['ALL'])
+
+    m = re.search(info['re_option'], contents)
+    if m != None:
+      if 'options' in info:
+        for value, option_value in info['options'].iteritems():
+          if m.group(1) == option_value:
+            option_set.add(value)
+      else:
+        option_set.clear()
+        option_set.add(m.group(1))
+    else:
+      option_set.add(info['default'])
 
-    except IOError, e:
-      # print "Warning: I/O Error trying to read", filename, ":", e.strerror, "... Will try other locations."
-      pass
+    options[option] = option_set
 
-  if success == 0:
-    print "Error! Could not find libmesh_config.h in any of the usual locations!"
-    exit(1)
+  return options
 
-  return option_set
+def getLibMeshConfigOption(libmesh_dir, option):
+  return getLibMeshConfigOptions(libmesh_dir)[option]
 
 def getSharedOption(libmesh_dir):
   # Some tests may only run properly with shared libraries on/off
@@ -357,3 +377,173 @@ def getInitializedSubmodules(root_dir):
     return []
   # This ignores submodules that have a '-' at the beginning which means they are not initialized
   return re.findall(r'^[ +]\S+ (\S+)', output, flags=re.MULTILINE)
+
+## Return the .git directory of the repository containing path, or None if it is not in one
+def findGitDir(path):
+  path = os.path.abspath(path)
+  while True:
+    git_path = os.path.join(path, '.git')
+    if os.path.isdir(git_path):
+      return git_path
+
+    # Submodules and worktrees use a file pointing at the real directory
+    if os.path.isfile(git_path):
+      f = open(git_path)
+      m = re.match(r'gitdir:\s*(.*)', f.read())
+      f.close()
+      if m:
+        return os.path.normpath(os.path.join(path, m.group(1).strip()))
+      return None
+
+    parent = os.path.dirname(path)
+    if parent == path:
+      return None
+    path = parent
+
+## Return a stamp of the modification time and size of each path, None for missing paths
+#
+# Comparing stamps is a cheap way to tell whether any of the files changed.
+def getFileStamps(paths):
+  stamps = []
+  for path in paths:
+    try:
+      stat = os.stat(path)
+      stamps.append((path, stat.st_mtime, stat.st_size))
+    except OSError:
+      stamps.append((path, None, None))
+  return tuple(stamps)
+
+## The md5 of the contents of files, kept in a file so it is only computed again for files
+# whose modification time or size changed
+#
+# Shared by everything that keys cached results on file contents (LastRunState, RunJournal
+# and ArtifactCache), so each file is read at most once per run.
+class FileDigests:
+  def __init__(self, filename):
+    self.filename = filename
+
+    ## {path : (mtime, size, md5)}
+    self.digests = loadPickle(self.filename, {})
+    if type(self.digests) != dict:
+      self.digests = {}
+
+  ## Return the md5 of the contents of a file (None if it can not be read)
+  def digest(self, path):
+    try:
+      stat = os.stat(path)
+    except OSError:
+      return None
+
+    (mtime, size, digest) = self.digests.get(path, (None, None, None))
+    if (stat.st_mtime, stat.st_size) == (mtime, size):
+      return digest
+
+    try:
+      f = open(path, 'rb')
+      try:
+        h = hashlib.md5()
+        while True:
+          data = f.read(1 << 20)
+          if data == '':
+            break
+          h.update(data)
+        digest = h.hexdigest()
+      finally:
+        f.close()
+    except IOError:
+      return None
+
+    self.digests[path] = (stat.st_mtime, stat.st_size, digest)
+    return digest
+
+  ## Write the digests back to disk, forgetting about files that no longer exist
+  def save(self):
+    for path in self.digests.keys():
+      if not os.path.exists(path):
+        del self.digests[path]
+
+    try:
+      dumpPickle(self.filename, self.digests)
+    except (IOError, OSError), ex:
+      print 'Warning: unable to write the file digests ' + self.filename + ': ' + str(ex)
+
+## Parameters naming files the tests write rather than read
+OUTPUT_PARAMETERS = set(['check_files', 'check_not_exists'])
+
+## Parameters naming output files compared against the file of the same name in the gold directory
+GOLD_PARAMETERS = set(['exodiff', 'csvdiff', 'vtkdiff'])
+
+## Return the set of existing files named by the parameters of a test
+#
+# Any string parameter can name a file the test reads. A name that exists in the gold
+# directory stands for the gold file, not the output of the same name in the test directory,
+# and the outputs compared against gold files only ever stand for the gold files. The files
+# in depend_files are relative to the base directory.
+def getParameterFiles(specs):
+  test_dir = specs['test_dir']
+  gold_dir = ''
+  if specs.isValid('gold_dir'):
+    gold_dir = specs['gold_dir']
+
+  files = set()
+  for name in specs.valid_keys():
+    # Parameters starting with an underscore hold the objects used to build the tester
+    if name in OUTPUT_PARAMETERS or name.startswith('_'):
+      continue
+    value = specs[name]
+    if type(value) == str:
+      value = [value]
+    if type(value) != list:
+      continue
+
+    for item in value:
+      if type(item) != str or item == '':
+        continue
+      if name == 'depend_files':
+        candidates = [os.path.join(specs['base_dir'], item)]
+      elif name in GOLD_PARAMETERS:
+        candidates = [os.path.join(test_dir, gold_dir, item)]
+      else:
+        candidates = [os.path.join(test_dir, gold_dir, item), os.path.join(test_dir, item)]
+      for path in candidates:
+        if os.path.isfile(path):
+          files.add(os.path.abspath(path))
+          break
+  return files
+
+## Load a pickled object written by dumpPickle, returning default if it is missing or unreadable
+def loadPickle(filename, default=None):
+  try:
+    f = open(filename, 'rb')
+    try:
+      return pickle.load(f)
+    finally:
+      f.close()
+  except (IOError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError):
+    return default
+
+## Pickle an object to a file
+#
+# The data is written to a temporary file which is then renamed over the target so
+# that concurrent runs sharing the file never see a partially written copy.
+def dumpPickle(filename, data):
+  directory = os.path.dirname(os.path.abspath(filename))
+  try:
+    os.makedirs(directory)
+  except OSError, ex:
+    if ex.errno != errno.EEXIST:
+      raise
+
+  (fd, tmp_name) = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(filename))
+  f = os.fdopen(fd, 'wb')
+  try:
+    pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+  finally:
+    f.close()
+
+  # mkstemp creates the file private to the user, apply the usual umask instead
+  umask = os.umask(0)
+  os.umask(umask)
+  os.chmod(tmp_name, 0666 & ~umask)
+
+  os.rename(tmp_name, filename)
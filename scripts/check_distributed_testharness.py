@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# Runs the tests of an application with a coordinator and several workers on this host
+# (run_tests --coordinator/--worker) and again locally, and compares the results.
+#
+# Usage (from the directory of the application):
+#   check_distributed_testharness.py [-n workers] [-j jobs] [run_tests options...]
+#
+# The options that follow are passed to every run, to select tests (--re, -i, ...).
+# Exits with 1 if a test has a different status in the two runs or the runs do not
+# end with the same exit code.
+import os, sys, time, json, socket, binascii, tempfile, shutil, subprocess, argparse
+
+## Seconds to wait for the coordinator to start listening
+STARTUP_TIMEOUT = 300
+
+## Return a port nobody listens on right now
+def findFreePort():
+  s = socket.socket()
+  s.bind(('localhost', 0))
+  port = s.getsockname()[1]
+  s.close()
+  return port
+
+## Return the status of every test in a --results-json file, keyed on the test name
+def readResults(filename):
+  results = {}
+  f = open(filename)
+  for line in f:
+    record = json.loads(line)
+    results[record['name']] = record['status']
+  f.close()
+  return results
+
+## Wait for the coordinator to print the line asking for workers, returns False if it exits first
+def waitForCoordinator(coordinator, log_name):
+  end = time.time() + STARTUP_TIMEOUT
+  while time.time() < end:
+    if 'Waiting for workers' in open(log_name).read():
+      return True
+    if coordinator.poll() != None:
+      return False
+    time.sleep(0.1)
+  return False
+
+def runDistributed(run_tests, args, workers, jobs, directory):
+  env = os.environ.copy()
+  env['TESTHARNESS_AUTHKEY'] = binascii.hexlify(os.urandom(16))
+  address = 'localhost:%d' % findFreePort()
+
+  log_name = os.path.join(directory, 'coordinator.log')
+  log = open(log_name, 'w')
+  coordinator = subprocess.Popen([run_tests, '--coordinator', address, '--results-json', os.path.join(directory, 'distributed.json')] + args,
+                                 stdout=log, stderr=subprocess.STDOUT, env=env)
+  if not waitForCoordinator(coordinator, log_name):
+    print open(log_name).read()
+    print 'ERROR: The coordinator did not start'
+    if coordinator.poll() == None:
+      coordinator.kill()
+    sys.exit(1)
+
+  processes = []
+  for i in xrange(workers):
+    worker_log = open(os.path.join(directory, 'worker_%d.log' % i), 'w')
+    processes.append(subprocess.Popen([run_tests, '--worker', address, '-j', str(jobs)], stdout=worker_log, stderr=subprocess.STDOUT, env=env))
+
+  returncode = coordinator.wait()
+  for process in processes:
+    process.wait()
+  log.close()
+
+  print open(log_name).read()
+  return returncode
+
+def main():
+  parser = argparse.ArgumentParser(description='Compare a distributed run of run_tests with workers on this host to a local run')
+  parser.add_argument('-n', type=int, default=2, dest='workers', help='The number of workers (default: 2)')
+  parser.add_argument('-j', type=int, default=2, dest='jobs', help='The number of jobs of each worker (default: 2)')
+  parser.add_argument('--run-tests', default='./run_tests', dest='run_tests', help='The run_tests script (default: ./run_tests)')
+  (options, args) = parser.parse_known_args()
+
+  directory = tempfile.mkdtemp(prefix='distributed_testharness_')
+  try:
+    print 'Distributed run with %d workers of %d jobs:' % (options.workers, options.jobs)
+    distributed_code = runDistributed(options.run_tests, args, options.workers, options.jobs, directory)
+
+    print 'Local run with %d jobs:' % (options.workers * options.jobs)
+    local_code = subprocess.call([options.run_tests, '-j', str(options.workers * options.jobs),
+                                  '--results-json', os.path.join(directory, 'local.json')] + args)
+
+    distributed = readResults(os.path.join(directory, 'distributed.json'))
+    local = readResults(os.path.join(directory, 'local.json'))
+  finally:
+    shutil.rmtree(directory, True)
+
+  differences = 0
+  for name in sorted(set(distributed.keys()) | set(local.keys())):
+    if distributed.get(name) != local.get(name):
+      print '%s: %s distributed, %s locally' % (name, distributed.get(name, 'missing'), local.get(name, 'missing'))
+      differences += 1
+  if distributed_code != local_code:
+    print 'The distributed run exited with %d, the local run with %d' % (distributed_code, local_code)
+    differences += 1
+
+  if differences:
+    print 'FAILED: The distributed run differs from the local run'
+    sys.exit(1)
+  print 'OK: %d tests with the same results' % len(local)
+
+if __name__ == '__main__':
+  main()
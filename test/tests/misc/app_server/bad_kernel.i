@@ -0,0 +1,24 @@
+[Mesh]
+  type = GeneratedMesh
+  dim = 2
+  nx = 4
+  ny = 4
+[]
+
+[Variables]
+  [./u]
+  [../]
+[]
+
+[Kernels]
+  # Not a registered object
+  [./diff]
+    type = Foo
+    variable = u
+  [../]
+[]
+
+[Executioner]
+  type = Steady
+  solve_type = 'PJFNK'
+[]
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Runs inputs through an application server (--server, see TestHarness/AppServer.py) and each
+# in a process of its own, and checks that both runs fail or pass alike and report the same
+# error, warnings and messages.
+#
+# The requests are sent to the same server one after the other, so the options of one request
+# (--error) must not carry over to the next one, and the messages printed once per run must
+# be printed again.
+import os, sys, re, time, select, subprocess
+
+MOOSE_DIR = os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), '..', '..', '..', '..'))
+if os.environ.has_key('MOOSE_DIR'):
+  MOOSE_DIR = os.environ['MOOSE_DIR']
+
+sys.path.append(os.path.join(MOOSE_DIR, 'python'))
+import path_tool
+path_tool.activate_module('TestHarness')
+from AppServer import AppServer
+
+## The arguments of the requests, in the order they are sent to the server
+REQUESTS = [['-i', 'warning.i', '--error'],
+            ['-i', 'warning.i'],
+            ['-i', 'bad_kernel.i'],
+            ['-i', 'deprecated.i'],
+            ['-i', 'warning.i', '--error'],
+            ['-i', 'warning.i'],
+            ['-i', 'deprecated.i']]
+
+## Seconds to wait for the server to run a request
+TIMEOUT = 300
+
+## Return whether a run passed, the error it reported if any and the first line of its warnings and messages
+def summarize(returncode, output):
+  output = re.sub(r'\x1b\[[0-9;]*m', '', output)
+  error = None
+  m = re.search(r'\*\*\* ERROR \*\*\*\n(.*?)\n\n', output, re.DOTALL)
+  if m:
+    error = m.group(1).strip()
+  messages = re.findall(r'\*\*\* (?:Warning|Info)[^\n]*\n([^\n]*)', output)
+  return (returncode == 0, error, messages)
+
+## Run the arguments in the server, returns the summary of the run
+def runInServer(server, args):
+  request = server.submit(os.getcwd(), args)
+  end = time.time() + TIMEOUT
+  while request.poll() == None:
+    if time.time() > end:
+      print 'ERROR: The server did not answer the request: ' + ' '.join(args)
+      sys.exit(1)
+    select.select([request.fileno()], [], [], 1)
+  if request.crashed:
+    print 'ERROR: The server died running the request: ' + ' '.join(args)
+    sys.exit(1)
+  request.output.seek(0)
+  return summarize(request.returncode, request.output.read())
+
+## Run the arguments in a process of their own, returns the summary of the run
+def runAlone(executable, args):
+  p = subprocess.Popen([executable] + args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+  output = p.communicate()[0]
+  return summarize(p.returncode, output)
+
+def main():
+  os.chdir(os.path.abspath(os.path.dirname(sys.argv[0])))
+  method = os.environ.get('METHOD', 'opt')
+  executable = os.path.join(MOOSE_DIR, 'test', 'moose_test-' + method)
+
+  server = AppServer(executable)
+  differences = 0
+  try:
+    for args in REQUESTS:
+      served = runInServer(server, args)
+      alone = runAlone(executable, args)
+      if served != alone:
+        print ' '.join(args) + ':'
+        print '  server:  passed=%s error=%r messages=%r' % served
+        print '  process: passed=%s error=%r messages=%r' % alone
+        differences += 1
+  finally:
+    server.shutdown()
+    server.process.wait()
+
+  if differences:
+    print 'FAILED: %d of %d requests differ between the server and a process of their own' % (differences, len(REQUESTS))
+    sys.exit(1)
+  print 'OK: %d requests with the same results' % len(REQUESTS)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,54 @@
+# Declares a material property twice on the same block: a warning, an error with --error
+[Mesh]
+  type = GeneratedMesh
+  dim = 2
+  nx = 4
+  ny = 4
+[]
+
+[Variables]
+  [./u]
+  [../]
+[]
+
+[Kernels]
+  [./diff]
+    type = Diffusion
+    variable = u
+  [../]
+[]
+
+[BCs]
+  [./left]
+    type = DirichletBC
+    variable = u
+    boundary = left
+    value = 0
+  [../]
+  [./right]
+    type = DirichletBC
+    variable = u
+    boundary = right
+    value = 1
+  [../]
+[]
+
+[Materials]
+  [./two]
+    type = GenericConstantMaterial
+    prop_names = 'prop'
+    prop_values = '2'
+    block = 0
+  [../]
+  [./one]
+    type = GenericConstantMaterial
+    prop_names = 'prop'
+    prop_values = '1'
+    block = 0
+  [../]
+[]
+
+[Executioner]
+  type = Steady
+  solve_type = 'PJFNK'
+[]
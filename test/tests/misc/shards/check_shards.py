@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# Checks that the shards of a run (run_tests --shard i/N, see TestHarness/Shards.py) agree on
+# where each test goes: every test has to run in exactly one shard, but each shard only sees
+# what is on its own machine.
+#
+# Without --shard-history the shard of a group of tests does not depend on the other groups or
+# the order they are found in. With it, the split does not depend on the order either. Neither
+# the runtime history of the machine a shard runs on nor the tests it does not need to run
+# (passed in the run being resumed, restored from the artifact cache) change the split.
+import os, sys, random
+
+MOOSE_DIR = os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), '..', '..', '..', '..'))
+if os.environ.has_key('MOOSE_DIR'):
+  MOOSE_DIR = os.environ['MOOSE_DIR']
+
+sys.path.append(os.path.join(MOOSE_DIR, 'python'))
+import path_tool
+path_tool.activate_module('TestHarness')
+path_tool.activate_module('FactorySystem')
+import Shards
+from JobDAG import JobDAG
+from RunParallel import RunParallel
+
+## Number of shards the tests are split into
+COUNT = 4
+
+## Groups of tests connected through prereqs, as RunParallel finds them
+GROUPS = [['dir.case%d_setup' % i, 'dir.case%d_use' % i] for i in range(20)] + \
+         [['dir.single%d' % i] for i in range(40)] + \
+         [['dir.recover%d_part1' % i, 'dir.recover%d' % i] for i in range(10)]
+
+## Runtimes of a snapshot of the history, some tests have none
+SNAPSHOT = dict([(name, 1.0 + (i * 7) % 13) for (i, name) in enumerate(sum(GROUPS, [])) if i % 5])
+
+## Return {first name of group : shard} of a partition of groups
+def split(groups, runtime=lambda name: None, typical_runtime=None):
+  return dict([(group[0], shard) for (group, shard) in zip(groups, Shards.partition(groups, COUNT, runtime, typical_runtime))])
+
+## Stand-ins for what RunParallel.selectShard uses of the tester, options and harness
+class Specs(dict):
+  def isValid(self, name):
+    return name in self
+class Tester:
+  def __init__(self, name, prereq):
+    self.specs = Specs(test_name=name, prereq=prereq, max_time=300)
+class Options:
+  shard = None
+  pbs = None
+class Harness:
+  shard_history = None
+  def __init__(self):
+    self.reported = []
+  def handleTestResult(self, specs, output, result, executed=True):
+    self.reported.append(specs['test_name'])
+## A RunParallel holding nothing but a graph of the jobs
+class ShardRunner(RunParallel):
+  def __init__(self, index, history):
+    self.options = Options()
+    self.options.shard = (index, COUNT)
+    self.harness = Harness()
+    self.history = history
+    self.dag = JobDAG()
+    self.skipped_jobs = set()
+    self.finished_jobs = set()
+    self.finished_results = {}
+    self.shards = {}
+class History:
+  def __init__(self, runtimes):
+    self.runtimes = runtimes
+  def getRuntime(self, name):
+    return self.runtimes.get(name)
+  def getTypicalRuntime(self):
+    return sorted(self.runtimes.values())[len(self.runtimes) / 2]
+
+## Return the names of the tests shard index runs and of those it reports without running them,
+# with history being the runtime history of the machine the shard runs on and finished the
+# tests that do not need to run on it
+def runShard(index, history, finished=set()):
+  runner = ShardRunner(index, history)
+  for group in GROUPS:
+    for (i, name) in enumerate(group):
+      if name in finished:
+        runner.run(Tester(name, group[:i]), '', '[RESUMED] OK')
+      else:
+        runner.dag.addJob(Tester(name, group[:i]), '', '')
+  sys.stdout = open(os.devnull, 'w')
+  try:
+    runner.buildGraph()
+  finally:
+    sys.stdout = sys.__stdout__
+  return (set(runner.dag.jobs), runner.harness.reported)
+
+## Return the errors of tests that are not run or reported by exactly one of the shards
+def checkOnce(shards):
+  seen = {}
+  for (index, (run, reported)) in enumerate(shards):
+    for name in list(run) + reported:
+      seen.setdefault(name, []).append(index + 1)
+  return ['%s is handled by shard(s) %s' % (name, seen.get(name, [])) for name in sum(GROUPS, []) if len(seen.get(name, [])) != 1]
+
+def main():
+  errors = []
+  rng = random.Random(42)
+
+  # Without a history: any subset of the groups, in any order
+  full = split(GROUPS)
+  for trial in range(50):
+    subset = rng.sample(GROUPS, rng.randint(1, len(GROUPS)))
+    for (name, shard) in split(subset).iteritems():
+      if shard != full[name]:
+        errors.append('%s moved from shard %d to %d in a subset of %d groups' % (name, full[name], shard, len(subset)))
+
+  # With a snapshot: the groups in any order
+  typical = History(SNAPSHOT).getTypicalRuntime()
+  full = split(GROUPS, SNAPSHOT.get, typical)
+  for trial in range(50):
+    shuffled = list(GROUPS)
+    rng.shuffle(shuffled)
+    if split(shuffled, SNAPSHOT.get, typical) != full:
+      errors.append('The split with a history depends on the order of the groups')
+      break
+
+  # Each shard with the history of its own machine (the timings of its own tests only)
+  shards = []
+  for index in range(1, COUNT + 1):
+    local = History(dict([(name, 100.0 * index) for name in sum(GROUPS, [])[index::COUNT]]))
+    shards.append(runShard(index, local))
+  errors.extend(checkOnce(shards))
+
+  # The first tests of the groups passed in the interrupted run of some of the shards only
+  first = set([group[0] for group in GROUPS if len(group) > 1])
+  shards = [runShard(index, None, [set(), first][index % 2]) for index in range(1, COUNT + 1)]
+  errors.extend(checkOnce(shards))
+
+  if errors:
+    print 'FAILED:\n' + '\n'.join(errors[:20])
+    sys.exit(1)
+  print 'OK: every test is placed in exactly one shard'
+
+if __name__ == '__main__':
+  main()